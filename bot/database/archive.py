@@ -0,0 +1,158 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable
+import logging
+
+from bot.database.backends import create_backend
+from bot.database.migrations import (
+    CALCULATIONS_FTS_SOURCE_SQL, CALCULATIONS_FTS_SQL, CEILING_ESTIMATE_COLUMNS, calculations_fts_rows
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CalculationArchive:
+    """
+    Холодный архив старых расчетов в отдельном файле SQLite
+
+    Схема архива повторяет таблицы calculations, ceiling_estimates
+    и recognitions основной базы, поэтому запросы истории выполняются
+    в архиве без изменений. Все расчеты в архиве старше расчетов
+    в основной базе. У архива свой полнотекстовый индекс calculations_fts,
+    поэтому поиск находит и заархивированные расчеты.
+    """
+
+    def __init__(self, url: str = "sqlite:///bot_archive.db", pool_size: int = 1):
+        self.url = url
+        self.backend = create_backend(url, pool_size=pool_size)
+
+    @property
+    def is_open(self) -> bool:
+        return self.backend.is_open
+
+    async def connect(self):
+        """Открывает архив и создает таблицы, если их еще нет"""
+        if self.backend.is_open:
+            return
+        await self.backend.connect()
+        async with self.backend.acquire() as db:
+            await self._create_tables(db)
+            await db.commit()
+        logger.info(f"Архив расчетов открыт: {self.url}")
+
+    async def close(self):
+        await self.backend.close()
+
+    @asynccontextmanager
+    async def acquire(self, readonly: bool = False) -> AsyncIterator:
+        """Берет соединение с архивом (открывает архив при первом обращении)"""
+        if not self.backend.is_open:
+            await self.connect()
+        async with self.backend.acquire(readonly=readonly) as conn:
+            yield conn
+
+    @staticmethod
+    async def _create_tables(db):
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS recognitions (
+                id INTEGER PRIMARY KEY,
+                digest TEXT UNIQUE NOT NULL,
+                data BLOB NOT NULL,
+                created_at DATETIME
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS calculations (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                calculation_type TEXT NOT NULL,
+                room_type TEXT,
+                room_description TEXT,
+                measurements BLOB,
+                perimeter REAL,
+                area REAL,
+                corners_count INTEGER,
+                recognition_digest TEXT,
+                final_result BLOB,
+                created_at DATETIME
+            )
+        """)
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_calculations_user_created "
+            "ON calculations (user_id, created_at)"
+        )
+        await db.execute(f"""
+            CREATE TABLE IF NOT EXISTS ceiling_estimates (
+                calculation_id INTEGER PRIMARY KEY,
+                {", ".join(CEILING_ESTIMATE_COLUMNS)}
+            )
+        """)
+
+        cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE name = 'calculations_fts'")
+        if await cursor.fetchone() is None:
+            await db.execute(CALCULATIONS_FTS_SQL)
+            # Архив, созданный до появления индекса: индексируем уже перенесенные расчеты
+            await CalculationArchive._index_calculations(db)
+
+    @staticmethod
+    async def _index_calculations(db, ids: list = None):
+        """Добавляет расчеты архива (все или с заданными id) в полнотекстовый индекс"""
+        where, params = "", ()
+        if ids is not None:
+            marks = ", ".join("?" * len(ids))
+            where, params = f"WHERE c.id IN ({marks})", tuple(ids)
+            # Повторная запись пачки не должна дублировать строки индекса
+            await db.execute(f"DELETE FROM calculations_fts WHERE rowid IN ({marks})", params)
+        cursor = await db.execute(f"{CALCULATIONS_FTS_SOURCE_SQL} {where}", params)
+        await db.executemany(
+            "INSERT INTO calculations_fts (rowid, user_id, body) VALUES (?, ?, ?)",
+            calculations_fts_rows(await cursor.fetchall())
+        )
+
+    async def store(self, calculations: Iterable[dict], estimates: Iterable[dict],
+                    recognitions: Iterable[dict]):
+        """
+        Записывает пачку расчетов в архив одной транзакцией
+
+        Уже заархивированные строки пропускаются, поэтому пачку можно
+        записать повторно после сбоя.
+
+        Распознавания приходят из разных шардов, где у них свои id,
+        поэтому в архиве они получают новый id и совпадают только по digest.
+        Расчеты сразу попадают в полнотекстовый индекс архива.
+        """
+        calculations = list(calculations)
+        async with self.acquire() as db:
+            for table, rows, key in (("recognitions", recognitions, "digest"),
+                                     ("calculations", calculations, "id"),
+                                     ("ceiling_estimates", estimates, "calculation_id")):
+                rows = list(rows)
+                if not rows:
+                    continue
+                columns = [column for column in rows[0].keys()
+                           if not (table == "recognitions" and column == "id")]
+                await db.executemany(f"""
+                    INSERT INTO {table} ({", ".join(columns)})
+                    VALUES ({", ".join("?" * len(columns))})
+                    ON CONFLICT ({key}) DO NOTHING
+                """, [tuple(row[column] for column in columns) for row in rows])
+            if calculations:
+                await self._index_calculations(db, [calc['id'] for calc in calculations])
+            await db.commit()
+
+    async def get_user_totals(self, telegram_id: int = None) -> list:
+        """
+        Количество и время последнего расчета в архиве по пользователям
+
+        Returns:
+            Список (telegram_id, количество, время последнего расчета)
+        """
+        where = "WHERE user_id = ?" if telegram_id is not None else ""
+        params = (telegram_id,) if telegram_id is not None else ()
+        async with self.acquire(readonly=True) as db:
+            cursor = await db.execute(f"""
+                SELECT user_id, COUNT(*), MAX(created_at)
+                FROM calculations
+                {where}
+                GROUP BY user_id
+            """, params)
+            return [tuple(row) for row in await cursor.fetchall()]
@@ -0,0 +1,38 @@
+from typing import AsyncContextManager
+
+
+class StorageBackend:
+    """
+    Интерфейс хранилища данных
+
+    Бэкенд владеет пулом соединений и выдает соединения с интерфейсом
+    aiosqlite: execute() / executemany() / commit() / rollback(),
+    курсоры с fetchone() / fetchall() и строки с доступом по индексу
+    и по имени колонки. Параметры запросов пишутся в стиле sqlite3
+    (? или :name) - бэкенд переводит их в свой формат сам.
+    """
+
+    # Диалект SQL: 'sqlite' или 'postgres'
+    dialect: str = ""
+
+    @property
+    def is_open(self) -> bool:
+        """Открыт ли пул соединений"""
+        raise NotImplementedError
+
+    async def connect(self):
+        """Открывает пул соединений"""
+        raise NotImplementedError
+
+    async def close(self):
+        """Закрывает пул соединений"""
+        raise NotImplementedError
+
+    def acquire(self, readonly: bool = False) -> AsyncContextManager:
+        """
+        Берет соединение из пула на время блока async with
+
+        Соединение с readonly=True используется только для чтения,
+        бэкенд может выдать его из отдельного пула.
+        """
+        raise NotImplementedError
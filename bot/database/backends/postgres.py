@@ -0,0 +1,192 @@
+from contextlib import asynccontextmanager
+from datetime import datetime, date
+from functools import lru_cache
+from typing import Any, AsyncIterator, Iterable, List, Optional, Tuple, Union
+import re
+import logging
+
+from bot.database.backends.base import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+try:
+    import asyncpg
+    ASYNCPG_AVAILABLE = True
+except ImportError:
+    ASYNCPG_AVAILABLE = False
+    logger.warning("asyncpg не установлен, хранилище PostgreSQL недоступно")
+
+
+# Строковые литералы, идентификаторы в кавычках, комментарии и параметры.
+# Двоеточие перед именем не должно быть частью приведения типа (::text).
+_PLACEHOLDER_RE = re.compile(
+    r"""('(?:[^']|'')*')|("(?:[^"]|"")*")|(--[^\n]*)|(\?)|(?<!:):([A-Za-z_]\w*)"""
+)
+
+
+@lru_cache(maxsize=512)
+def translate_sql(sql: str) -> Tuple[str, Tuple[Union[int, str], ...]]:
+    """
+    Переводит параметры запроса из стиля sqlite3 (? и :name) в $1, $2, ...
+
+    Returns:
+        Запрос для asyncpg и ключи параметров по порядку:
+        индексы для ? или имена для :name
+    """
+    keys: List[Union[int, str]] = []
+    names = {}
+
+    def replace(match):
+        if match.group(4):
+            keys.append(len(keys))
+            return f"${len(keys)}"
+        name = match.group(5)
+        if name is None:
+            # Литерал или комментарий оставляем как есть
+            return match.group(0)
+        if name not in names:
+            keys.append(name)
+            names[name] = len(keys)
+        return f"${names[name]}"
+
+    translated = _PLACEHOLDER_RE.sub(replace, sql)
+    if any(isinstance(k, int) for k in keys) and any(isinstance(k, str) for k in keys):
+        raise ValueError("Нельзя смешивать параметры ? и :name в одном запросе")
+    return translated, tuple(keys)
+
+
+def _convert_value(value: Any) -> Any:
+    """Приводит значение к виду, в котором его хранит схема бота"""
+    # Даты хранятся текстом, как в SQLite
+    if isinstance(value, datetime):
+        return value.isoformat(" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _bind(keys: Tuple[Union[int, str], ...], params) -> list:
+    """Собирает аргументы запроса в порядке $1, $2, ..."""
+    if not keys:
+        return []
+    if isinstance(keys[0], str):
+        return [_convert_value(params[k]) for k in keys]
+    return [_convert_value(v) for v in params]
+
+
+class PostgresCursor:
+    """Результат запроса с интерфейсом курсора aiosqlite"""
+
+    def __init__(self, rows: list):
+        self._rows = rows
+        self._position = 0
+
+    async def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        row = self._rows[self._position]
+        self._position += 1
+        return row
+
+    async def fetchall(self) -> list:
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+
+class PostgresConnection:
+    """
+    Соединение asyncpg с интерфейсом aiosqlite
+
+    Как и sqlite3, открывает транзакцию перед первым запросом
+    и держит ее до commit() или rollback().
+    """
+
+    def __init__(self, conn: "asyncpg.Connection"):
+        self._conn = conn
+        self._transaction = None
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._transaction is not None
+
+    async def _begin(self):
+        if self._transaction is None:
+            transaction = self._conn.transaction()
+            await transaction.start()
+            self._transaction = transaction
+
+    async def execute(self, sql: str, params: Iterable = ()) -> PostgresCursor:
+        query, keys = translate_sql(sql)
+        await self._begin()
+        rows = await self._conn.fetch(query, *_bind(keys, params))
+        return PostgresCursor(rows)
+
+    async def executemany(self, sql: str, params_seq: Iterable):
+        query, keys = translate_sql(sql)
+        await self._begin()
+        await self._conn.executemany(query, [_bind(keys, params) for params in params_seq])
+
+    async def commit(self):
+        transaction, self._transaction = self._transaction, None
+        if transaction is not None:
+            await transaction.commit()
+
+    async def rollback(self):
+        transaction, self._transaction = self._transaction, None
+        if transaction is not None:
+            await transaction.rollback()
+
+
+class PostgresBackend(StorageBackend):
+    """Хранилище в PostgreSQL с пулом соединений asyncpg"""
+
+    dialect = "postgres"
+
+    def __init__(self, dsn: str, pool_size: int = 4):
+        self.dsn = dsn
+        self.pool_size = max(1, pool_size)
+        self._pool: Optional["asyncpg.Pool"] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._pool is not None
+
+    async def connect(self):
+        """Открывает пул соединений с PostgreSQL"""
+        if self._pool is not None:
+            return
+        if not ASYNCPG_AVAILABLE:
+            raise RuntimeError("Для работы с PostgreSQL установите asyncpg")
+
+        # Подготовленные запросы кэшируются asyncpg в каждом соединении пула
+        self._pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=self.pool_size,
+            max_size=self.pool_size
+        )
+        logger.info(f"Пул соединений с PostgreSQL открыт ({self.pool_size} шт.)")
+
+    async def close(self):
+        """Закрывает пул соединений"""
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            await pool.close()
+            logger.info("Пул соединений с PostgreSQL закрыт")
+
+    @asynccontextmanager
+    async def acquire(self, readonly: bool = False) -> AsyncIterator[PostgresConnection]:
+        """
+        Берет соединение из пула и возвращает его обратно после использования
+
+        PostgreSQL сам разводит конкурентные чтения и записи,
+        поэтому readonly не влияет на выбор соединения.
+        """
+        async with self._pool.acquire() as conn:
+            wrapper = PostgresConnection(conn)
+            try:
+                yield wrapper
+            finally:
+                # Не возвращаем в пул соединение с незавершенной транзакцией
+                if wrapper.in_transaction:
+                    await wrapper.rollback()
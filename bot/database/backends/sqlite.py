@@ -0,0 +1,201 @@
+import aiosqlite
+import asyncio
+import sqlite3
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, AsyncIterator
+import logging
+
+from bot.database.backends.base import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+
+class TuningProfile(NamedTuple):
+    """Набор PRAGMA для соединений SQLite"""
+    journal_mode: str
+    synchronous: str
+    cache_size: int  # Отрицательное значение - размер кэша страниц в КиБ
+    mmap_size: int  # Байт файла, отображаемых в память
+    busy_timeout: int  # Ожидание блокировки, мс
+
+
+TUNING_PROFILES: Dict[str, TuningProfile] = {
+    # WAL: читатели не ждут писателя; NORMAL не теряет целостность при сбое ОС
+    "default": TuningProfile("WAL", "NORMAL", -16000, 128 * 1024 * 1024, 5000),
+    # Каждый коммит сразу на диск
+    "durable": TuningProfile("WAL", "FULL", -8000, 0, 10000),
+    # Больше памяти под кэш страниц и mmap
+    "throughput": TuningProfile("WAL", "NORMAL", -64000, 512 * 1024 * 1024, 5000),
+    # Поведение старых версий бота: журнал отката без mmap
+    "legacy": TuningProfile("DELETE", "FULL", -2000, 0, 5000),
+}
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Хранилище в файле SQLite
+
+    Все записи идут через одно соединение-писатель, поэтому транзакции
+    не соревнуются за блокировку файла. Чтение идет через пул соединений
+    только для чтения: в режиме WAL они не ждут писателя и работают
+    параллельно в своих потоках.
+    """
+
+    dialect = "sqlite"
+
+    def __init__(self, path: str = "bot.db", pool_size: int = 4, profile: str = "default"):
+        if profile not in TUNING_PROFILES:
+            raise ValueError(f"Неизвестный профиль настроек SQLite: {profile}")
+
+        self.path = path
+        self.pool_size = max(1, pool_size)
+        self.profile_name = profile
+        self.profile = TUNING_PROFILES[profile]
+
+        self._writer: Optional[asyncio.Queue] = None
+        self._readers: Optional[asyncio.Queue] = None
+        self._connections: list = []
+        self._pool_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    @property
+    def _in_memory(self) -> bool:
+        return self.path == ":memory:" or self.path.startswith("file::memory:")
+
+    async def _open(self, readonly: bool) -> aiosqlite.Connection:
+        """Открывает соединение и применяет профиль настроек"""
+        if readonly:
+            uri = f"{Path(self.path).resolve().as_uri()}?mode=ro"
+            conn = await aiosqlite.connect(uri, uri=True)
+        else:
+            conn = await aiosqlite.connect(self.path)
+            # Для новой базы: свободные страницы можно отдавать по частям
+            # (PRAGMA incremental_vacuum); на существующую базу не влияет
+            await conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._connections.append(conn)
+        conn.row_factory = aiosqlite.Row
+
+        profile = self.profile
+        # Ждем освобождения блокировки вместо мгновенной ошибки
+        await conn.execute(f"PRAGMA busy_timeout = {profile.busy_timeout}")
+        await conn.execute(f"PRAGMA cache_size = {profile.cache_size}")
+        await conn.execute(f"PRAGMA mmap_size = {profile.mmap_size}")
+        if not readonly:
+            # Режим журнала хранится в файле базы, его меняет только писатель
+            await conn.execute(f"PRAGMA journal_mode = {profile.journal_mode}")
+            await conn.execute(f"PRAGMA synchronous = {profile.synchronous}")
+        return conn
+
+    async def connect(self):
+        """Открывает соединение-писатель и пул соединений для чтения"""
+        async with self._pool_lock:
+            if self._writer is not None:
+                return
+
+            writer, readers = asyncio.Queue(), asyncio.Queue()
+            try:
+                # Писатель открываем первым: он создает файл и включает WAL
+                writer.put_nowait(await self._open(readonly=False))
+                # Базу в памяти другие соединения не видят - читаем через писателя
+                if not self._in_memory:
+                    for _ in range(self.pool_size):
+                        readers.put_nowait(await self._open(readonly=True))
+            except Exception:
+                await self._close_connections()
+                raise
+
+            self._writer = writer
+            self._readers = readers if not readers.empty() else None
+            logger.info(
+                f"SQLite открыт: 1 писатель, {readers.qsize()} читателей, "
+                f"профиль {self.profile_name}"
+            )
+
+    async def close(self):
+        """Закрывает все соединения"""
+        async with self._pool_lock:
+            if self._writer is None:
+                return
+            self._writer = self._readers = None
+            await self._close_connections()
+            logger.info("Соединения с SQLite закрыты")
+
+    async def _close_connections(self):
+        """Закрывает открытые соединения"""
+        connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                await conn.close()
+            except Exception as e:
+                logger.error(f"Ошибка при закрытии соединения с БД: {e}")
+
+    @asynccontextmanager
+    async def acquire(self, readonly: bool = False) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Берет соединение и возвращает его обратно после использования
+
+        Args:
+            readonly: Соединение только для чтения из пула читателей;
+                иначе - единственный писатель (запросы к нему идут по очереди)
+        """
+        pool = self._readers if readonly and self._readers is not None else self._writer
+        conn = await pool.get()
+        try:
+            yield conn
+        except BaseException:
+            # Не возвращаем в пул соединение с незавершенной транзакцией
+            if conn.in_transaction:
+                await conn.rollback()
+            raise
+        finally:
+            pool.put_nowait(conn)
+
+    async def backup(self, target_path: str, pages: int = 256, sleep: float = 0.05,
+                     max_restarts: int = 3):
+        """
+        Онлайн-копия базы через sqlite3 backup API
+
+        Страницы копируются пачками по pages штук с паузой sleep между ними
+        в отдельном соединении только для чтения: писатель и читатели пула
+        продолжают работать, а цикл событий не блокируется.
+
+        Запись в базу во время копирования перезапускает копирование с начала.
+        Если это случилось больше max_restarts раз, база копируется за один
+        шаг: в режиме WAL это одна транзакция чтения, писатель ее не ждет.
+        """
+        if self._in_memory:
+            raise ValueError("База в памяти не поддерживает резервное копирование")
+
+        uri = f"{Path(self.path).resolve().as_uri()}?mode=ro"
+        source = await aiosqlite.connect(uri, uri=True)
+        # Целевое соединение используется из потока источника
+        target = sqlite3.connect(target_path, check_same_thread=False)
+        restarts = 0
+        last_remaining = None
+
+        def progress(status, remaining, total):
+            nonlocal restarts, last_remaining
+            if last_remaining is not None and remaining > last_remaining:
+                restarts += 1
+                if restarts > max_restarts:
+                    raise _BackupRestarted()
+            last_remaining = remaining
+
+        try:
+            await source.execute(f"PRAGMA busy_timeout = {self.profile.busy_timeout}")
+            try:
+                await source.backup(target, pages=pages, progress=progress, sleep=sleep)
+            except _BackupRestarted:
+                logger.info(f"Копирование {self.path} перезапускалось {restarts} раз, копируем за один шаг")
+                await source.backup(target, pages=-1)
+        finally:
+            await source.close()
+            target.close()
+
+
+class _BackupRestarted(Exception):
+    """Копирование базы слишком часто перезапускается из-за записи"""
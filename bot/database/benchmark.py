@@ -0,0 +1,251 @@
+"""
+Нагрузочный тест базы данных бота
+
+Гоняет N одновременных пользователей по той же последовательности
+вызовов Database, что и сценарии бота, и печатает JSON с пропускной
+способностью и задержками (p50/p95/p99) по каждому методу.
+
+    python -m bot.database.benchmark --users 50 --sessions 5 --rooms 3
+    python -m bot.database.benchmark --url sqlite:////tmp/bench.db --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List
+import logging
+
+from bot.database.models import Database
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# telegram_id симулируемых пользователей начинаются отсюда
+FIRST_USER_ID = 10_000_000
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Перцентиль по методу ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(percent / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class LatencyRecorder:
+    """Собирает задержки вызовов по методам"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    async def call(self, name: str, coro):
+        started = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.samples[name].append(time.perf_counter() - started)
+
+    def report(self, elapsed: float) -> dict:
+        methods = {}
+        for name, values in sorted(self.samples.items()):
+            methods[name] = {
+                'count': len(values),
+                'ops_per_sec': round(len(values) / elapsed, 1) if elapsed else 0.0,
+                'p50_ms': round(percentile(values, 50) * 1000, 3),
+                'p95_ms': round(percentile(values, 95) * 1000, 3),
+                'p99_ms': round(percentile(values, 99) * 1000, 3),
+                'max_ms': round(max(values) * 1000, 3)
+            }
+        return methods
+
+
+def make_room(rng: random.Random, index: int) -> dict:
+    """Данные одной комнаты, похожие на результат распознавания и расчета"""
+    walls = [round(rng.uniform(1.5, 6.0), 2) for _ in range(rng.choice((4, 4, 4, 6, 8)))]
+    perimeter = round(sum(walls), 2)
+    area = round(walls[0] * walls[1], 2)
+    return {
+        'room_type': rng.choice(('bedroom', 'kitchen', 'living', 'bathroom')),
+        'room_description': f"Комната {index + 1}",
+        'measurements': walls,
+        'perimeter': perimeter,
+        'area': area,
+        'corners_count': len(walls),
+        'recognized_data': {
+            'measurements': walls,
+            'corners': len(walls),
+            'confidence': round(rng.uniform(0.7, 1.0), 2),
+            'notes': "Размеры распознаны по фото чертежа"
+        },
+        'final_result': {
+            'perimeter': perimeter,
+            'area': area,
+            'profile_meters': round(perimeter * 1.1, 2),
+            'items': [{'name': f"Позиция {i}", 'quantity': rng.randint(1, 40)} for i in range(6)]
+        },
+        'profile_type': 'standard',
+        'profile_quantity': round(perimeter / 2.5 + 1),
+        'dowel_nails_count': int(perimeter / 0.2),
+        'lighting_type': 'spots',
+        'lighting_data': {'spots': rng.randint(2, 12)},
+        'fastener_type': 'dowel',
+        'total_hangers': rng.randint(4, 30)
+    }
+
+
+async def simulate_user(db: Database, recorder: LatencyRecorder, telegram_id: int,
+                        sessions: int, rooms: int, seed: int):
+    """
+    Один пользователь: несколько сессий расчета, как в обработчиках бота
+
+    Каждый четвертый пользователь (в среднем) на бесплатном тарифе: часть
+    его расчетов упирается в лимит, а история ему недоступна.
+    """
+    rng = random.Random(seed)
+    subscriber = rng.random() >= 0.25
+    for _ in range(sessions):
+        # /start
+        user = await recorder.call('get_user', db.get_user(telegram_id))
+        if not user:
+            await recorder.call('create_user', db.create_user(telegram_id, f"user{telegram_id}", "Bench"))
+            if subscriber:
+                await recorder.call('update_user_subscription', db.update_user_subscription(
+                    telegram_id, 'pro', datetime.now() + timedelta(days=30)
+                ))
+
+        # Начало расчета: атомарное резервирование из лимита тарифа
+        allowed, _ = await recorder.call('reserve_calculation', db.reserve_calculation(telegram_id))
+        if allowed:
+            # Расчет по комнатам
+            for index in range(rooms):
+                room = make_room(rng, index)
+                await recorder.call('save_calculation', db.save_calculation(telegram_id, 'ceiling', **room))
+
+        # Просмотр истории: первая страница и, если есть, следующая
+        subscription = await recorder.call('get_active_subscription', db.get_active_subscription(telegram_id))
+        if subscription in (None, 'free'):
+            continue
+        page = await recorder.call('get_calculation_history', db.get_calculation_history(
+            telegram_id, limit=settings.HISTORY_PAGE_SIZE
+        ))
+        if page['older_cursor']:
+            await recorder.call('get_calculation_history', db.get_calculation_history(
+                telegram_id, limit=settings.HISTORY_PAGE_SIZE, before=page['older_cursor']
+            ))
+
+
+async def run_benchmark(users: int = 50, sessions: int = 5, rooms: int = 3,
+                        url: str = None, pool_size: int = 4,
+                        write_flush_interval: float = 0.05, write_batch_size: int = 100,
+                        cache_size: int = 10000, sqlite_profile: str = "default", shards: int = 1,
+                        seed: int = 1) -> dict:
+    """
+    Запускает нагрузочный тест и возвращает отчет
+
+    Без url база создается во временном каталоге и удаляется после теста.
+    """
+    workdir = None
+    if url is None:
+        workdir = tempfile.mkdtemp(prefix="bot-bench-")
+        url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    db = Database(
+        url=url,
+        pool_size=pool_size,
+        write_flush_interval=write_flush_interval,
+        write_batch_size=write_batch_size,
+        cache_size=cache_size,
+        sqlite_profile=sqlite_profile,
+        shards=shards
+    )
+    recorder = LatencyRecorder()
+    try:
+        await db.connect()
+        await db.create_tables()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            simulate_user(db, recorder, FIRST_USER_ID + i, sessions, rooms, seed + i)
+            for i in range(users)
+        ))
+        # Отложенные записи тоже входят в стоимость нагрузки
+        await recorder.call('drain_writes', db.flush_writes())
+        elapsed = time.perf_counter() - started
+    finally:
+        await db.close()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    total_ops = sum(len(values) for values in recorder.samples.values())
+    return {
+        'config': {
+            'users': users,
+            'sessions': sessions,
+            'rooms': rooms,
+            'dialect': db.dialect,
+            'pool_size': pool_size,
+            'write_flush_interval': write_flush_interval,
+            'write_batch_size': write_batch_size,
+            'cache_size': cache_size,
+            'sqlite_profile': sqlite_profile,
+            'shards': shards
+        },
+        'total': {
+            'ops': total_ops,
+            'seconds': round(elapsed, 3),
+            'ops_per_sec': round(total_ops / elapsed, 1) if elapsed else 0.0
+        },
+        'methods': recorder.report(elapsed),
+        'cache': db.cache_stats(),
+        'writes': db.write_stats()
+    }
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест базы данных бота")
+    parser.add_argument("--users", type=int, default=50, help="Одновременных пользователей")
+    parser.add_argument("--sessions", type=int, default=5, help="Сессий расчета на пользователя")
+    parser.add_argument("--rooms", type=int, default=3, help="Комнат в одном расчете")
+    parser.add_argument("--url", default=None, help="Адрес базы (по умолчанию - временный SQLite)")
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--flush-interval-ms", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--cache-size", type=int, default=10000)
+    parser.add_argument("--profile", default="default", help="Профиль PRAGMA для SQLite")
+    parser.add_argument("--shards", type=int, default=1, help="Количество шардов SQLite")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="Файл для JSON-отчета")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    report = asyncio.run(run_benchmark(
+        users=args.users,
+        sessions=args.sessions,
+        rooms=args.rooms,
+        url=args.url,
+        pool_size=args.pool_size,
+        write_flush_interval=args.flush_interval_ms / 1000,
+        write_batch_size=args.batch_size,
+        cache_size=args.cache_size,
+        sqlite_profile=args.profile,
+        shards=args.shards,
+        seed=args.seed
+    ))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+from typing import Any, Dict, Optional, Union
+import json
+import zlib
+
+
+class BlobCodec:
+    """
+    Базовый класс кодека для JSON-полей
+
+    Закодированное значение начинается с байта версии кодека,
+    по которому decode() выбирает нужный кодек при чтении.
+    """
+
+    version: int = 0
+
+    def encode(self, value: Any) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, payload: bytes) -> Any:
+        raise NotImplementedError
+
+
+class CompactJSONCodec(BlobCodec):
+    """Компактный JSON без пробелов (для маленьких значений)"""
+
+    version = 1
+
+    def encode(self, value: Any) -> bytes:
+        return dumps(value).encode("utf-8")
+
+    def decode(self, payload: bytes) -> Any:
+        return json.loads(payload.decode("utf-8"))
+
+
+class ZlibJSONCodec(CompactJSONCodec):
+    """Компактный JSON, сжатый zlib"""
+
+    version = 2
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def encode(self, value: Any) -> bytes:
+        return zlib.compress(super().encode(value), self.level)
+
+    def decode(self, payload: bytes) -> Any:
+        return super().decode(zlib.decompress(payload))
+
+
+# Зарегистрированные кодеки по байту версии
+CODECS: Dict[int, BlobCodec] = {}
+
+# Значения меньше этого размера не сжимаем - выигрыш съедает заголовок zlib
+COMPRESS_THRESHOLD = 256
+
+
+def register_codec(codec: BlobCodec):
+    """Регистрирует кодек для чтения и записи"""
+    if not 0 < codec.version < 256:
+        raise ValueError(f"Недопустимая версия кодека: {codec.version}")
+    CODECS[codec.version] = codec
+
+
+register_codec(CompactJSONCodec())
+register_codec(ZlibJSONCodec())
+
+
+def dumps(value: Any) -> str:
+    """Каноничное компактное JSON-представление значения"""
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def encode(value: Any) -> Optional[bytes]:
+    """
+    Кодирует значение в компактный бинарный вид
+
+    Returns:
+        Байт версии + данные, или None для пустого значения
+    """
+    if value is None:
+        return None
+
+    plain = CODECS[CompactJSONCodec.version].encode(value)
+    if len(plain) >= COMPRESS_THRESHOLD:
+        compressed = CODECS[ZlibJSONCodec.version].encode(value)
+        if len(compressed) < len(plain):
+            return bytes([ZlibJSONCodec.version]) + compressed
+
+    return bytes([CompactJSONCodec.version]) + plain
+
+
+def decode(raw: Union[bytes, str, None]) -> Any:
+    """
+    Декодирует значение из базы
+
+    Строки считаются JSON-текстом из старых версий бота,
+    байты - значением с байтом версии кодека.
+    """
+    if raw is None:
+        return None
+
+    if isinstance(raw, str):
+        return json.loads(raw)
+
+    codec = CODECS.get(raw[0])
+    if codec is None:
+        raise ValueError(f"Неизвестная версия кодека: {raw[0]}")
+    return codec.decode(bytes(raw[1:]))
+
+
+def is_legacy(raw: Union[bytes, str, None]) -> bool:
+    """Хранится ли значение в старом текстовом формате"""
+    return isinstance(raw, str)
@@ -0,0 +1,83 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+BatchFunc = Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]]
+
+
+class BatchLoader:
+    """
+    Объединяет одновременные запросы по ключам в один пакетный запрос
+
+    Все load(), вызванные за один проход цикла событий, собираются
+    в пачку и выполняются одним вызовом batch_func; повторные ключи
+    в пачке запрашиваются один раз. Пачка уже отправленного запроса
+    не переиспользуется, поэтому запись, закоммиченная до load(),
+    всегда видна в результате.
+    """
+
+    def __init__(self, batch_func: BatchFunc, max_batch: int = 500):
+        self.batch_func = batch_func
+        self.max_batch = max(1, max_batch)
+
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+        self._scheduled = False
+        self._tasks: set = set()
+
+        # Статистика
+        self.loads = 0
+        self.batches = 0
+
+    async def load(self, key: Hashable) -> Any:
+        """Возвращает значение по ключу (None, если batch_func его не вернула)"""
+        self.loads += 1
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[key] = future
+            if len(self._pending) >= self.max_batch:
+                self._dispatch()
+            elif not self._scheduled:
+                self._scheduled = True
+                loop.call_soon(self._dispatch)
+
+        # Отмена одного ожидающего не должна отменять запрос для остальных
+        return await asyncio.shield(future)
+
+    def _dispatch(self):
+        """Отправляет накопленную пачку"""
+        self._scheduled = False
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        self.batches += 1
+
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: Dict[Hashable, asyncio.Future]):
+        try:
+            results = await self.batch_func(list(batch))
+        except asyncio.CancelledError:
+            for future in batch.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            # Ошибку получает каждый, кто ждал ключ из этой пачки
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key))
+
+    def stats(self) -> dict:
+        """Сколько запросов пришлось на один пакетный запрос"""
+        return {
+            'loads': self.loads,
+            'batches': self.batches,
+            'loads_per_batch': self.loads / self.batches if self.batches else 0.0
+        }
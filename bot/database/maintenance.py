@@ -0,0 +1,271 @@
+"""
+Обслуживание файлов SQLite: резервные копии, incremental vacuum, ANALYZE
+
+Разовый перевод старых файлов в auto_vacuum=INCREMENTAL (бот нужно
+остановить, файл переписывается целиком):
+
+    python -m bot.database.maintenance enable-incremental-vacuum [ФАЙЛ ...]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import logging
+
+from bot.database.backends import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseMaintenance:
+    """
+    Обслуживание файлов SQLite без остановки бота
+
+    - резервные копии через backup API небольшими пачками страниц
+      (хранится keep_backups последних копий каждого файла);
+    - PRAGMA incremental_vacuum - возврат свободных страниц частями,
+      чтобы писатель занимался этим не дольше одного короткого шага;
+    - ANALYZE с ограничением analysis_limit - свежая статистика
+      для планировщика запросов.
+
+    Файлы, созданные до включения auto_vacuum, incremental vacuum
+    пропускает: их разово переводит enable_incremental_vacuum().
+
+    Время и результат последнего запуска каждой операции доступны
+    через status().
+    """
+
+    def __init__(self, backends: List[Tuple[str, StorageBackend]], backup_dir: Optional[str] = "backups",
+                 keep_backups: int = 7, backup_pages: int = 256, backup_sleep: float = 0.05,
+                 vacuum_pages: int = 500, analysis_limit: int = 1000):
+        # Обслуживаются только файлы SQLite: (имя, хранилище)
+        self.backends = [(name, backend) for name, backend in backends if backend.dialect == 'sqlite']
+        self.backup_dir = backup_dir
+        self.keep_backups = max(1, keep_backups)
+        self.backup_pages = backup_pages
+        self.backup_sleep = backup_sleep
+        self.vacuum_pages = vacuum_pages
+        self.analysis_limit = analysis_limit
+
+        # {операция: {'started_at', 'seconds', 'result' | 'error'}}
+        self._status: Dict[str, dict] = {}
+
+    def status(self) -> Dict[str, dict]:
+        """Последний запуск каждой операции обслуживания"""
+        return {task: dict(info) for task, info in self._status.items()}
+
+    async def _timed(self, task: str, coro):
+        """Выполняет операцию и запоминает время и результат запуска"""
+        started_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        started = time.perf_counter()
+        try:
+            result = await coro
+        except Exception as e:
+            logger.error(f"Ошибка обслуживания БД ({task}): {e}")
+            self._status[task] = {
+                'started_at': started_at,
+                'seconds': round(time.perf_counter() - started, 3),
+                'error': str(e)
+            }
+            return None
+
+        self._status[task] = {
+            'started_at': started_at,
+            'seconds': round(time.perf_counter() - started, 3),
+            'result': result
+        }
+        logger.info(f"Обслуживание БД ({task}) за {self._status[task]['seconds']} с: {result}")
+        return result
+
+    async def backup(self) -> Optional[dict]:
+        """Делает резервную копию всех файлов: {имя: путь к копии}"""
+        if not self.backup_dir:
+            return None
+        return await self._timed('backup', self._backup_all())
+
+    async def _backup_all(self) -> dict:
+        directory = Path(self.backup_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+
+        paths = {}
+        for name, backend in self.backends:
+            path = directory / f"{name}-{stamp}.db"
+            partial = path.with_suffix(".db.part")
+            # Копия появляется под своим именем только целиком
+            await backend.backup(str(partial), pages=self.backup_pages, sleep=self.backup_sleep)
+            os.replace(partial, path)
+            paths[name] = str(path)
+            self._prune_backups(directory, name)
+        return paths
+
+    def _prune_backups(self, directory: Path, name: str):
+        """Удаляет старые копии файла сверх keep_backups"""
+        # Метка времени в имени сортируется как строка
+        backups = sorted(directory.glob(f"{name}-*.db"))
+        for old in backups[:-self.keep_backups]:
+            try:
+                old.unlink()
+            except OSError as e:
+                logger.warning(f"Не удалось удалить старую копию {old}: {e}")
+
+    async def vacuum(self) -> dict:
+        """Возвращает свободные страницы файлов: {имя: освобождено страниц}"""
+        return await self._timed('vacuum', self._vacuum_all())
+
+    async def _vacuum_all(self) -> dict:
+        freed = {}
+        for name, backend in self.backends:
+            freed[name] = 0
+            async with backend.acquire(readonly=True) as db:
+                cursor = await db.execute("PRAGMA auto_vacuum")
+                mode = (await cursor.fetchone())[0]
+            if mode != 2:
+                # Режим INCREMENTAL включается только полным VACUUM - на ходу его
+                # не делаем, см. enable_incremental_vacuum
+                logger.info(
+                    f"{name}: auto_vacuum не INCREMENTAL, файл пропущен "
+                    f"(python -m bot.database.maintenance enable-incremental-vacuum)"
+                )
+                continue
+
+            while True:
+                # Короткие шаги: между ними писатель свободен для записей бота
+                async with backend.acquire() as db:
+                    cursor = await db.execute("PRAGMA freelist_count")
+                    free = (await cursor.fetchone())[0]
+                    if not free:
+                        break
+                    # executescript доводит PRAGMA до конца: execute освобождает
+                    # только одну страницу за шаг
+                    await db.executescript(f"PRAGMA incremental_vacuum({min(free, self.vacuum_pages)})")
+                    cursor = await db.execute("PRAGMA freelist_count")
+                    left = (await cursor.fetchone())[0]
+                freed[name] += free - left
+                if left >= free:
+                    break
+                await asyncio.sleep(0)
+        return freed
+
+    async def analyze(self) -> list:
+        """Обновляет статистику планировщика запросов: [имена файлов]"""
+        return await self._timed('analyze', self._analyze_all())
+
+    async def _analyze_all(self) -> list:
+        names = []
+        for name, backend in self.backends:
+            async with backend.acquire() as db:
+                # Ограничение выборки держит ANALYZE коротким на больших таблицах
+                await db.execute(f"PRAGMA analysis_limit = {int(self.analysis_limit)}")
+                await db.execute("ANALYZE")
+                await db.commit()
+            names.append(name)
+        return names
+
+    async def run(self, backup_interval: float = 6 * 3600, vacuum_interval: float = 24 * 3600,
+                  analyze_interval: float = 24 * 3600, tick: float = 60):
+        """Периодически выполняет обслуживание (запускается через run_in_background)"""
+        schedule = [
+            [self.backup, backup_interval, 0.0],
+            [self.vacuum, vacuum_interval, 0.0],
+            [self.analyze, analyze_interval, 0.0],
+        ]
+        while True:
+            now = time.monotonic()
+            for entry in schedule:
+                task, interval, due = entry
+                if interval > 0 and now >= due:
+                    await task()
+                    entry[2] = time.monotonic() + interval
+            await asyncio.sleep(tick)
+
+
+def enable_incremental_vacuum(path: str) -> bool:
+    """
+    Разовый перевод файла SQLite в режим auto_vacuum=INCREMENTAL
+
+    Режим меняется только полным VACUUM вне режима WAL: файл переписывается
+    целиком, на это нужно до двух его размеров свободного места. Переход
+    из WAL требует, чтобы других соединений не было, поэтому при запущенном
+    боте перевод завершится ошибкой "database is locked".
+
+    Returns:
+        True, если файл переведен; False, если он уже в этом режиме
+    """
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if mode == 2:
+            logger.info(f"{path}: уже auto_vacuum=INCREMENTAL")
+            return False
+
+        size = os.path.getsize(path)
+        free = shutil.disk_usage(os.path.dirname(os.path.abspath(path))).free
+        logger.info(
+            f"{path}: {size / 1024 / 1024:.1f} МБ, свободно на диске "
+            f"{free / 1024 / 1024:.1f} МБ - полный VACUUM..."
+        )
+        if free < 2 * size:
+            raise RuntimeError(f"Для VACUUM {path} нужно не меньше {2 * size} байт свободного места")
+
+        started = time.perf_counter()
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        # В режиме WAL VACUUM не меняет auto_vacuum
+        if conn.execute("PRAGMA journal_mode = DELETE").fetchone()[0].lower() != "delete":
+            raise RuntimeError(f"Не удалось выйти из режима {journal_mode}: файл открыт ботом?")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+        logger.info(f"{path}: переведен в auto_vacuum=INCREMENTAL за {time.perf_counter() - started:.1f} с")
+        return True
+    finally:
+        conn.close()
+
+
+def configured_sqlite_files() -> list:
+    """Файлы SQLite из настроек бота: основная база и шарды, архив, кэш распознавания"""
+    from config.settings import settings
+    from bot.database.sharding import shard_urls
+
+    urls = []
+    if settings.DATABASE_URL.lower().startswith("sqlite"):
+        urls.extend(shard_urls(settings.DATABASE_URL, settings.DATABASE_SHARDS))
+    urls.extend(url for url in (settings.ARCHIVE_DATABASE_URL, settings.RECOGNITION_CACHE_URL)
+                if url and url.lower().startswith("sqlite"))
+
+    paths = []
+    for url in urls:
+        # sqlite:///bot.db -> bot.db, sqlite:////abs/bot.db -> /abs/bot.db
+        rest = url.partition("://")[2]
+        path = rest[1:] if rest.startswith("/") else rest
+        if path and path != ":memory:" and os.path.exists(path):
+            paths.append(path)
+    return paths
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Обслуживание файлов SQLite бота")
+    parser.add_argument("command", choices=["enable-incremental-vacuum"])
+    parser.add_argument("files", nargs="*", help="Файлы SQLite (по умолчанию - все из настроек бота)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    paths = args.files or configured_sqlite_files()
+    failed = False
+    for path in paths:
+        try:
+            enable_incremental_vacuum(path)
+        except (sqlite3.Error, RuntimeError, OSError) as e:
+            logger.error(f"{path}: не удалось перевести в auto_vacuum=INCREMENTAL: {e}")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,655 @@
+import aiosqlite
+import hashlib
+from typing import Callable, Awaitable, Dict, List, Tuple
+import logging
+
+from bot.database import codec
+from bot.database.search import search_text
+
+logger = logging.getLogger(__name__)
+
+MigrationFunc = Callable[[aiosqlite.Connection], Awaitable[None]]
+
+# Упорядоченные списки миграций по диалектам: (версия, описание, функция)
+MIGRATIONS: Dict[str, List[Tuple[int, str, MigrationFunc]]] = {
+    "sqlite": [],
+    "postgres": [],
+}
+
+# Таблица версий схемы в каждом диалекте
+_SCHEMA_VERSION_DDL = {
+    "sqlite": """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    "postgres": """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT now()
+        )
+    """,
+}
+
+# Запрос, с которого начинается транзакция миграции: он же не дает
+# двум процессам применять миграции одновременно
+_MIGRATION_LOCK = {
+    "sqlite": "BEGIN IMMEDIATE",
+    "postgres": "SELECT pg_advisory_xact_lock(74201)",
+}
+
+
+def migration(version: int, description: str, dialect: str = "sqlite"):
+    """Регистрирует функцию как шаг миграции схемы"""
+    def decorator(func: MigrationFunc) -> MigrationFunc:
+        migrations = MIGRATIONS[dialect]
+        if any(v == version for v, _, _ in migrations):
+            raise ValueError(f"Миграция версии {version} ({dialect}) уже зарегистрирована")
+        migrations.append((version, description, func))
+        migrations.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+async def get_table_columns(db: aiosqlite.Connection, table: str) -> set:
+    """Возвращает множество имен колонок таблицы"""
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in await cursor.fetchall()}
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    """Возвращает текущую версию схемы (0 для пустой базы)"""
+    cursor = await db.execute("SELECT MAX(version) FROM schema_version")
+    row = await cursor.fetchone()
+    return row[0] or 0
+
+
+def latest_version(dialect: str = "sqlite") -> int:
+    """Версия схемы после применения всех миграций"""
+    migrations = MIGRATIONS[dialect]
+    return migrations[-1][0] if migrations else 0
+
+
+async def apply_migrations(db: aiosqlite.Connection, dialect: str = "sqlite") -> int:
+    """
+    Применяет недостающие миграции по порядку
+
+    Каждая миграция выполняется в отдельной транзакции вместе с записью
+    в schema_version, поэтому прерванный запуск не оставляет схему
+    в промежуточном состоянии.
+
+    Returns:
+        Версия схемы после применения миграций
+    """
+    await db.execute(_SCHEMA_VERSION_DDL[dialect])
+    current = await get_schema_version(db)
+    await db.commit()
+
+    target = latest_version(dialect)
+    if current >= target:
+        # Схема актуальна - ничего не делаем
+        return current
+
+    for version, description, func in MIGRATIONS[dialect]:
+        if version <= current:
+            continue
+
+        await db.execute(_MIGRATION_LOCK[dialect])
+        try:
+            # Другой процесс мог успеть применить миграцию
+            if await get_schema_version(db) >= version:
+                await db.rollback()
+                continue
+
+            await func(db)
+            await db.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            logger.error(f"Ошибка применения миграции {version}: {description}")
+            raise
+
+        logger.info(f"Применена миграция {version}: {description}")
+        current = version
+
+    return current
+
+
+# ========== МИГРАЦИИ ==========
+
+@migration(1, "Базовые таблицы users, calculations, payments")
+async def _create_base_tables(db: aiosqlite.Connection):
+    # Таблица пользователей
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            subscription_type TEXT DEFAULT 'unlimited',
+            subscription_expires DATETIME,
+            daily_calculations INTEGER DEFAULT 0,
+            last_calculation_date DATE,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Таблица расчетов
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS calculations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            calculation_type TEXT NOT NULL,
+            room_type TEXT,
+            room_description TEXT,
+            measurements TEXT,
+            perimeter REAL,
+            area REAL,
+            corners_count INTEGER DEFAULT 4,
+            recognized_data TEXT,
+            final_result TEXT,
+
+            -- Этап 2: Профиль
+            profile_type TEXT,
+            profile_quantity REAL,
+            dowel_nails_count INTEGER,
+
+            -- Этап 3: Освещение
+            lighting_type TEXT,
+            lighting_data TEXT,  -- JSON с параметрами освещения
+
+            -- Этап 4: Ниши под шторы
+            curtain_niche_needed BOOLEAN DEFAULT FALSE,
+            curtain_niche_type TEXT,
+            curtain_niche_meters REAL,
+            curtain_ends_count INTEGER,
+            curtain_tape_meters REAL,
+            curtain_brackets_count INTEGER,
+            curtain_screws_count INTEGER,
+
+            -- Этап 5: Дополнительные элементы
+            timber_needed BOOLEAN DEFAULT FALSE,
+            timber_meters REAL,
+            timber_brackets_count INTEGER,
+
+            -- Этап 6: Крепеж
+            fastener_type TEXT,
+
+            -- Итоговые расчеты
+            total_hangers INTEGER,
+            total_dowels INTEGER,
+            total_screws INTEGER,
+            glue_volume REAL,
+
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (telegram_id)
+        )
+    """)
+
+    # Таблица платежей
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            payment_id TEXT UNIQUE NOT NULL,
+            plan_type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            status TEXT DEFAULT 'pending',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (telegram_id)
+        )
+    """)
+
+
+# Колонки, которых может не быть в базах, созданных старыми версиями бота
+_LEGACY_CALCULATION_COLUMNS = [
+    ("room_type", "TEXT"),
+    ("room_description", "TEXT"),
+    ("measurements", "TEXT"),
+    ("perimeter", "REAL"),
+    ("area", "REAL"),
+    ("corners_count", "INTEGER DEFAULT 4"),
+    ("recognized_data", "TEXT"),
+    ("final_result", "TEXT"),
+    ("profile_type", "TEXT"),
+    ("profile_quantity", "REAL"),
+    ("dowel_nails_count", "INTEGER"),
+    ("lighting_type", "TEXT"),
+    ("lighting_data", "TEXT"),
+    ("curtain_niche_needed", "BOOLEAN DEFAULT FALSE"),
+    ("curtain_niche_type", "TEXT"),
+    ("curtain_niche_meters", "REAL"),
+    ("curtain_ends_count", "INTEGER"),
+    ("curtain_tape_meters", "REAL"),
+    ("curtain_brackets_count", "INTEGER"),
+    ("curtain_screws_count", "INTEGER"),
+    ("timber_needed", "BOOLEAN DEFAULT FALSE"),
+    ("timber_meters", "REAL"),
+    ("timber_brackets_count", "INTEGER"),
+    ("fastener_type", "TEXT"),
+    ("total_hangers", "INTEGER"),
+    ("total_dowels", "INTEGER"),
+    ("total_screws", "INTEGER"),
+    ("glue_volume", "REAL"),
+]
+
+
+@migration(2, "Недостающие колонки calculations в старых базах")
+async def _add_legacy_calculation_columns(db: aiosqlite.Connection):
+    existing = await get_table_columns(db, "calculations")
+    for column, column_type in _LEGACY_CALCULATION_COLUMNS:
+        if column not in existing:
+            await db.execute(f"ALTER TABLE calculations ADD COLUMN {column} {column_type}")
+
+
+@migration(3, "Индексы для истории расчетов и платежей")
+async def _create_history_indexes(db: aiosqlite.Connection):
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_calculations_user_created "
+        "ON calculations (user_id, created_at)"
+    )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_payments_user_status "
+        "ON payments (user_id, status)"
+    )
+    # payment_id уже UNIQUE, но в старых базах ограничения могло не быть
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_payments_payment_id "
+        "ON payments (payment_id)"
+    )
+
+
+@migration(4, "Счетчики использования по периодам (день/месяц)")
+async def _create_usage_counters(db: aiosqlite.Connection):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS usage_counters (
+            telegram_id INTEGER NOT NULL,
+            period_kind TEXT NOT NULL,  -- 'day' или 'month'
+            period_start DATE NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (telegram_id, period_kind, period_start)
+        ) WITHOUT ROWID
+    """)
+
+    # Переносим текущие дневные счетчики из users
+    await db.execute("""
+        INSERT OR IGNORE INTO usage_counters (telegram_id, period_kind, period_start, count)
+        SELECT telegram_id, 'day', last_calculation_date, daily_calculations
+        FROM users
+        WHERE last_calculation_date IS NOT NULL AND daily_calculations > 0
+    """)
+
+    # Месячные счетчики восстанавливаем по сохраненным расчетам текущего месяца.
+    # created_at и ключи периодов - в UTC, поэтому и начало месяца берем по UTC
+    await db.execute("""
+        INSERT OR IGNORE INTO usage_counters (telegram_id, period_kind, period_start, count)
+        SELECT user_id, 'month', date('now', 'start of month'), COUNT(*)
+        FROM calculations
+        WHERE created_at >= date('now', 'start of month')
+        GROUP BY user_id
+    """)
+
+
+# Колонки сметы натяжного потолка, вынесенные из calculations
+CEILING_ESTIMATE_COLUMNS = (
+    # Этап 2: Профиль
+    "profile_type", "profile_quantity", "dowel_nails_count",
+    # Этап 3: Освещение
+    "lighting_type", "lighting_data",
+    # Этап 4: Ниши под шторы
+    "curtain_niche_needed", "curtain_niche_type", "curtain_niche_meters",
+    "curtain_ends_count", "curtain_tape_meters", "curtain_brackets_count",
+    "curtain_screws_count",
+    # Этап 5: Дополнительные элементы
+    "timber_needed", "timber_meters", "timber_brackets_count",
+    # Этап 6: Крепеж
+    "fastener_type",
+    # Итоговые расчеты
+    "total_hangers", "total_dowels", "total_screws", "glue_volume",
+)
+
+
+def recognition_digest(data) -> str:
+    """Ключ результата распознавания: SHA-1 от его сериализованного вида"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+
+@migration(5, "Разделение calculations на ядро, сметы и распознавания")
+async def _split_calculations(db: aiosqlite.Connection):
+    await db.create_function("recognition_digest", 1, recognition_digest, deterministic=True)
+
+    # Результаты распознавания хранятся один раз и адресуются по содержимому
+    await db.execute("""
+        CREATE TABLE recognitions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            digest TEXT UNIQUE NOT NULL,
+            data TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await db.execute("""
+        INSERT OR IGNORE INTO recognitions (digest, data)
+        SELECT recognition_digest(recognized_data), recognized_data
+        FROM calculations
+        WHERE recognized_data IS NOT NULL
+    """)
+
+    # Узкая таблица расчетов
+    await db.execute("""
+        CREATE TABLE calculations_core (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            calculation_type TEXT NOT NULL,
+            room_type TEXT,
+            room_description TEXT,
+            measurements TEXT,
+            perimeter REAL,
+            area REAL,
+            corners_count INTEGER DEFAULT 4,
+            recognition_digest TEXT,
+            final_result TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (telegram_id),
+            FOREIGN KEY (recognition_digest) REFERENCES recognitions (digest)
+        )
+    """)
+    await db.execute("""
+        INSERT INTO calculations_core (
+            id, user_id, calculation_type, room_type, room_description,
+            measurements, perimeter, area, corners_count,
+            recognition_digest, final_result, created_at
+        )
+        SELECT id, user_id, calculation_type, room_type, room_description,
+               measurements, perimeter, area, corners_count,
+               CASE WHEN recognized_data IS NOT NULL
+                    THEN recognition_digest(recognized_data) END,
+               final_result, created_at
+        FROM calculations
+    """)
+
+    # Смета натяжного потолка - только для расчетов, где она есть
+    columns = ", ".join(CEILING_ESTIMATE_COLUMNS)
+    await db.execute("""
+        CREATE TABLE ceiling_estimates (
+            calculation_id INTEGER PRIMARY KEY,
+            profile_type TEXT,
+            profile_quantity REAL,
+            dowel_nails_count INTEGER,
+            lighting_type TEXT,
+            lighting_data TEXT,
+            curtain_niche_needed BOOLEAN DEFAULT FALSE,
+            curtain_niche_type TEXT,
+            curtain_niche_meters REAL,
+            curtain_ends_count INTEGER,
+            curtain_tape_meters REAL,
+            curtain_brackets_count INTEGER,
+            curtain_screws_count INTEGER,
+            timber_needed BOOLEAN DEFAULT FALSE,
+            timber_meters REAL,
+            timber_brackets_count INTEGER,
+            fastener_type TEXT,
+            total_hangers INTEGER,
+            total_dowels INTEGER,
+            total_screws INTEGER,
+            glue_volume REAL,
+            FOREIGN KEY (calculation_id) REFERENCES calculations (id)
+        )
+    """)
+    await db.execute(f"""
+        INSERT INTO ceiling_estimates (calculation_id, {columns})
+        SELECT id, {columns}
+        FROM calculations
+        WHERE calculation_type = 'ceiling'
+           OR profile_type IS NOT NULL
+           OR lighting_type IS NOT NULL
+           OR fastener_type IS NOT NULL
+    """)
+
+    await db.execute("DROP TABLE calculations")
+    await db.execute("ALTER TABLE calculations_core RENAME TO calculations")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_calculations_user_created "
+        "ON calculations (user_id, created_at)"
+    )
+
+
+def user_stats_rebuild_sql(single_user: bool = False) -> str:
+    """
+    Запрос, заполняющий user_stats по исходным таблицам
+
+    С single_user=True пересчитывает одного пользователя (параметр :telegram_id).
+    Запрос работает в обоих диалектах и используется и миграциями, и командой
+    пересчета статистики.
+    """
+    calc_filter = "WHERE user_id = :telegram_id" if single_user else ""
+    payment_filter = "AND user_id = :telegram_id" if single_user else ""
+    return f"""
+        INSERT INTO user_stats (
+            telegram_id, total_calculations, last_calculation_at,
+            total_payments, total_spent
+        )
+        SELECT telegram_id, SUM(calculations), MAX(last_calculation_at),
+               SUM(payments), SUM(spent)
+        FROM (
+            SELECT user_id AS telegram_id, COUNT(*) AS calculations,
+                   MAX(created_at) AS last_calculation_at,
+                   0 AS payments, 0 AS spent
+            FROM calculations
+            {calc_filter}
+            GROUP BY user_id
+            UNION ALL
+            SELECT user_id, 0, NULL, COUNT(*), SUM(amount)
+            FROM payments
+            WHERE status = 'succeeded' {payment_filter}
+            GROUP BY user_id
+        ) totals
+        GROUP BY telegram_id
+    """
+
+
+@migration(6, "Агрегаты пользователей user_stats")
+async def _create_user_stats(db: aiosqlite.Connection):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            telegram_id INTEGER PRIMARY KEY,
+            total_calculations INTEGER NOT NULL DEFAULT 0,
+            last_calculation_at DATETIME,
+            total_payments INTEGER NOT NULL DEFAULT 0,
+            total_spent REAL NOT NULL DEFAULT 0
+        )
+    """)
+    await db.execute(user_stats_rebuild_sql())
+
+
+@migration(7, "Индекс ссылок расчетов на распознавания")
+async def _create_recognition_digest_index(db: aiosqlite.Connection):
+    # Нужен для поиска распознаваний без ссылок при архивировании
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_calculations_recognition "
+        "ON calculations (recognition_digest)"
+    )
+
+
+CALCULATIONS_FTS_SQL = """
+    CREATE VIRTUAL TABLE calculations_fts USING fts5(
+        user_id, body,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+"""
+
+# Колонки расчета для calculations_fts_rows (r.data - закодированное распознавание)
+CALCULATIONS_FTS_SOURCE_SQL = """
+    SELECT c.id, c.user_id, c.room_description, c.room_type,
+           c.calculation_type, c.created_at, r.data
+    FROM calculations c
+    LEFT JOIN recognitions r ON r.digest = c.recognition_digest
+"""
+
+
+def calculations_fts_rows(rows) -> list:
+    """Строки calculations_fts (rowid, user_id, body) из строк CALCULATIONS_FTS_SOURCE_SQL"""
+    fts_rows = []
+    for calc_id, user_id, description, room_type, calc_type, created_at, recognized in rows:
+        try:
+            notes = (codec.decode(recognized) or {}).get("notes") if recognized else None
+        except (ValueError, AttributeError):
+            notes = None
+        fts_rows.append((
+            calc_id, str(user_id),
+            search_text(description, room_type, calc_type, created_at, notes)
+        ))
+    return fts_rows
+
+
+@migration(8, "Полнотекстовый индекс расчетов (FTS5)")
+async def _create_calculations_fts(db: aiosqlite.Connection):
+    # rowid строки индекса - id расчета
+    await db.execute(CALCULATIONS_FTS_SQL)
+
+    cursor = await db.execute(CALCULATIONS_FTS_SOURCE_SQL)
+    await db.executemany(
+        "INSERT INTO calculations_fts (rowid, user_id, body) VALUES (?, ?, ?)",
+        calculations_fts_rows(await cursor.fetchall())
+    )
+
+
+# ========== МИГРАЦИИ POSTGRESQL ==========
+#
+# Схема повторяет итоговую схему SQLite: даты хранятся текстом
+# в том же формате, JSON-поля - в бинарном формате codec (BYTEA).
+# Внешние ключи на users не объявляются, как и не проверяются в SQLite;
+# остальные откладываются до коммита, т.к. очередь записи группирует
+# строки по таблицам.
+
+_PG_NOW = "to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"
+
+
+@migration(1, "Схема бота в PostgreSQL", dialect="postgres")
+async def _create_postgres_schema(db):
+    await db.execute(f"""
+        CREATE TABLE IF NOT EXISTS users (
+            id BIGSERIAL PRIMARY KEY,
+            telegram_id BIGINT UNIQUE NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            subscription_type TEXT DEFAULT 'unlimited',
+            subscription_expires TEXT,
+            daily_calculations INTEGER DEFAULT 0,
+            last_calculation_date TEXT,
+            created_at TEXT DEFAULT {_PG_NOW}
+        )
+    """)
+
+    await db.execute(f"""
+        CREATE TABLE IF NOT EXISTS payments (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            payment_id TEXT UNIQUE NOT NULL,
+            plan_type TEXT NOT NULL,
+            amount DOUBLE PRECISION NOT NULL,
+            status TEXT DEFAULT 'pending',
+            created_at TEXT DEFAULT {_PG_NOW}
+        )
+    """)
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_payments_user_status "
+        "ON payments (user_id, status)"
+    )
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS usage_counters (
+            telegram_id BIGINT NOT NULL,
+            period_kind TEXT NOT NULL,
+            period_start TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (telegram_id, period_kind, period_start)
+        )
+    """)
+
+    await db.execute(f"""
+        CREATE TABLE IF NOT EXISTS recognitions (
+            id BIGSERIAL PRIMARY KEY,
+            digest TEXT UNIQUE NOT NULL,
+            data BYTEA NOT NULL,
+            created_at TEXT DEFAULT {_PG_NOW}
+        )
+    """)
+
+    await db.execute(f"""
+        CREATE TABLE IF NOT EXISTS calculations (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            calculation_type TEXT NOT NULL,
+            room_type TEXT,
+            room_description TEXT,
+            measurements BYTEA,
+            perimeter DOUBLE PRECISION,
+            area DOUBLE PRECISION,
+            corners_count INTEGER DEFAULT 4,
+            recognition_digest TEXT
+                REFERENCES recognitions (digest) DEFERRABLE INITIALLY DEFERRED,
+            final_result BYTEA,
+            created_at TEXT DEFAULT {_PG_NOW}
+        )
+    """)
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_calculations_user_created "
+        "ON calculations (user_id, created_at)"
+    )
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS ceiling_estimates (
+            calculation_id BIGINT PRIMARY KEY
+                REFERENCES calculations (id) DEFERRABLE INITIALLY DEFERRED,
+            profile_type TEXT,
+            profile_quantity DOUBLE PRECISION,
+            dowel_nails_count INTEGER,
+            lighting_type TEXT,
+            lighting_data BYTEA,
+            curtain_niche_needed BOOLEAN DEFAULT FALSE,
+            curtain_niche_type TEXT,
+            curtain_niche_meters DOUBLE PRECISION,
+            curtain_ends_count INTEGER,
+            curtain_tape_meters DOUBLE PRECISION,
+            curtain_brackets_count INTEGER,
+            curtain_screws_count INTEGER,
+            timber_needed BOOLEAN DEFAULT FALSE,
+            timber_meters DOUBLE PRECISION,
+            timber_brackets_count INTEGER,
+            fastener_type TEXT,
+            total_hangers INTEGER,
+            total_dowels INTEGER,
+            total_screws INTEGER,
+            glue_volume DOUBLE PRECISION
+        )
+    """)
+
+
+@migration(2, "Агрегаты пользователей user_stats", dialect="postgres")
+async def _create_postgres_user_stats(db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            telegram_id BIGINT PRIMARY KEY,
+            total_calculations INTEGER NOT NULL DEFAULT 0,
+            last_calculation_at TEXT,
+            total_payments INTEGER NOT NULL DEFAULT 0,
+            total_spent DOUBLE PRECISION NOT NULL DEFAULT 0
+        )
+    """)
+    await db.execute(user_stats_rebuild_sql())
+
+
+@migration(3, "Индекс ссылок расчетов на распознавания", dialect="postgres")
+async def _create_postgres_recognition_digest_index(db):
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_calculations_recognition "
+        "ON calculations (recognition_digest)"
+    )
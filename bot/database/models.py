@@ -1,214 +1,373 @@
 import aiosqlite
-from datetime import datetime, date, timedelta
-from typing import Optional
-import json
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, date, timedelta, timezone
+from typing import Optional, AsyncIterator, Tuple, List, Union
+from functools import partial
+from pathlib import Path
 import logging
 
+from bot.database.migrations import (
+    apply_migrations,
+    recognition_digest,
+    user_stats_rebuild_sql,
+    CEILING_ESTIMATE_COLUMNS
+)
+from bot.database.backends import create_backend
+from bot.database.archive import CalculationArchive
+from bot.database.write_behind import WriteBehindQueue
+from bot.database.cache import TTLCache
+from bot.database.loader import BatchLoader
+from bot.database.maintenance import DatabaseMaintenance
+from bot.database import codec
+from bot.database.search import search_text, build_match_query
+from bot.database.sharding import shard_for, shard_urls, USER_TABLES, ROW_KEYS, SHARD_LOCAL_IDS
+from config.settings import settings
+
 logger = logging.getLogger(__name__)
 
 
 class Database:
-    def __init__(self, db_path: str = "bot.db"):
+    def __init__(self, db_path: str = "bot.db", pool_size: int = 4,
+                 write_flush_interval: float = 0.05, write_batch_size: int = 100,
+                 cache_size: int = 10000, cache_ttl: float = 60.0,
+                 url: Optional[str] = None, sqlite_profile: str = "default",
+                 archive_url: Optional[str] = None, shards: int = 1,
+                 backup_dir: Optional[str] = None, keep_backups: int = 7):
         self.db_path = db_path
+        self.pool_size = max(1, pool_size)
+        
+        # Хранилища с пулами долгоживущих соединений (открываются в connect()).
+        # В режиме шардирования данные каждого пользователя лежат в одном
+        # из файлов SQLite, выбранном по хэшу telegram_id, и у каждого файла
+        # свой писатель - записи разных пользователей не ждут друг друга.
+        url = url or f"sqlite:///{db_path}"
+        urls = shard_urls(url, shards) if shards > 1 else [url]
+        self.backends = [
+            create_backend(shard_url, pool_size=self.pool_size, sqlite_profile=sqlite_profile)
+            for shard_url in urls
+        ]
+        self.backend = self.backends[0]
+        
+        # Холодный архив старых расчетов (если настроен)
+        self.archive = CalculationArchive(archive_url) if archive_url else None
+        
+        # Резервные копии, VACUUM и ANALYZE файлов SQLite (расписание - run_in_background)
+        stores = list(self.backends)
+        if self.archive is not None:
+            stores.append(self.archive.backend)
+        self.maintenance = DatabaseMaintenance(
+            [(Path(store.path).stem, store) for store in stores if store.dialect == 'sqlite'],
+            backup_dir=backup_dir,
+            keep_backups=keep_backups
+        )
+        
+        # Очереди отложенной записи расчетов и счетчиков (по одной на шард)
+        self._write_queues = [
+            WriteBehindQueue(
+                partial(self._acquire, shard=shard),
+                flush_interval=write_flush_interval,
+                max_batch=write_batch_size
+            )
+            for shard in range(len(self.backends))
+        ]
+        
+        # Фоновые задачи обслуживания (отменяются в close())
+        self._background_tasks: set = set()
+        
+        # Последний выделенный ID расчета в каждом шарде (загружается при первой записи)
+        self._last_calculation_ids: List[Optional[int]] = [None] * len(self.backends)
+        self._id_lock = asyncio.Lock()
+        
+        # Кэш строк пользователей и их активных подписок
+        self._users = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._subscriptions = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        
+        # Промахи кэша пользователей за один проход цикла событий
+        # читаются одним запросом WHERE telegram_id IN (...)
+        self._user_loader = BatchLoader(self._load_users)
+        # Счетчик сбросов кэша: результат чтения, начатого до сброса, не кэшируем
+        self._user_invalidations = 0
+    
+    @property
+    def dialect(self) -> str:
+        """Диалект SQL хранилища: 'sqlite' или 'postgres'"""
+        return self.backend.dialect
+    
+    @property
+    def shard_count(self) -> int:
+        """Количество шардов (1 - без шардирования)"""
+        return len(self.backends)
+    
+    def _shard_of(self, telegram_id: int) -> int:
+        """Номер шарда с данными пользователя"""
+        return shard_for(telegram_id, self.shard_count)
+    
+    def _writes(self, telegram_id: int) -> WriteBehindQueue:
+        """Очередь отложенной записи шарда пользователя"""
+        return self._write_queues[self._shard_of(telegram_id)]
+    
+    async def flush_writes(self, telegram_id: int = None):
+        """Сбрасывает очередь записи шарда пользователя (по умолчанию - всех шардов)"""
+        if telegram_id is not None:
+            await self._writes(telegram_id).flush()
+        else:
+            await asyncio.gather(*(queue.flush() for queue in self._write_queues))
+    
+    def write_stats(self) -> dict:
+        """Статистика очередей отложенной записи (суммарно по шардам)"""
+        return {
+            'flushed_batches': sum(queue.flushed_batches for queue in self._write_queues),
+            'flushed_rows': sum(queue.flushed_rows for queue in self._write_queues),
+            'failed_rows': sum(queue.failed_rows for queue in self._write_queues)
+        }
+    
+    async def connect(self):
+        """Открывает пулы долгоживущих соединений с базой данных"""
+        for backend in self.backends:
+            await backend.connect()
+        if self.archive is not None:
+            await self.archive.connect()
+        for queue in self._write_queues:
+            queue.start()
+    
+    def run_in_background(self, coro) -> asyncio.Task:
+        """Запускает фоновую задачу обслуживания БД, которая будет отменена в close()"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._on_background_done)
+        return task
+    
+    def _on_background_done(self, task: asyncio.Task):
+        self._background_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Ошибка фоновой задачи БД: {task.exception()}")
+    
+    async def close(self):
+        """Сбрасывает очередь записи и закрывает все соединения пула"""
+        for task in list(self._background_tasks):
+            task.cancel()
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        
+        for queue in self._write_queues:
+            await queue.stop()
+        for backend in self.backends:
+            await backend.close()
+        if self.archive is not None:
+            await self.archive.close()
+    
+    @asynccontextmanager
+    async def _acquire(self, readonly: bool = False, shard: int = 0) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Берет соединение из пула шарда и возвращает его обратно после использования
+        
+        Чтения истории и админской статистики берут соединение с readonly=True
+        и не стоят в очереди за записями.
+        """
+        backend = self.backends[shard]
+        if not backend.is_open:
+            await self.connect()
+        
+        async with backend.acquire(readonly=readonly) as conn:
+            yield conn
+    
+    def _acquire_user(self, telegram_id: int, readonly: bool = False):
+        """Берет соединение с шардом, где лежат данные пользователя"""
+        return self._acquire(readonly=readonly, shard=self._shard_of(telegram_id))
         
     async def create_tables(self):
-        """Создает таблицы в базе данных"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Таблица пользователей
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER UNIQUE NOT NULL,
-                    username TEXT,
-                    first_name TEXT,
-                    subscription_type TEXT DEFAULT 'unlimited',
-                    subscription_expires DATETIME,
-                    daily_calculations INTEGER DEFAULT 0,
-                    last_calculation_date DATE,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Таблица расчетов
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS calculations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    calculation_type TEXT NOT NULL,
-                    room_type TEXT,
-                    room_description TEXT,
-                    measurements TEXT,
-                    perimeter REAL,
-                    area REAL,
-                    corners_count INTEGER DEFAULT 4,
-                    recognized_data TEXT,
-                    final_result TEXT,
-                    
-                    -- Этап 2: Профиль
-                    profile_type TEXT,
-                    profile_quantity REAL,
-                    dowel_nails_count INTEGER,
-                    
-                    -- Этап 3: Освещение
-                    lighting_type TEXT,
-                    lighting_data TEXT,  -- JSON с параметрами освещения
-                    
-                    -- Этап 4: Ниши под шторы
-                    curtain_niche_needed BOOLEAN DEFAULT FALSE,
-                    curtain_niche_type TEXT,
-                    curtain_niche_meters REAL,
-                    curtain_ends_count INTEGER,
-                    curtain_tape_meters REAL,
-                    curtain_brackets_count INTEGER,
-                    curtain_screws_count INTEGER,
-                    
-                    -- Этап 5: Дополнительные элементы
-                    timber_needed BOOLEAN DEFAULT FALSE,
-                    timber_meters REAL,
-                    timber_brackets_count INTEGER,
-                    
-                    -- Этап 6: Крепеж
-                    fastener_type TEXT,
-                    
-                    -- Итоговые расчеты
-                    total_hangers INTEGER,
-                    total_dowels INTEGER,
-                    total_screws INTEGER,
-                    glue_volume REAL,
-                    
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (telegram_id)
-                )
-            """)
-            
-            # Добавляем новые колонки если их нет (для существующих баз)
-            try:
-                await db.execute("ALTER TABLE calculations ADD COLUMN room_type TEXT")
-                await db.execute("ALTER TABLE calculations ADD COLUMN room_description TEXT")
-                await db.execute("ALTER TABLE calculations ADD COLUMN measurements TEXT")
-                await db.execute("ALTER TABLE calculations ADD COLUMN perimeter REAL")
-                await db.execute("ALTER TABLE calculations ADD COLUMN area REAL")
-                await db.execute("ALTER TABLE calculations ADD COLUMN corners_count INTEGER DEFAULT 4")
-                
-                # Новые поля для натяжных потолков
-                await db.execute("ALTER TABLE calculations ADD COLUMN profile_type TEXT")
-                await db.execute("ALTER TABLE calculations ADD COLUMN profile_quantity REAL")
-                await db.execute("ALTER TABLE calculations ADD COLUMN dowel_nails_count INTEGER")
-                
-                await db.execute("ALTER TABLE calculations ADD COLUMN lighting_type TEXT")
-                await db.execute("ALTER TABLE calculations ADD COLUMN lighting_data TEXT")
-                
-                await db.execute("ALTER TABLE calculations ADD COLUMN curtain_niche_needed BOOLEAN DEFAULT FALSE")
-                await db.execute("ALTER TABLE calculations ADD COLUMN curtain_niche_type TEXT")
-                await db.execute("ALTER TABLE calculations ADD COLUMN curtain_niche_meters REAL")
-                await db.execute("ALTER TABLE calculations ADD COLUMN curtain_ends_count INTEGER")
-                await db.execute("ALTER TABLE calculations ADD COLUMN curtain_tape_meters REAL")
-                await db.execute("ALTER TABLE calculations ADD COLUMN curtain_brackets_count INTEGER")
-                await db.execute("ALTER TABLE calculations ADD COLUMN curtain_screws_count INTEGER")
-                
-                await db.execute("ALTER TABLE calculations ADD COLUMN timber_needed BOOLEAN DEFAULT FALSE")
-                await db.execute("ALTER TABLE calculations ADD COLUMN timber_meters REAL")
-                await db.execute("ALTER TABLE calculations ADD COLUMN timber_brackets_count INTEGER")
-                
-                await db.execute("ALTER TABLE calculations ADD COLUMN fastener_type TEXT")
-                
-                await db.execute("ALTER TABLE calculations ADD COLUMN total_hangers INTEGER")
-                await db.execute("ALTER TABLE calculations ADD COLUMN total_dowels INTEGER")
-                await db.execute("ALTER TABLE calculations ADD COLUMN total_screws INTEGER")
-                await db.execute("ALTER TABLE calculations ADD COLUMN glue_volume REAL")
-            except:
-                # Колонки уже существуют
-                pass
-            
-            # Таблица платежей
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS payments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    payment_id TEXT UNIQUE NOT NULL,
-                    plan_type TEXT NOT NULL,
-                    amount REAL NOT NULL,
-                    status TEXT DEFAULT 'pending',
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (telegram_id)
-                )
-            """)
-            
-            await db.commit()
+        """Создает таблицы и применяет недостающие миграции схемы во всех шардах"""
+        for shard in range(self.shard_count):
+            async with self._acquire(shard=shard) as db:
+                version = await apply_migrations(db, self.dialect)
+        logger.info(f"Версия схемы БД: {version} (шардов: {self.shard_count})")
+    
+    def _invalidate_user(self, telegram_id: int):
+        """Сбрасывает закэшированные данные пользователя"""
+        self._users.invalidate(telegram_id)
+        self._subscriptions.invalidate(telegram_id)
+        self._user_invalidations += 1
+    
+    def cache_stats(self) -> dict:
+        """Статистика кэшей пользователей и подписок"""
+        return {
+            'users': self._users.stats(),
+            'subscriptions': self._subscriptions.stats(),
+            'user_loader': self._user_loader.stats()
+        }
     
     async def get_user(self, telegram_id: int) -> Optional[dict]:
         """Получает пользователя по telegram_id"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute(
-                "SELECT * FROM users WHERE telegram_id = ?", 
-                (telegram_id,)
-            )
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+        user = self._users.get(telegram_id)
+        if user is TTLCache.MISSING:
+            invalidations = self._user_invalidations
+            user = await self._user_loader.load(telegram_id)
+            if invalidations == self._user_invalidations:
+                self._users.set(telegram_id, user)
+        
+        # Отдаем копию, чтобы вызывающий код не испортил кэш
+        return dict(user) if user else None
+    
+    async def _load_users(self, telegram_ids: list) -> dict:
+        """Читает пачку пользователей одним запросом на шард: {telegram_id: строка}"""
+        by_shard = {}
+        for telegram_id in telegram_ids:
+            by_shard.setdefault(self._shard_of(telegram_id), []).append(telegram_id)
+        
+        async def load_shard(shard: int, ids: list) -> list:
+            async with self._acquire(readonly=True, shard=shard) as db:
+                cursor = await db.execute(
+                    f"SELECT * FROM users WHERE telegram_id IN ({', '.join('?' * len(ids))})",
+                    ids
+                )
+                return await cursor.fetchall()
+        
+        results = await asyncio.gather(*(load_shard(shard, ids) for shard, ids in by_shard.items()))
+        return {row['telegram_id']: dict(row) for rows in results for row in rows}
     
     async def create_user(self, telegram_id: int, username: str = None, 
                          first_name: str = None) -> dict:
         """Создает нового пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._acquire_user(telegram_id) as db:
             await db.execute("""
                 INSERT INTO users (telegram_id, username, first_name, last_calculation_date)
                 VALUES (?, ?, ?, ?)
             """, (telegram_id, username, first_name, date.today()))
             await db.commit()
-            
+        
+        self._invalidate_user(telegram_id)
         return await self.get_user(telegram_id)
     
     async def update_user_subscription(self, telegram_id: int, 
                                      subscription_type: str, 
                                      expires: datetime):
         """Обновляет подписку пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._acquire_user(telegram_id) as db:
             await db.execute("""
                 UPDATE users 
                 SET subscription_type = ?, subscription_expires = ?
                 WHERE telegram_id = ?
             """, (subscription_type, expires, telegram_id))
             await db.commit()
+        
+        self._invalidate_user(telegram_id)
     
-    async def get_user_calculations_today(self, telegram_id: int) -> int:
-        """Получает количество расчетов пользователя за сегодня"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Сначала проверяем и обновляем дату последнего расчета
-            cursor = await db.execute(
-                "SELECT last_calculation_date, daily_calculations FROM users WHERE telegram_id = ?",
-                (telegram_id,)
-            )
+    @staticmethod
+    def _period_starts(today: date = None) -> dict:
+        """Начала текущих периодов учета по UTC, как и created_at: {'day': ..., 'month': ...}"""
+        today = today or datetime.now(timezone.utc).date()
+        return {
+            'day': today.isoformat(),
+            'month': today.replace(day=1).isoformat()
+        }
+    
+    async def get_usage(self, telegram_id: int, period_kind: str) -> int:
+        """Получает количество расчетов пользователя за текущий день или месяц"""
+        await self._writes(telegram_id).flush()
+        period_start = self._period_starts()[period_kind]
+        async with self._acquire_user(telegram_id, readonly=True) as db:
+            cursor = await db.execute("""
+                SELECT count FROM usage_counters
+                WHERE telegram_id = ? AND period_kind = ? AND period_start = ?
+            """, (telegram_id, period_kind, period_start))
+            row = await cursor.fetchone()
+        return row[0] if row else 0
+    
+    async def reserve_calculation(self, telegram_id: int) -> Tuple[bool, Optional[str]]:
+        """
+        Атомарно резервирует один расчет из лимита пользователя
+        
+        В одной транзакции сбрасывает истекшую подписку на бесплатную и
+        увеличивает счетчик периода, по которому считается лимит тарифа
+        (день для free, месяц для платных), только если лимит еще не исчерпан.
+        
+        Returns:
+            (разрешен ли расчет, активный тариф пользователя)
+        """
+        now = datetime.now().isoformat(" ")
+        periods = self._period_starts()
+        
+        active = """(
+            subscription_type != 'free'
+            AND subscription_expires IS NOT NULL
+            AND subscription_expires > :now
+        )"""
+        
+        async with self._acquire_user(telegram_id) as db:
+            cursor = await db.execute(f"""
+                UPDATE users
+                SET subscription_type = CASE WHEN {active} THEN subscription_type ELSE 'free' END,
+                    subscription_expires = CASE WHEN {active} THEN subscription_expires ELSE NULL END
+                WHERE telegram_id = :telegram_id
+                RETURNING subscription_type
+            """, {'now': now, 'telegram_id': telegram_id})
             row = await cursor.fetchone()
             
-            if row:
-                last_date = datetime.strptime(row[0], "%Y-%m-%d").date() if row[0] else None
-                today = date.today()
+            if row is None:
+                await db.rollback()
+            else:
+                plan = row[0]
+                limit = settings.SUBSCRIPTION_LIMITS.get(plan, settings.SUBSCRIPTION_LIMITS['free'])
+                limited_kind = settings.SUBSCRIPTION_LIMIT_PERIODS.get(plan, 'day')
                 
-                if last_date != today:
-                    # Сбрасываем счетчик для нового дня
-                    await db.execute("""
-                        UPDATE users 
-                        SET daily_calculations = 0, last_calculation_date = ?
-                        WHERE telegram_id = ?
-                    """, (today, telegram_id))
-                    await db.commit()
-                    return 0
-                else:
-                    return row[1]
-            
-            return 0
+                # Условный инкремент: строка не обновится, если лимит исчерпан
+                cursor = await db.execute("""
+                    INSERT INTO usage_counters (telegram_id, period_kind, period_start, count)
+                    VALUES (:telegram_id, :period_kind, :period_start, 1)
+                    ON CONFLICT (telegram_id, period_kind, period_start)
+                    DO UPDATE SET count = usage_counters.count + 1
+                    WHERE :limit < 0 OR usage_counters.count < :limit
+                    RETURNING count
+                """, {
+                    'telegram_id': telegram_id,
+                    'period_kind': limited_kind,
+                    'period_start': periods[limited_kind],
+                    'limit': limit
+                })
+                allowed = await cursor.fetchone() is not None
+                
+                if allowed:
+                    # Остальные периоды считаем без ограничений
+                    await db.executemany(self._BUMP_USAGE_SQL, [
+                        (telegram_id, kind, start)
+                        for kind, start in periods.items() if kind != limited_kind
+                    ])
+                await db.commit()
+        
+        if row is not None:
+            # Подписка могла быть сброшена на бесплатную
+            self._invalidate_user(telegram_id)
+            return allowed, plan
+        
+        # Пользователь мог еще не пройти /start - создаем и повторяем
+        if not await self.get_user(telegram_id):
+            await self.create_user(telegram_id)
+            return await self.reserve_calculation(telegram_id)
+        
+        return False, None
     
-    async def increment_user_calculations(self, telegram_id: int):
-        """Увеличивает счетчик расчетов пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+    async def release_calculation(self, telegram_id: int):
+        """Возвращает зарезервированный расчет (например, если распознавание не удалось)"""
+        periods = self._period_starts()
+        async with self._acquire_user(telegram_id) as db:
             await db.execute("""
-                UPDATE users 
-                SET daily_calculations = daily_calculations + 1
+                UPDATE usage_counters
+                SET count = CASE WHEN count > 0 THEN count - 1 ELSE 0 END
                 WHERE telegram_id = ?
-            """, (telegram_id,))
+                  AND ((period_kind = 'day' AND period_start = ?)
+                       OR (period_kind = 'month' AND period_start = ?))
+            """, (telegram_id, periods['day'], periods['month']))
             await db.commit()
     
+    # Безусловное увеличение счетчика периода
+    _BUMP_USAGE_SQL = """
+        INSERT INTO usage_counters (telegram_id, period_kind, period_start, count)
+        VALUES (?, ?, ?, 1)
+        ON CONFLICT (telegram_id, period_kind, period_start)
+        DO UPDATE SET count = usage_counters.count + 1
+    """
+    
     async def save_calculation(self, user_id: int, calculation_type: str,
                              room_type: str = None, room_description: str = None,
                              measurements: list = None, perimeter: float = None,
@@ -232,104 +391,587 @@ class Database:
                              # Итоговые расчеты
                              total_hangers: int = None, total_dowels: int = None,
                              total_screws: int = None, glue_volume: float = None):
-        """Сохраняет расчет в базу данных"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT INTO calculations (
-                    user_id, calculation_type, room_type, room_description,
-                    measurements, perimeter, area, corners_count, recognized_data, final_result,
-                    profile_type, profile_quantity, dowel_nails_count,
-                    lighting_type, lighting_data,
-                    curtain_niche_needed, curtain_niche_type, curtain_niche_meters,
-                    curtain_ends_count, curtain_tape_meters, curtain_brackets_count, curtain_screws_count,
-                    timber_needed, timber_meters, timber_brackets_count,
-                    fastener_type,
-                    total_hangers, total_dowels, total_screws, glue_volume
+        """
+        Сохраняет расчет в базу данных
+        
+        Запись ставится в очередь отложенной записи и попадает в базу
+        при ближайшем групповом коммите. Общие поля пишутся в узкую таблицу
+        calculations, смета натяжного потолка - в ceiling_estimates,
+        а результат распознавания - один раз в recognitions.
+        В той же пачке обновляются агрегаты пользователя в user_stats.
+        
+        Returns:
+            ID расчета
+        """
+        shard = self._shard_of(user_id)
+        writes = self._write_queues[shard]
+        calculation_id = await self._next_calculation_id(shard)
+        # Время расчета фиксируем сразу, а не в момент сброса очереди
+        created_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        
+        digest = None
+        if recognized_data:
+            digest = recognition_digest(codec.dumps(recognized_data))
+            writes.enqueue("""
+                INSERT INTO recognitions (digest, data) VALUES (?, ?)
+                ON CONFLICT (digest) DO NOTHING
+            """, (digest, codec.encode(recognized_data)))
+        
+        writes.enqueue("""
+            INSERT INTO calculations (
+                id, user_id, calculation_type, room_type, room_description,
+                measurements, perimeter, area, corners_count,
+                recognition_digest, final_result, created_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            calculation_id,
+            user_id, 
+            calculation_type,
+            room_type,
+            room_description,
+            codec.encode(measurements) if measurements else None,
+            perimeter,
+            area,
+            corners_count,
+            digest,
+            codec.encode(final_result) if final_result else None,
+            created_at
+        ))
+        
+        estimate = (
+            profile_type,
+            profile_quantity,
+            dowel_nails_count,
+            lighting_type,
+            codec.encode(lighting_data) if lighting_data else None,
+            curtain_niche_needed,
+            curtain_niche_type,
+            curtain_niche_meters,
+            curtain_ends_count,
+            curtain_tape_meters,
+            curtain_brackets_count,
+            curtain_screws_count,
+            timber_needed,
+            timber_meters,
+            timber_brackets_count,
+            fastener_type,
+            total_hangers,
+            total_dowels,
+            total_screws,
+            glue_volume
+        )
+        
+        # Для расчетов без сметы строку в ceiling_estimates не создаем
+        if calculation_type == 'ceiling' or any(value not in (None, False) for value in estimate):
+            writes.enqueue(f"""
+                INSERT INTO ceiling_estimates (calculation_id, {", ".join(CEILING_ESTIMATE_COLUMNS)})
+                VALUES ({", ".join("?" * (len(CEILING_ESTIMATE_COLUMNS) + 1))})
+            """, (calculation_id, *estimate))
+        
+        if self.dialect == 'sqlite':
+            # Полнотекстовый индекс обновляется в той же пачке
+            notes = recognized_data.get('notes') if isinstance(recognized_data, dict) else None
+            writes.enqueue(
+                "INSERT INTO calculations_fts (rowid, user_id, body) VALUES (?, ?, ?)",
+                (calculation_id, str(user_id),
+                 search_text(room_description, room_type, calculation_type, created_at, notes))
+            )
+        
+        writes.enqueue(self._BUMP_CALCULATION_STATS_SQL, (user_id, 1, created_at))
+        
+        return calculation_id
+    
+    # Учет расчетов в агрегатах пользователя: (telegram_id, количество, время последнего)
+    _BUMP_CALCULATION_STATS_SQL = """
+        INSERT INTO user_stats (telegram_id, total_calculations, last_calculation_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT (telegram_id) DO UPDATE SET
+            total_calculations = user_stats.total_calculations + excluded.total_calculations,
+            last_calculation_at = CASE
+                WHEN user_stats.last_calculation_at IS NULL
+                  OR excluded.last_calculation_at > user_stats.last_calculation_at
+                THEN excluded.last_calculation_at
+                ELSE user_stats.last_calculation_at
+            END
+    """
+    
+    async def _next_calculation_id(self, shard: int = 0) -> int:
+        """
+        Выделяет ID для нового расчета
+        
+        ID назначаются заранее, чтобы строки ядра и сметы одного расчета
+        можно было записать одной пачкой через очередь отложенной записи.
+        В режиме шардирования каждый шард выдает ID со своим остатком
+        от деления на количество шардов, поэтому ID не пересекаются
+        между шардами (и в общем архиве).
+        """
+        async with self._id_lock:
+            if self._last_calculation_ids[shard] is None:
+                if self.dialect == 'postgres':
+                    # В PostgreSQL ID выдает последовательность - она общая для всех процессов
+                    async with self._acquire() as db:
+                        cursor = await db.execute(
+                            "SELECT nextval(pg_get_serial_sequence('calculations', 'id'))"
+                        )
+                        calculation_id = (await cursor.fetchone())[0]
+                        await db.commit()
+                    return calculation_id
+                
+                # Начинаем выше максимального ID во всех шардах
+                last_id = 0
+                for index in range(self.shard_count):
+                    async with self._acquire(shard=index) as db:
+                        # Учитываем sqlite_sequence, чтобы не переиспользовать ID удаленных строк
+                        cursor = await db.execute("""
+                            SELECT MAX(
+                                COALESCE((SELECT MAX(id) FROM calculations), 0),
+                                COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'calculations'), 0)
+                            )
+                        """)
+                        last_id = max(last_id, (await cursor.fetchone())[0])
+                self._last_calculation_ids = [
+                    last_id if known is None else known for known in self._last_calculation_ids
+                ]
+            
+            # Следующий ID с остатком shard по модулю количества шардов
+            last_id = self._last_calculation_ids[shard] + 1
+            calculation_id = last_id + (shard - last_id) % self.shard_count
+            self._last_calculation_ids[shard] = calculation_id
+            return calculation_id
+    
+    # JSON-поля расчета и значения по умолчанию при ошибке разбора
+    JSON_FIELDS = {
+        'measurements': list,
+        'recognized_data': dict,
+        'final_result': dict,
+        'lighting_data': dict
+    }
+    
+    # Колонки, нужные для списка истории (без тяжелых JSON-полей)
+    HISTORY_COLUMNS = (
+        'id', 'created_at', 'calculation_type', 'room_description',
+        'room_type', 'perimeter', 'area'
+    )
+    
+    # Полный расчет: ядро + смета + результат распознавания
+    FULL_CALCULATION_SELECT = f"""
+        SELECT c.*, r.data AS recognized_data,
+               {", ".join(f"e.{column}" for column in CEILING_ESTIMATE_COLUMNS)}
+        FROM calculations c
+        LEFT JOIN ceiling_estimates e ON e.calculation_id = c.id
+        LEFT JOIN recognitions r ON r.digest = c.recognition_digest
+    """
+    
+    @classmethod
+    def _decode_calculation(cls, row) -> dict:
+        """Преобразует строку расчета в словарь, разбирая JSON-поля"""
+        calc = dict(row)
+        for field, default in cls.JSON_FIELDS.items():
+            if calc.get(field):
+                try:
+                    calc[field] = codec.decode(calc[field])
+                except:
+                    calc[field] = default()
+        return calc
+    
+    # Колонки с JSON-значениями: (таблица, ключ, колонка)
+    BLOB_COLUMNS = (
+        ('calculations', 'id', 'measurements'),
+        ('calculations', 'id', 'final_result'),
+        ('ceiling_estimates', 'calculation_id', 'lighting_data'),
+        ('recognitions', 'id', 'data'),
+    )
+    
+    async def reencode_legacy_blobs(self, batch_size: int = 200, pause: float = 0.05) -> int:
+        """
+        Перекодирует JSON-поля, сохраненные старыми версиями бота текстом,
+        в компактный бинарный формат
+        
+        Работает небольшими пачками с паузами, чтобы не мешать обработке
+        сообщений. Можно безопасно прерывать и запускать повторно.
+        
+        Returns:
+            Количество перекодированных значений
+        """
+        if self.dialect != 'sqlite':
+            # В PostgreSQL данные переносятся уже в бинарном формате
+            return 0
+        
+        total = 0
+        for shard in range(self.shard_count):
+            for table, key, column in self.BLOB_COLUMNS:
+                last_key = 0
+                while True:
+                    async with self._acquire(shard=shard) as db:
+                        cursor = await db.execute(f"""
+                            SELECT {key}, {column} FROM {table}
+                            WHERE {key} > ? AND typeof({column}) = 'text'
+                            ORDER BY {key}
+                            LIMIT ?
+                        """, (last_key, batch_size))
+                        rows = await cursor.fetchall()
+                        if not rows:
+                            break
+                        
+                        updates = []
+                        for row_key, raw in rows:
+                            try:
+                                updates.append((codec.encode(codec.decode(raw)), row_key))
+                            except ValueError as e:
+                                logger.warning(f"Не удалось перекодировать {table}.{column} #{row_key}: {e}")
+                        
+                        await db.executemany(f"""
+                            UPDATE {table} SET {column} = ?
+                            WHERE {key} = ? AND typeof({column}) = 'text'
+                        """, updates)
+                        await db.commit()
+                    
+                    last_key = rows[-1][0]
+                    total += len(updates)
+                    await asyncio.sleep(pause)
+            
+        if total:
+            logger.info(f"Перекодировано JSON-значений в бинарный формат: {total}")
+        return total
+    
+    async def archive_old_calculations(self, older_than_days: int, mode: str = 'move',
+                                       batch_size: int = 500, pause: float = 0.05) -> int:
+        """
+        Убирает из основной базы расчеты старше заданного возраста
+        
+        Режим 'move' переносит расчеты вместе со сметой и распознаванием
+        в архив, режим 'strip' оставляет расчет на месте, но удаляет тяжелые
+        JSON-поля (итоговый результат и распознавание). Работает пачками
+        с паузами; можно безопасно прерывать и запускать повторно.
+        
+        Returns:
+            Количество обработанных расчетов
+        """
+        if mode not in ('move', 'strip'):
+            raise ValueError(f"Неизвестный режим архивирования: {mode}")
+        if mode == 'move' and self.archive is None:
+            raise RuntimeError("Архив расчетов не настроен")
+        
+        await self.flush_writes()
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).strftime("%Y-%m-%d %H:%M:%S")
+        step = self._move_to_archive if mode == 'move' else self._strip_calculation_blobs
+        
+        total = 0
+        for shard in range(self.shard_count):
+            last_id = 0
+            while True:
+                count, last_id = await step(shard, cutoff, last_id, batch_size)
+                if not count:
+                    break
+                total += count
+                await asyncio.sleep(pause)
+        
+        if total:
+            logger.info(f"Архивировано расчетов старше {older_than_days} дн. ({mode}): {total}")
+        return total
+    
+    async def _move_to_archive(self, shard: int, cutoff: str, last_id: int, batch_size: int) -> Tuple[int, int]:
+        """Переносит в архив одну пачку старых расчетов"""
+        async with self._acquire(shard=shard) as db:
+            cursor = await db.execute("""
+                SELECT * FROM calculations
+                WHERE id > ? AND created_at < ?
+                ORDER BY id
+                LIMIT ?
+            """, (last_id, cutoff, batch_size))
+            calculations = [dict(row) for row in await cursor.fetchall()]
+            if not calculations:
+                await db.rollback()
+                return 0, last_id
+            
+            ids = [calc['id'] for calc in calculations]
+            marks = ", ".join("?" * len(ids))
+            cursor = await db.execute(
+                f"SELECT * FROM ceiling_estimates WHERE calculation_id IN ({marks})", ids
+            )
+            estimates = [dict(row) for row in await cursor.fetchall()]
+            
+            digests = sorted({calc['recognition_digest'] for calc in calculations
+                              if calc['recognition_digest']})
+            recognitions = []
+            if digests:
+                cursor = await db.execute(
+                    f"SELECT * FROM recognitions WHERE digest IN ({', '.join('?' * len(digests))})",
+                    digests
                 )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                user_id, 
-                calculation_type,
-                room_type,
-                room_description,
-                json.dumps(measurements, ensure_ascii=False) if measurements else None,
-                perimeter,
-                area,
-                corners_count,
-                json.dumps(recognized_data, ensure_ascii=False) if recognized_data else None,
-                json.dumps(final_result, ensure_ascii=False) if final_result else None,
-                profile_type,
-                profile_quantity,
-                dowel_nails_count,
-                lighting_type,
-                json.dumps(lighting_data, ensure_ascii=False) if lighting_data else None,
-                curtain_niche_needed,
-                curtain_niche_type,
-                curtain_niche_meters,
-                curtain_ends_count,
-                curtain_tape_meters,
-                curtain_brackets_count,
-                curtain_screws_count,
-                timber_needed,
-                timber_meters,
-                timber_brackets_count,
-                fastener_type,
-                total_hangers,
-                total_dowels,
-                total_screws,
-                glue_volume
-            ))
+                recognitions = [dict(row) for row in await cursor.fetchall()]
+            await db.rollback()
+        
+        # Сначала пишем в архив: при сбое расчеты останутся в основной базе
+        await self.archive.store(calculations, estimates, recognitions)
+        
+        async with self._acquire(shard=shard) as db:
+            await db.execute(f"DELETE FROM ceiling_estimates WHERE calculation_id IN ({marks})", ids)
+            await db.execute(f"DELETE FROM calculations WHERE id IN ({marks})", ids)
+            if self.dialect == 'sqlite':
+                # Расчеты уже в индексе архива (CalculationArchive.store)
+                await db.execute(f"DELETE FROM calculations_fts WHERE rowid IN ({marks})", ids)
+            await self._delete_orphan_recognitions(db, digests)
             await db.commit()
+        
+        return len(ids), ids[-1]
     
-    async def get_user_calculations(self, telegram_id: int, limit: int = 10) -> list:
-        """Получает последние расчеты пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+    async def _strip_calculation_blobs(self, shard: int, cutoff: str, last_id: int,
+                                       batch_size: int) -> Tuple[int, int]:
+        """Удаляет тяжелые JSON-поля у одной пачки старых расчетов"""
+        async with self._acquire(shard=shard) as db:
             cursor = await db.execute("""
-                SELECT * FROM calculations 
-                WHERE user_id = ? 
-                ORDER BY created_at DESC 
+                SELECT id, recognition_digest FROM calculations
+                WHERE id > ? AND created_at < ?
+                  AND (final_result IS NOT NULL OR recognition_digest IS NOT NULL)
+                ORDER BY id
                 LIMIT ?
-            """, (telegram_id, limit))
-            
+            """, (last_id, cutoff, batch_size))
             rows = await cursor.fetchall()
-            calculations = []
+            if not rows:
+                await db.rollback()
+                return 0, last_id
             
-            for row in rows:
-                calc = dict(row)
-                # Парсим JSON поля
-                if calc['measurements']:
-                    try:
-                        calc['measurements'] = json.loads(calc['measurements'])
-                    except:
-                        calc['measurements'] = []
-                        
-                if calc['recognized_data']:
-                    try:
-                        calc['recognized_data'] = json.loads(calc['recognized_data'])
-                    except:
-                        calc['recognized_data'] = {}
-                        
-                if calc['final_result']:
-                    try:
-                        calc['final_result'] = json.loads(calc['final_result'])
-                    except:
-                        calc['final_result'] = {}
-                        
-                if calc['lighting_data']:
-                    try:
-                        calc['lighting_data'] = json.loads(calc['lighting_data'])
-                    except:
-                        calc['lighting_data'] = {}
-                        
-                calculations.append(calc)
+            ids = [row[0] for row in rows]
+            await db.execute(f"""
+                UPDATE calculations SET final_result = NULL, recognition_digest = NULL
+                WHERE id IN ({", ".join("?" * len(ids))})
+            """, ids)
+            await self._delete_orphan_recognitions(db, sorted({row[1] for row in rows if row[1]}))
+            await db.commit()
+        
+        return len(ids), ids[-1]
+    
+    @staticmethod
+    async def _delete_orphan_recognitions(db, digests: list):
+        """Удаляет результаты распознавания, на которые больше не ссылается ни один расчет"""
+        if not digests:
+            return
+        await db.execute(f"""
+            DELETE FROM recognitions
+            WHERE digest IN ({", ".join("?" * len(digests))})
+              AND NOT EXISTS (
+                  SELECT 1 FROM calculations c WHERE c.recognition_digest = recognitions.digest
+              )
+        """, digests)
+    
+    async def run_retention(self, older_than_days: int, mode: str = 'move',
+                            interval: float = 24 * 3600):
+        """Периодически архивирует старые расчеты (запускается через run_in_background)"""
+        while True:
+            try:
+                await self.archive_old_calculations(older_than_days, mode)
+            except Exception as e:
+                logger.error(f"Ошибка архивирования расчетов: {e}")
+            await asyncio.sleep(interval)
+    
+    def _calculation_stores(self, telegram_id: int, newest_first: bool = True) -> list:
+        """
+        Хранилища расчетов пользователя в порядке просмотра истории
+        
+        Все расчеты архива старше расчетов основной базы, поэтому при
+        движении к старым расчетам архив читается после шарда пользователя,
+        а при движении к новым - до него.
+        """
+        stores = [partial(self._acquire, shard=self._shard_of(telegram_id))]
+        if self.archive is not None:
+            stores.append(self.archive.acquire)
+        return stores if newest_first else stores[::-1]
+    
+    async def get_calculation(self, calculation_id: int, telegram_id: int) -> Optional[dict]:
+        """Получает расчет пользователя целиком, с разобранными JSON-полями"""
+        await self._writes(telegram_id).flush()
+        for acquire in self._calculation_stores(telegram_id):
+            async with acquire(readonly=True) as db:
+                cursor = await db.execute(
+                    f"{self.FULL_CALCULATION_SELECT} WHERE c.id = ? AND c.user_id = ?",
+                    (calculation_id, telegram_id)
+                )
+                row = await cursor.fetchone()
+            if row:
+                return self._decode_calculation(row)
+        
+        return None
+    
+    @staticmethod
+    def make_history_cursor(calc: dict) -> str:
+        """Курсор страницы истории: позиция расчета в порядке (created_at, id)"""
+        return f"{calc['created_at']}|{calc['id']}"
+    
+    @staticmethod
+    def parse_history_cursor(cursor: str) -> Tuple[str, int]:
+        """Разбирает курсор страницы истории"""
+        created_at, calc_id = cursor.rsplit('|', 1)
+        return created_at, int(calc_id)
+    
+    async def get_calculation_history(self, telegram_id: int, limit: int = 10,
+                                      before: str = None, after: str = None) -> dict:
+        """
+        Получает страницу истории расчетов (keyset-пагинация)
+        
+        Выбираются только колонки для списка (HISTORY_COLUMNS), поэтому
+        стоимость страницы не зависит ни от размера истории, ни от объема
+        JSON-полей. Полный расчет можно получить через get_calculation().
+        Расчеты, перенесенные в архив, продолжают историю после основной базы.
+        
+        Args:
+            telegram_id: ID пользователя
+            limit: Размер страницы
+            before: Курсор - вернуть расчеты старше этой позиции
+            after: Курсор - вернуть расчеты новее этой позиции
+        
+        Returns:
+            {'items': [...], 'older_cursor': str | None, 'newer_cursor': str | None}
+        """
+        await self._writes(telegram_id).flush()
+        columns = ", ".join(self.HISTORY_COLUMNS)
+        
+        if after:
+            where = "AND (created_at, id) > (?, ?)"
+            order = "ASC"
+            params = (telegram_id, *self.parse_history_cursor(after))
+        elif before:
+            where = "AND (created_at, id) < (?, ?)"
+            order = "DESC"
+            params = (telegram_id, *self.parse_history_cursor(before))
+        else:
+            where = ""
+            order = "DESC"
+            params = (telegram_id,)
+        
+        # Берем на одну строку больше, чтобы узнать, есть ли следующая страница.
+        # Когда основная база заканчивается, продолжаем читать из архива.
+        rows = []
+        for acquire in self._calculation_stores(telegram_id, newest_first=order == "DESC"):
+            async with acquire(readonly=True) as db:
+                cursor = await db.execute(f"""
+                    SELECT {columns} FROM calculations
+                    WHERE user_id = ? {where}
+                    ORDER BY created_at {order}, id {order}
+                    LIMIT ?
+                """, (*params, limit + 1 - len(rows)))
+                rows.extend(dict(row) for row in await cursor.fetchall())
+            if len(rows) > limit:
+                break
+        
+        has_more = len(rows) > limit
+        items = rows[:limit]
+        if after:
+            # Страница "новее" выбиралась по возрастанию
+            items.reverse()
+            has_older, has_newer = True, has_more
+        else:
+            has_older, has_newer = has_more, before is not None
+        
+        return {
+            'items': items,
+            'older_cursor': self.make_history_cursor(items[-1]) if items and has_older else None,
+            'newer_cursor': self.make_history_cursor(items[0]) if items and has_newer else None
+        }
+    
+    @staticmethod
+    def make_search_cursor(item: dict) -> str:
+        """Курсор страницы поиска: позиция результата в порядке (хранилище, score, id)"""
+        return f"{item['store']}|{item['score']!r}|{item['id']}"
+    
+    @staticmethod
+    def parse_search_cursor(cursor: str, dialect: str = 'sqlite') -> Tuple[int, Union[float, int], int]:
+        """
+        Разбирает курсор страницы поиска
+        
+        В SQLite score - ранг bm25 (float), в PostgreSQL - минус id расчета
+        (целое): через float большие id передавались бы неточно.
+        """
+        store, score, calc_id = cursor.split('|')
+        return int(store), float(score) if dialect == 'sqlite' else int(score), int(calc_id)
+    
+    async def search_calculations(self, telegram_id: int, query: str, limit: int = 10,
+                                  after: str = None) -> dict:
+        """
+        Полнотекстовый поиск по расчетам пользователя
+        
+        Ищет по описанию помещения, типу, заметкам распознавания и дате
+        (название месяца, ДД.ММ.ГГГГ), в том числе среди заархивированных
+        расчетов. Внутри хранилища результаты упорядочены по релевантности
+        (bm25), страницы листаются по курсору. Ранги bm25 разных индексов
+        не сравнимы, поэтому найденное в архиве идет после основной базы.
+        
+        Args:
+            telegram_id: ID пользователя
+            query: Поисковый запрос
+            limit: Размер страницы
+            after: Курсор - вернуть результаты после этой позиции
+        
+        Returns:
+            {'items': [...], 'next_cursor': str | None}
+        """
+        await self._writes(telegram_id).flush()
+        columns = ", ".join(f"c.{column}" for column in self.HISTORY_COLUMNS)
+        match = build_match_query(telegram_id, query)
+        words = query.split()
+        
+        # Шард пользователя, затем архив: у архива свой индекс FTS5
+        stores = [(partial(self._acquire_user, telegram_id), self.dialect)]
+        if self.archive is not None:
+            stores.append((self.archive.acquire, 'sqlite'))
+        
+        # Берем на одну строку больше, чтобы узнать, есть ли следующая страница.
+        # Когда основная база заканчивается, продолжаем искать в архиве.
+        rows = []
+        for store, (acquire, dialect) in enumerate(stores):
+            where = ""
+            position = []
+            if after:
+                after_store, score, calc_id = self.parse_search_cursor(after, dialect)
+                if store < after_store:
+                    continue
+                if store == after_store:
+                    where = "WHERE (m.score, m.id) > (?, ?)"
+                    position = [score, calc_id]
+            
+            if dialect == 'sqlite':
+                if match is None:
+                    continue
+                source = """
+                    SELECT rowid AS id, bm25(calculations_fts, 0.0, 1.0) AS score
+                    FROM calculations_fts
+                    WHERE calculations_fts MATCH ?
+                """
+                params = [match]
+            else:
+                # В PostgreSQL индекса FTS5 нет: ищем по описанию, новые расчеты выше
+                if not words:
+                    continue
+                source = f"""
+                    SELECT id, -id AS score FROM calculations
+                    WHERE user_id = ? {"AND room_description ILIKE ? " * len(words)}
+                """
+                params = [telegram_id, *(f"%{word}%" for word in words)]
             
-            return calculations
+            async with acquire(readonly=True) as db:
+                cursor = await db.execute(f"""
+                    SELECT {columns}, m.score
+                    FROM ({source}) m
+                    JOIN calculations c ON c.id = m.id
+                    {where}
+                    ORDER BY m.score, m.id
+                    LIMIT ?
+                """, (*params, *position, limit + 1 - len(rows)))
+                rows.extend(dict(row, store=store) for row in await cursor.fetchall())
+            if len(rows) > limit:
+                break
+        
+        items = rows[:limit]
+        return {
+            'items': items,
+            'next_cursor': self.make_search_cursor(items[-1]) if len(rows) > limit else None
+        }
     
     async def save_payment(self, user_id: int, payment_id: str, 
                           plan_type: str, amount: float):
         """Сохраняет информацию о платеже"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._acquire_user(user_id) as db:
             await db.execute("""
                 INSERT INTO payments (user_id, payment_id, plan_type, amount)
                 VALUES (?, ?, ?, ?)
@@ -337,34 +979,84 @@ class Database:
             await db.commit()
     
     async def update_payment_status(self, payment_id: str, status: str):
-        """Обновляет статус платежа"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                UPDATE payments 
-                SET status = ?
-                WHERE payment_id = ?
-            """, (status, payment_id))
-            await db.commit()
+        """
+        Обновляет статус платежа
+        
+        Если платеж становится успешным (или перестает им быть),
+        в той же транзакции поправляет агрегаты пользователя в user_stats
+        (они лежат в том же шарде, что и платеж).
+        """
+        params = {'status': status, 'payment_id': payment_id}
+        # Платеж ищется по payment_id, поэтому обновляем его во всех шардах
+        for shard in range(self.shard_count):
+            async with self._acquire(shard=shard) as db:
+                # Строка вернется, только если платеж перешел через статус succeeded
+                cursor = await db.execute("""
+                    UPDATE payments
+                    SET status = :status
+                    WHERE payment_id = :payment_id
+                      AND (status = 'succeeded') != (:status = 'succeeded')
+                    RETURNING user_id, amount
+                """, params)
+                changed = await cursor.fetchone()
+                
+                if changed is None:
+                    await db.execute("""
+                        UPDATE payments 
+                        SET status = :status
+                        WHERE payment_id = :payment_id
+                    """, params)
+                else:
+                    sign = 1 if status == 'succeeded' else -1
+                    await db.execute("""
+                        INSERT INTO user_stats (telegram_id, total_payments, total_spent)
+                        VALUES (:telegram_id, :count, :amount)
+                        ON CONFLICT (telegram_id) DO UPDATE SET
+                            total_payments = user_stats.total_payments + excluded.total_payments,
+                            total_spent = user_stats.total_spent + excluded.total_spent
+                    """, {
+                        'telegram_id': changed[0],
+                        'count': sign,
+                        'amount': sign * changed[1]
+                    })
+                await db.commit()
     
     async def get_active_subscription(self, telegram_id: int) -> Optional[str]:
         """Проверяет активную подписку пользователя"""
+        subscription = self._subscriptions.get(telegram_id)
+        if subscription is not TTLCache.MISSING:
+            return subscription
+        
+        subscription, ttl = await self._resolve_subscription(telegram_id)
+        self._subscriptions.set(telegram_id, subscription, ttl)
+        return subscription
+    
+    async def _resolve_subscription(self, telegram_id: int) -> Tuple[Optional[str], Optional[float]]:
+        """
+        Определяет активный тариф пользователя
+        
+        Returns:
+            (тариф, сколько секунд результат остается верным)
+        """
         user = await self.get_user(telegram_id)
         if not user:
-            return None
+            return None, None
             
         if user['subscription_type'] == 'free':
-            return 'free'
+            return 'free', None
             
         if user['subscription_expires']:
             expires = datetime.fromisoformat(user['subscription_expires'])
-            if expires > datetime.now():
-                return user['subscription_type']
+            now = datetime.now()
+            if expires > now:
+                # Кэшируем не дольше, чем до окончания подписки
+                return user['subscription_type'], (expires - now).total_seconds()
             else:
                 # Подписка истекла, сбрасываем на бесплатную
                 await self.update_user_subscription(telegram_id, 'free', None)
-                return 'free'
+                return 'free', None
         
-        return 'free'
+        return 'free', None
     
     async def set_admin_subscription(self, telegram_id: int, subscription_type: str, 
                                    duration_days: int = 365) -> bool:
@@ -394,6 +1086,7 @@ class Database:
             
             # Обновляем подписку
             await self.update_user_subscription(telegram_id, subscription_type, expires)
+            self._invalidate_user(telegram_id)
             
             return True
             
@@ -407,40 +1100,269 @@ class Database:
         if not user:
             return None
         
-        # Получаем статистику
-        async with aiosqlite.connect(self.db_path) as db:
-            # Количество расчетов
-            cursor = await db.execute(
-                "SELECT COUNT(*) FROM calculations WHERE user_id = ?",
-                (telegram_id,)
-            )
-            total_calculations = (await cursor.fetchone())[0]
-            
-            # Последний расчет
-            cursor = await db.execute(
-                "SELECT created_at FROM calculations WHERE user_id = ? ORDER BY created_at DESC LIMIT 1",
-                (telegram_id,)
-            )
-            last_calc = await cursor.fetchone()
-            last_calculation = last_calc[0] if last_calc else None
-            
-            # Платежи
-            cursor = await db.execute(
-                "SELECT COUNT(*), SUM(amount) FROM payments WHERE user_id = ? AND status = 'succeeded'",
-                (telegram_id,)
-            )
-            payment_data = await cursor.fetchone()
-            total_payments = payment_data[0] or 0
-            total_spent = payment_data[1] or 0
+        stats = await self.get_user_stats(telegram_id)
         
         return {
             **user,
-            'total_calculations': total_calculations,
-            'last_calculation': last_calculation,
-            'total_payments': total_payments,
-            'total_spent': total_spent
+            'daily_calculations': await self.get_usage(telegram_id, 'day'),
+            'monthly_calculations': await self.get_usage(telegram_id, 'month'),
+            'total_calculations': stats['total_calculations'],
+            'last_calculation': stats['last_calculation_at'],
+            'total_payments': stats['total_payments'],
+            'total_spent': stats['total_spent']
         }
+    
+    async def get_user_stats(self, telegram_id: int) -> dict:
+        """Агрегаты пользователя: расчеты и успешные платежи (одна строка user_stats)"""
+        # Учитываем еще не записанные расчеты
+        await self._writes(telegram_id).flush()
+        async with self._acquire_user(telegram_id, readonly=True) as db:
+            cursor = await db.execute("""
+                SELECT total_calculations, last_calculation_at, total_payments, total_spent
+                FROM user_stats
+                WHERE telegram_id = ?
+            """, (telegram_id,))
+            row = await cursor.fetchone()
+        
+        if row is None:
+            return {
+                'total_calculations': 0,
+                'last_calculation_at': None,
+                'total_payments': 0,
+                'total_spent': 0
+            }
+        return dict(row)
+    
+    async def rebuild_user_stats(self, telegram_id: int = None) -> int:
+        """
+        Пересчитывает user_stats по таблицам расчетов и платежей
+        
+        Исправляет расхождения, если агрегаты разошлись с данными.
+        Учитывает и расчеты, перенесенные в архив.
+        
+        Args:
+            telegram_id: Пользователь для пересчета (по умолчанию - все)
+        
+        Returns:
+            Количество пересчитанных строк
+        """
+        if telegram_id is not None:
+            await self._writes(telegram_id).flush()
+            shards = [self._shard_of(telegram_id)]
+        else:
+            await self.flush_writes()
+            shards = range(self.shard_count)
+        archived = await self.archive.get_user_totals(telegram_id) if self.archive else []
+        
+        count = 0
+        for shard in shards:
+            async with self._acquire(shard=shard) as db:
+                if telegram_id is None:
+                    await db.execute("DELETE FROM user_stats")
+                    await db.execute(user_stats_rebuild_sql())
+                else:
+                    params = {'telegram_id': telegram_id}
+                    await db.execute("DELETE FROM user_stats WHERE telegram_id = :telegram_id", params)
+                    await db.execute(user_stats_rebuild_sql(single_user=True), params)
+                # Расчеты в архиве тоже входят в статистику
+                await db.executemany(self._BUMP_CALCULATION_STATS_SQL, [
+                    totals for totals in archived if self._shard_of(totals[0]) == shard
+                ])
+                
+                if telegram_id is None:
+                    cursor = await db.execute("SELECT COUNT(*) FROM user_stats")
+                else:
+                    cursor = await db.execute(
+                        "SELECT COUNT(*) FROM user_stats WHERE telegram_id = ?", (telegram_id,)
+                    )
+                count += (await cursor.fetchone())[0]
+                await db.commit()
+        
+        logger.info(f"Пересчитана статистика пользователей: {count}")
+        return count
+    
+    async def get_global_stats(self) -> dict:
+        """
+        Общая статистика бота для админа
+        
+        В режиме шардирования запросы выполняются во всех шардах
+        параллельно, результаты складываются.
+        """
+        await self.flush_writes()
+        
+        async def shard_stats(shard: int) -> dict:
+            async with self._acquire(readonly=True, shard=shard) as db:
+                cursor = await db.execute("""
+                    SELECT
+                        (SELECT COUNT(*) FROM users) AS users,
+                        (SELECT COUNT(*) FROM users WHERE subscription_type != 'free') AS subscribers,
+                        (SELECT COALESCE(SUM(total_calculations), 0) FROM user_stats) AS calculations,
+                        (SELECT COALESCE(SUM(total_payments), 0) FROM user_stats) AS payments,
+                        (SELECT COALESCE(SUM(total_spent), 0) FROM user_stats) AS revenue
+                """)
+                return dict(await cursor.fetchone())
+        
+        results = await asyncio.gather(*(shard_stats(shard) for shard in range(self.shard_count)))
+        totals = {key: sum(result[key] for result in results) for key in results[0]}
+        totals['shards'] = [result['users'] for result in results]
+        return totals
+    
+    async def redistribute_shards(self, batch_size: int = 100) -> int:
+        """
+        Переносит пользователей в их шарды после включения шардирования
+        или изменения количества шардов
+        
+        Вместе с пользователем переносятся его счетчики, агрегаты, платежи
+        и расчеты (со сметами, распознаваниями и полнотекстовым индексом).
+        Можно безопасно прерывать и запускать повторно.
+        
+        Returns:
+            Количество перенесенных пользователей
+        """
+        await self.flush_writes()
+        moved = 0
+        # Пользователи, которых не удалось перенести: их данные остаются на месте
+        failed = set()
+        for shard in range(self.shard_count):
+            while True:
+                async with self._acquire(readonly=True, shard=shard) as db:
+                    cursor = await db.execute("""
+                        SELECT telegram_id FROM users
+                        UNION SELECT user_id FROM calculations
+                    """)
+                    misplaced = [row[0] for row in await cursor.fetchall()
+                                 if self._shard_of(row[0]) != shard and row[0] not in failed][:batch_size]
+                if not misplaced:
+                    break
+                for telegram_id in misplaced:
+                    if await self._move_user(telegram_id, shard, self._shard_of(telegram_id)):
+                        moved += 1
+                    else:
+                        failed.add(telegram_id)
+                    self._invalidate_user(telegram_id)
+        
+        if moved:
+            logger.info(f"Перенесено пользователей между шардами: {moved}")
+        if failed:
+            logger.error(f"Не удалось перенести между шардами пользователей: {sorted(failed)}")
+        return moved
+    
+    async def _move_user(self, telegram_id: int, source: int, target: int) -> bool:
+        """
+        Переносит все данные пользователя из одного шарда в другой
+        
+        Returns:
+            False, если не все строки оказались в целевом шарде - тогда
+            перенос отменяется и исходные данные не удаляются
+        """
+        rows = {}
+        async with self._acquire(readonly=True, shard=source) as db:
+            for table, column in USER_TABLES + (("calculations", "user_id"),):
+                cursor = await db.execute(f"SELECT * FROM {table} WHERE {column} = ?", (telegram_id,))
+                rows[table] = [dict(row) for row in await cursor.fetchall()]
+            
+            ids = [calc['id'] for calc in rows['calculations']]
+            digests = sorted({calc['recognition_digest'] for calc in rows['calculations']
+                              if calc['recognition_digest']})
+            rows['ceiling_estimates'] = rows['recognitions'] = rows['calculations_fts'] = []
+            if ids:
+                marks = ", ".join("?" * len(ids))
+                cursor = await db.execute(
+                    f"SELECT * FROM ceiling_estimates WHERE calculation_id IN ({marks})", ids
+                )
+                rows['ceiling_estimates'] = [dict(row) for row in await cursor.fetchall()]
+                cursor = await db.execute(
+                    f"SELECT rowid, user_id, body FROM calculations_fts WHERE rowid IN ({marks})", ids
+                )
+                rows['calculations_fts'] = [dict(row) for row in await cursor.fetchall()]
+            if digests:
+                cursor = await db.execute(
+                    f"SELECT * FROM recognitions WHERE digest IN ({', '.join('?' * len(digests))})",
+                    digests
+                )
+                rows['recognitions'] = [dict(row) for row in await cursor.fetchall()]
+        
+        # Сначала пишем в целевой шард: при сбое данные останутся в исходном
+        async with self._acquire(shard=target) as db:
+            for table in ("users", "usage_counters", "user_stats", "payments",
+                          "recognitions", "calculations", "ceiling_estimates", "calculations_fts"):
+                if not rows[table]:
+                    continue
+                columns = list(rows[table][0])
+                if table in SHARD_LOCAL_IDS:
+                    # Такой id в другом шарде может быть занят другой строкой
+                    columns.remove("id")
+                # Виртуальные таблицы не поддерживают ON CONFLICT
+                conflict = "ON CONFLICT DO NOTHING"
+                if table == "calculations_fts":
+                    conflict = ""
+                    await db.execute(
+                        f"DELETE FROM calculations_fts WHERE rowid IN ({', '.join('?' * len(ids))})", ids
+                    )
+                await db.executemany(f"""
+                    INSERT INTO {table} ({", ".join(columns)})
+                    VALUES ({", ".join("?" * len(columns))})
+                    {conflict}
+                """, [tuple(row[column] for column in columns) for row in rows[table]])
+            
+            # Удаляем из исходного шарда, только если каждая строка есть в целевом
+            missing = await self._missing_rows(db, rows)
+            if missing:
+                await db.rollback()
+                logger.error(
+                    f"Перенос пользователя {telegram_id} из шарда {source} в {target} отменен: "
+                    f"в целевом шарде нет строк {missing}"
+                )
+                return False
+            await db.commit()
+        
+        async with self._acquire(shard=source) as db:
+            for table, column in USER_TABLES + (("calculations_fts", "user_id"),):
+                await db.execute(f"DELETE FROM {table} WHERE {column} = ?",
+                                 (str(telegram_id) if table == "calculations_fts" else telegram_id,))
+            if ids:
+                marks = ", ".join("?" * len(ids))
+                await db.execute(f"DELETE FROM ceiling_estimates WHERE calculation_id IN ({marks})", ids)
+                await db.execute(f"DELETE FROM calculations WHERE id IN ({marks})", ids)
+            await self._delete_orphan_recognitions(db, digests)
+            await db.commit()
+        return True
+    
+    @staticmethod
+    async def _missing_rows(db, rows: dict) -> dict:
+        """Строки, которых нет в шарде: {таблица: количество}"""
+        missing = {}
+        for table, keys in ROW_KEYS.items():
+            where = " AND ".join(f"{key} = ?" for key in keys)
+            for row in rows.get(table, []):
+                cursor = await db.execute(
+                    f"SELECT 1 FROM {table} WHERE {where}", tuple(row[key] for key in keys)
+                )
+                if await cursor.fetchone() is None:
+                    missing[table] = missing.get(table, 0) + 1
+        
+        if rows.get('calculations_fts'):
+            ids = [row['rowid'] for row in rows['calculations_fts']]
+            cursor = await db.execute(
+                f"SELECT COUNT(*) FROM calculations_fts WHERE rowid IN ({', '.join('?' * len(ids))})", ids
+            )
+            lost = len(ids) - (await cursor.fetchone())[0]
+            if lost:
+                missing['calculations_fts'] = lost
+        return missing
 
 
 # Создаем экземпляр базы данных
-db = Database() 
\ No newline at end of file
+db = Database(
+    url=settings.DATABASE_URL,
+    pool_size=settings.DATABASE_POOL_SIZE,
+    write_flush_interval=settings.DATABASE_WRITE_FLUSH_INTERVAL_MS / 1000,
+    write_batch_size=settings.DATABASE_WRITE_BATCH_SIZE,
+    cache_size=settings.DATABASE_CACHE_SIZE,
+    cache_ttl=settings.DATABASE_CACHE_TTL,
+    sqlite_profile=settings.DATABASE_SQLITE_PROFILE,
+    archive_url=settings.ARCHIVE_DATABASE_URL or None,
+    shards=settings.DATABASE_SHARDS,
+    backup_dir=settings.BACKUP_DIR or None,
+    keep_backups=settings.BACKUP_KEEP
+) 
\ No newline at end of file
@@ -0,0 +1,285 @@
+import asyncio
+import copy
+import hashlib
+import time
+from typing import Any, Optional
+import logging
+
+from bot.database.backends import create_backend
+from bot.database.cache import TTLCache
+from bot.database import codec
+
+logger = logging.getLogger(__name__)
+
+
+def recognition_cache_key(image_data: bytes, model: str, prompt: str) -> str:
+    """
+    Ключ кэша распознавания
+
+    Учитывает содержимое обработанного изображения, модель и текст промпта:
+    смена модели или промпта делает старые записи недоступными.
+    """
+    prompt_digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    digest = hashlib.sha256()
+    digest.update(f"{model}\0{prompt_digest}\0".encode("utf-8"))
+    digest.update(image_data)
+    return digest.hexdigest()
+
+
+class RecognitionCache:
+    """
+    Двухуровневый кэш результатов распознавания
+
+    Первый уровень - LRU в памяти процесса, второй - файл SQLite,
+    который переживает перезапуск бота. Записи живут ttl секунд;
+    когда объем второго уровня превышает max_bytes, вытесняются
+    записи, которые дольше всего не использовались.
+
+    Ошибки второго уровня не мешают распознаванию: они только
+    записываются в лог, а кэш работает как промах.
+    """
+
+    # Как часто (в записях) проверять срок жизни и объем второго уровня
+    PRUNE_EVERY = 100
+
+    def __init__(self, url: Optional[str] = "sqlite:///recognition_cache.db",
+                 ttl: float = 30 * 24 * 3600, memory_size: int = 500,
+                 max_bytes: int = 200 * 1024 * 1024):
+        self.url = url
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.backend = create_backend(url, pool_size=1) if url else None
+        self._memory = TTLCache(maxsize=memory_size, ttl=ttl)
+        self._files = TTLCache(maxsize=memory_size * 4, ttl=ttl)
+        self._connect_lock = asyncio.Lock()
+
+        # Статистика второго уровня
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.disk_bytes = 0
+        self.evicted = 0
+        self.file_hits = 0
+        self.file_misses = 0
+        self._writes_since_prune = 0
+
+    async def connect(self):
+        """Открывает файл кэша и создает таблицу, если ее еще нет"""
+        if self.backend is None or self.backend.is_open:
+            return
+        async with self._connect_lock:
+            if self.backend.is_open:
+                return
+            await self._open()
+        await self.prune()
+        logger.info(f"Кэш распознавания открыт: {self.url}")
+
+    async def _open(self):
+        await self.backend.connect()
+        async with self.backend.acquire() as db:
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS recognition_cache (
+                    key TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+            """)
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_recognition_cache_used "
+                "ON recognition_cache (last_used_at)"
+            )
+            # Индекс файлов Telegram: file_key -> ключ результата в recognition_cache
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS recognition_files (
+                    file_key TEXT PRIMARY KEY,
+                    key TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            await db.commit()
+
+    async def close(self):
+        if self.backend is not None:
+            await self.backend.close()
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Возвращает копию закэшированного результата или None"""
+        value = self._memory.get(key)
+        if value is not TTLCache.MISSING:
+            return copy.deepcopy(value)
+        if self.backend is None:
+            return None
+
+        now = time.time()
+        try:
+            await self.connect()
+            async with self.backend.acquire(readonly=True) as db:
+                cursor = await db.execute(
+                    "SELECT data, created_at FROM recognition_cache WHERE key = ? AND created_at > ?",
+                    (key, now - self.ttl)
+                )
+                row = await cursor.fetchone()
+            if row is None:
+                self.disk_misses += 1
+                return None
+
+            value = codec.decode(row[0])
+            async with self.backend.acquire() as db:
+                await db.execute(
+                    "UPDATE recognition_cache SET last_used_at = ? WHERE key = ?", (now, key)
+                )
+                await db.commit()
+        except Exception as e:
+            logger.warning(f"Ошибка чтения кэша распознавания: {e}")
+            return None
+
+        self.disk_hits += 1
+        # Оставшийся срок жизни записи переносим в память
+        self._memory.set(key, value, ttl=row[1] + self.ttl - now)
+        return copy.deepcopy(value)
+
+    async def set(self, key: str, value: Any):
+        """Сохраняет результат распознавания на обоих уровнях"""
+        self._memory.set(key, copy.deepcopy(value))
+        if self.backend is None:
+            return
+
+        data = codec.encode(value)
+        now = time.time()
+        try:
+            await self.connect()
+            async with self.backend.acquire() as db:
+                await db.execute("""
+                    INSERT INTO recognition_cache (key, data, size, created_at, last_used_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET
+                        data = excluded.data,
+                        size = excluded.size,
+                        created_at = excluded.created_at,
+                        last_used_at = excluded.last_used_at
+                """, (key, data, len(data), now, now))
+                await db.commit()
+        except Exception as e:
+            logger.warning(f"Ошибка записи в кэш распознавания: {e}")
+            return
+
+        self.disk_bytes += len(data)
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= self.PRUNE_EVERY or self.disk_bytes > self.max_bytes:
+            await self.prune()
+
+    async def get_by_file(self, file_key: str) -> Optional[Any]:
+        """
+        Результат распознавания по ключу файла Telegram
+
+        Returns:
+            Копия результата или None, если файл не встречался или его
+            результат уже вытеснен из кэша
+        """
+        key = self._files.get(file_key)
+        if key is TTLCache.MISSING:
+            key = None
+            if self.backend is not None:
+                try:
+                    await self.connect()
+                    async with self.backend.acquire(readonly=True) as db:
+                        cursor = await db.execute(
+                            "SELECT key FROM recognition_files WHERE file_key = ?", (file_key,)
+                        )
+                        row = await cursor.fetchone()
+                    key = row[0] if row else None
+                except Exception as e:
+                    logger.warning(f"Ошибка чтения индекса файлов распознавания: {e}")
+            if key is not None:
+                self._files.set(file_key, key)
+
+        value = await self.get(key) if key is not None else None
+        if value is None:
+            self.file_misses += 1
+        else:
+            self.file_hits += 1
+        return value
+
+    async def link_file(self, file_key: str, key: str):
+        """Запоминает, что файл Telegram распознан в результат с ключом key"""
+        if self._files.get(file_key) == key:
+            return
+        self._files.set(file_key, key)
+        if self.backend is None:
+            return
+
+        try:
+            await self.connect()
+            async with self.backend.acquire() as db:
+                await db.execute("""
+                    INSERT INTO recognition_files (file_key, key, created_at)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (file_key) DO UPDATE SET
+                        key = excluded.key,
+                        created_at = excluded.created_at
+                """, (file_key, key, time.time()))
+                await db.commit()
+        except Exception as e:
+            logger.warning(f"Ошибка записи в индекс файлов распознавания: {e}")
+
+    async def prune(self) -> int:
+        """
+        Удаляет устаревшие записи и вытесняет давно не использованные,
+        пока объем второго уровня больше max_bytes
+
+        Returns:
+            Количество удаленных записей
+        """
+        if self.backend is None:
+            return 0
+
+        self._writes_since_prune = 0
+        try:
+            async with self.backend.acquire() as db:
+                cursor = await db.execute(
+                    "DELETE FROM recognition_cache WHERE created_at <= ?",
+                    (time.time() - self.ttl,)
+                )
+                removed = cursor.rowcount
+                # Оставляем самые свежие по использованию записи в пределах max_bytes
+                cursor = await db.execute("""
+                    DELETE FROM recognition_cache WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key, SUM(size) OVER (ORDER BY last_used_at DESC, key) AS used
+                            FROM recognition_cache
+                        ) WHERE used > ?
+                    )
+                """, (self.max_bytes,))
+                removed += cursor.rowcount
+                # Ссылки файлов на вытесненные результаты больше не нужны
+                await db.execute("""
+                    DELETE FROM recognition_files WHERE NOT EXISTS (
+                        SELECT 1 FROM recognition_cache c WHERE c.key = recognition_files.key
+                    )
+                """)
+                cursor = await db.execute("SELECT COALESCE(SUM(size), 0) FROM recognition_cache")
+                self.disk_bytes = (await cursor.fetchone())[0]
+                await db.commit()
+        except Exception as e:
+            logger.warning(f"Ошибка очистки кэша распознавания: {e}")
+            return 0
+
+        self.evicted += removed
+        return removed
+
+    def stats(self) -> dict:
+        """Статистика попаданий по уровням"""
+        memory = self._memory.stats()
+        hits = memory['hits'] + self.disk_hits
+        lookups = memory['hits'] + memory['misses']
+        return {
+            'memory': memory,
+            'disk_hits': self.disk_hits,
+            'disk_misses': self.disk_misses,
+            'disk_bytes': self.disk_bytes,
+            'evicted': self.evicted,
+            'file_hits': self.file_hits,
+            'file_misses': self.file_misses,
+            'hit_rate': hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,68 @@
+from datetime import datetime
+from typing import Optional
+import re
+
+# Названия месяцев в именительном и родительном падеже ("март", "марта"),
+# чтобы находились запросы вроде "кухня март" и "кухня 15 марта"
+MONTH_NAMES = (
+    ("январь", "января"), ("февраль", "февраля"), ("март", "марта"),
+    ("апрель", "апреля"), ("май", "мая"), ("июнь", "июня"),
+    ("июль", "июля"), ("август", "августа"), ("сентябрь", "сентября"),
+    ("октябрь", "октября"), ("ноябрь", "ноября"), ("декабрь", "декабря"),
+)
+
+ROOM_TYPE_WORDS = {
+    'rectangle': "прямоугольник",
+    'complex': "сложная форма",
+}
+
+CALCULATION_TYPE_WORDS = {
+    'perimeter': "периметр",
+    'area': "площадь",
+    'both': "периметр площадь",
+    'ceiling': "натяжной потолок",
+}
+
+# Слова поискового запроса: буквы и цифры
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def search_text(room_description: Optional[str], room_type: Optional[str],
+                calculation_type: Optional[str], created_at: Optional[str],
+                notes: Optional[str] = None) -> str:
+    """Текст расчета для полнотекстового индекса"""
+    parts = [
+        room_description,
+        room_type,
+        ROOM_TYPE_WORDS.get(room_type),
+        CALCULATION_TYPE_WORDS.get(calculation_type),
+        notes,
+    ]
+
+    if created_at:
+        try:
+            moment = datetime.strptime(created_at[:10], "%Y-%m-%d")
+        except ValueError:
+            moment = None
+        if moment:
+            parts.extend(MONTH_NAMES[moment.month - 1])
+            parts.append(moment.strftime("%d.%m.%Y %Y"))
+
+    return " ".join(part for part in parts if part)
+
+
+def build_match_query(telegram_id: int, query: str) -> Optional[str]:
+    """
+    Строит выражение FTS5 MATCH для поиска по расчетам пользователя
+
+    Каждое слово ищется как префикс ("кух" находит "кухня"), все слова
+    должны встретиться. Спецсимволы FTS5 в запросе не интерпретируются.
+
+    Returns:
+        Выражение MATCH или None, если в запросе нет слов
+    """
+    tokens = _TOKEN_RE.findall(query.lower())
+    if not tokens:
+        return None
+    terms = " AND ".join(f'"{token}"*' for token in tokens[:10])
+    return f'user_id : "{int(telegram_id)}" AND body : ({terms})'
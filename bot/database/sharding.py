@@ -0,0 +1,58 @@
+from typing import List
+import zlib
+
+# Таблицы с данными пользователя: (таблица, колонка с telegram_id)
+USER_TABLES = (
+    ("users", "telegram_id"),
+    ("usage_counters", "telegram_id"),
+    ("user_stats", "telegram_id"),
+    ("payments", "user_id"),
+)
+
+# Естественные ключи строк при переносе между шардами. Суррогатные id
+# (AUTOINCREMENT) у каждого шарда свои, поэтому не переносятся; исключение -
+# calculations.id, который выделяется уникальным для всех шардов
+ROW_KEYS = {
+    "users": ("telegram_id",),
+    "usage_counters": ("telegram_id", "period_kind", "period_start"),
+    "user_stats": ("telegram_id",),
+    "payments": ("payment_id",),
+    "recognitions": ("digest",),
+    "calculations": ("id", "user_id"),
+    "ceiling_estimates": ("calculation_id",),
+}
+
+# Таблицы, чей AUTOINCREMENT id локален для шарда
+SHARD_LOCAL_IDS = ("users", "payments", "recognitions")
+
+
+def shard_for(telegram_id: int, count: int) -> int:
+    """
+    Номер шарда, в котором хранятся данные пользователя
+
+    Хэш стабилен между запусками и процессами (в отличие от hash() для строк),
+    поэтому пользователь всегда попадает в один и тот же файл, пока не
+    меняется количество шардов.
+    """
+    if count <= 1:
+        return 0
+    return zlib.crc32(str(int(telegram_id)).encode()) % count
+
+
+def shard_urls(url: str, count: int) -> List[str]:
+    """
+    Адреса файлов шардов SQLite
+
+    Шард 0 - исходный файл, остальные лежат рядом с ним:
+    sqlite:///bot.db -> bot.db, bot.shard1.db, bot.shard2.db, ...
+    """
+    scheme, sep, rest = url.partition("://")
+    if scheme.lower() != "sqlite" or not sep:
+        raise ValueError("Шардирование поддерживается только для SQLite")
+    if count <= 1:
+        return [url]
+
+    stem, dot, suffix = rest.rpartition(".")
+    if not dot or "/" in suffix:
+        stem, suffix = rest, "db"
+    return [url] + [f"{scheme}://{stem}.shard{index}.{suffix}" for index in range(1, count)]
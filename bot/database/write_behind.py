@@ -0,0 +1,132 @@
+import asyncio
+from typing import Callable, List, Tuple, Optional, AsyncContextManager
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """
+    Очередь отложенной записи с групповым коммитом
+
+    Собирает операции записи от всех пользователей и сбрасывает их
+    в базу одной транзакцией (executemany по каждому SQL-выражению)
+    раз в flush_interval секунд или при накоплении max_batch строк.
+
+    Внутри пачки операции группируются по тексту SQL, поэтому в очередь
+    можно ставить только независимые друг от друга выражения
+    (вставки, инкременты счетчиков).
+    """
+
+    def __init__(self, acquire: Callable[[], AsyncContextManager],
+                 flush_interval: float = 0.05, max_batch: int = 100):
+        self._acquire = acquire
+        self.flush_interval = flush_interval
+        self.max_batch = max(1, max_batch)
+
+        self._pending: List[Tuple[str, tuple]] = []
+        self._has_items = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        # Статистика
+        self.flushed_batches = 0
+        self.flushed_rows = 0
+        self.failed_rows = 0
+
+    @property
+    def pending(self) -> int:
+        """Количество операций, ожидающих записи"""
+        return len(self._pending)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Запускает фоновую задачу сброса очереди"""
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновую задачу и надежно сбрасывает остаток очереди"""
+        if self._task is not None:
+            # Отменяем задачу только вне сброса, чтобы не потерять пачку
+            async with self._flush_lock:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def enqueue(self, sql: str, params: tuple):
+        """Ставит операцию записи в очередь"""
+        self._pending.append((sql, params))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch:
+            self._batch_full.set()
+
+    async def flush(self):
+        """Записывает все накопленные операции одной транзакцией"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+
+            batch, self._pending = self._pending, []
+            self._has_items.clear()
+            self._batch_full.clear()
+
+            # Группируем параметры по SQL, сохраняя порядок внутри группы
+            groups = {}
+            for sql, params in batch:
+                groups.setdefault(sql, []).append(params)
+
+            try:
+                async with self._acquire() as db:
+                    for sql, rows in groups.items():
+                        await db.executemany(sql, rows)
+                    await db.commit()
+            except Exception as e:
+                logger.error(f"Ошибка группового сброса ({len(batch)} строк): {e}")
+                try:
+                    await self._write_one_by_one(batch)
+                except Exception:
+                    # База недоступна - возвращаем пачку в начало очереди
+                    self._pending[:0] = batch
+                    self._has_items.set()
+                    raise
+                return
+
+            self.flushed_batches += 1
+            self.flushed_rows += len(batch)
+
+    async def _write_one_by_one(self, batch: List[Tuple[str, tuple]]):
+        """Повторяет запись построчно, чтобы одна плохая строка не теряла всю пачку"""
+        async with self._acquire() as db:
+            for sql, params in batch:
+                try:
+                    await db.execute(sql, params)
+                    await db.commit()
+                    self.flushed_rows += 1
+                except Exception as e:
+                    await db.rollback()
+                    self.failed_rows += 1
+                    logger.error(f"Не удалось записать строку {params!r}: {e}")
+
+    async def _run(self):
+        """Фоновый цикл: ждет данных и сбрасывает их по таймеру или размеру пачки"""
+        while True:
+            await self._has_items.wait()
+            if len(self._pending) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка в очереди отложенной записи: {e}")
+                await asyncio.sleep(self.flush_interval)
@@ -1,6 +1,7 @@
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from bot.database.models import db
+from bot.utils.gemini_api import recognizer
 from config.settings import settings
 import logging
 
@@ -28,6 +29,12 @@ async def admin_help(message: types.Message):
 /set_sub <user_id> <type> [days] - Установить подписку
 /user_info <user_id> - Информация о пользователе
 /unlimited <user_id> - Безлимитная подписка
+/stats - Общая статистика бота
+
+**Обслуживание:**
+/rebuild_stats [user_id] - Пересчитать статистику пользователей
+/db_status - Резервные копии и обслуживание БД
+/recognition_stats - Очередь распознавания фото
 
 **Типы подписок:**
 • free - Бесплатная
@@ -172,6 +179,7 @@ async def get_user_info(message: types.Message):
 📊 **Статистика:**
 • Всего расчетов: {user_info['total_calculations']}
 • Расчетов сегодня: {user_info['daily_calculations']}
+• Расчетов за месяц: {user_info['monthly_calculations']}
 • Последний расчет: {user_info.get('last_calculation', 'Никогда')[:10] if user_info.get('last_calculation') else 'Никогда'}
 
 💰 **Платежи:**
@@ -181,4 +189,130 @@ async def get_user_info(message: types.Message):
 📅 **Регистрация:** {user_info['created_at'][:10]}
     """
     
-    await message.answer(text.strip(), parse_mode="Markdown") 
\ No newline at end of file
+    await message.answer(text.strip(), parse_mode="Markdown")
+
+
+@router.message(Command("rebuild_stats"))
+async def rebuild_stats(message: types.Message):
+    """Пересчитывает агрегированную статистику пользователей"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора.")
+        return
+    
+    # Парсим команду
+    parts = message.text.split()
+    if len(parts) > 2:
+        await message.answer(
+            "❌ Неверный формат команды.\n"
+            "Используйте: /rebuild_stats [user_id]"
+        )
+        return
+    
+    try:
+        user_id = int(parts[1]) if len(parts) == 2 else None
+    except ValueError:
+        await message.answer("❌ Неверный ID пользователя.")
+        return
+    
+    try:
+        count = await db.rebuild_user_stats(user_id)
+    except Exception as e:
+        logger.error(f"Ошибка пересчета статистики: {e}")
+        await message.answer("❌ Ошибка при пересчете статистики.")
+        return
+    
+    target = f"пользователя {user_id}" if user_id else "всех пользователей"
+    await message.answer(f"✅ Статистика {target} пересчитана (строк: {count}).")
+    logger.info(f"Admin {message.from_user.id} rebuilt user stats for {user_id or 'all users'}")
+
+
+@router.message(Command("stats"))
+async def global_stats(message: types.Message):
+    """Общая статистика бота (по всем шардам базы)"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора.")
+        return
+    
+    stats = await db.get_global_stats()
+    
+    text = f"""
+📈 **СТАТИСТИКА БОТА**
+
+👥 **Пользователей:** {stats['users']}
+💳 **С подпиской:** {stats['subscribers']}
+📊 **Расчетов:** {stats['calculations']}
+💰 **Платежей:** {stats['payments']} на {stats['revenue']:.2f} ₽
+    """.strip()
+    if len(stats['shards']) > 1:
+        text += f"\n🗂 **Пользователей по шардам:** {', '.join(map(str, stats['shards']))}"
+    
+    await message.answer(text, parse_mode="Markdown")
+
+
+@router.message(Command("db_status"))
+async def db_maintenance_status(message: types.Message):
+    """Последние запуски резервного копирования, VACUUM и ANALYZE"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора.")
+        return
+    
+    titles = {
+        'backup': "💾 Резервная копия",
+        'vacuum': "🧹 Incremental vacuum",
+        'analyze': "📐 ANALYZE",
+    }
+    status = db.maintenance.status()
+    
+    lines = ["🛠 ОБСЛУЖИВАНИЕ БД", ""]
+    for task, title in titles.items():
+        info = status.get(task)
+        if info is None:
+            lines.append(f"{title}: еще не запускалось")
+        elif 'error' in info:
+            lines.append(f"{title}: {info['started_at']} UTC - ошибка: {info['error']}")
+        else:
+            lines.append(f"{title}: {info['started_at']} UTC, {info['seconds']} с")
+    
+    # Без Markdown: пути и тексты ошибок могут содержать спецсимволы
+    await message.answer("\n".join(lines), parse_mode=None)
+
+
+@router.message(Command("recognition_stats"))
+async def recognition_stats(message: types.Message):
+    """Статистика очереди запросов к Gemini"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора.")
+        return
+    
+    stats = recognizer.stats()
+    cache = stats['cache']
+    similar = stats['similar']
+    breaker = stats['breaker']
+    breaker_text = {
+        'closed': '🟢 работает',
+        'open': f"🔴 отключено, проба через {breaker['retry_after']} с",
+        'half_open': '🟡 пробный запрос'
+    }[breaker['state']]
+    
+    text = f"""
+🤖 **РАСПОЗНАВАНИЕ**
+
+⚙️ **Одновременных запросов:** {stats['active']} из {stats['max_concurrency']}
+⏳ **В очереди:** {stats['waiting']}
+📨 **Всего запросов:** {stats['requests']}
+🔗 **Объединено одинаковых:** {stats['coalesced']}, выполняется {stats['in_flight']}
+🔁 **Повторов после ошибок:** {stats['retries']}
+🚦 **Gemini:** {breaker_text}
+• Ошибок подряд: {breaker['failures']}, отключений: {breaker['opened']}, отклонено запросов: {breaker['rejected']}
+⏱ **Ожидание в очереди:** среднее {stats['avg_wait']} с, максимум {stats['max_wait']} с
+
+🗃 **Кэш результатов:** попаданий {cache['hit_rate']:.0%}
+• В памяти: {cache['memory']['size']} записей, попаданий {cache['memory']['hits']}
+• На диске: {cache['disk_bytes'] / 1024 / 1024:.1f} МБ, попаданий {cache['disk_hits']}, вытеснено {cache['evicted']}
+• По file\\_unique\\_id (без скачивания): {cache['file_hits']}
+
+🖼 **Похожие снимки:** предложено прошлых результатов {similar['hits']} ({similar['hit_rate']:.0%})
+• Помним {similar['images']} снимков {similar['users']} пользователей
+    """.strip()
+    
+    await message.answer(text, parse_mode="Markdown")
@@ -1,4 +1,5 @@
 from aiogram import Router, types, F
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from bot.keyboards.main import (
@@ -19,18 +20,26 @@ from bot.keyboards.main import (
     get_yes_no_keyboard,
     get_curtain_niche_type_keyboard,
     get_fastener_type_keyboard,
-    get_estimate_keyboard
+    get_estimate_keyboard,
+    get_history_keyboard,
+    get_search_keyboard,
+    get_similar_photo_keyboard
 )
 from bot.database.models import db
 from bot.utils.gemini_api import recognizer
 from bot.utils.calculator import calculator
 from bot.utils.ceiling_calculator import ceiling_calc
 from bot.utils.image_processor import image_processor
+from bot.utils.deadline import Deadline
+from bot.utils.resilience import CircuitOpenError, ServiceUnavailableError
 from config.settings import settings
 import logging
+import asyncio
 import io
 import json
+import zlib
 from datetime import datetime
+from typing import Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -64,21 +73,18 @@ class CalculationStates(StatesGroup):
     custom_crossings_input = State()
 
 
-@router.message(F.text == "📐 Рассчитать размеры")
-async def start_calculation(message: types.Message, state: FSMContext):
-    """Начало процесса расчета"""
-    # Проверяем лимиты пользователя
-    user_id = message.from_user.id
-    
-    # Получаем активную подписку
-    subscription = await db.get_active_subscription(user_id)
-    calculations_today = await db.get_user_calculations_today(user_id)
-    
-    # Проверяем лимиты
-    limit = settings.SUBSCRIPTION_LIMITS.get(subscription, 2)
-    
-    if subscription == 'free' and calculations_today >= limit:
-        await message.answer(
+PLAN_NAMES = {
+    'free': 'Бесплатный',
+    'basic': 'Базовый',
+    'pro': 'Профи',
+    'unlimited': 'Безлимит'
+}
+
+
+def get_limit_exceeded_text(plan: str) -> str:
+    """Текст сообщения об исчерпанном лимите тарифа"""
+    if plan in (None, 'free'):
+        return (
             "❌ Вы исчерпали дневной лимит бесплатных расчетов (2 в день).\n\n"
             "💳 Оформите подписку для продолжения работы:\n"
             "• Базовый - 50 расчетов/месяц (199₽)\n"
@@ -86,12 +92,49 @@ async def start_calculation(message: types.Message, state: FSMContext):
             "• Безлимит - неограниченно (799₽)\n\n"
             "Нажмите «💳 Подписка» в главном меню."
         )
-        return
     
-    elif subscription != 'unlimited' and subscription != 'free':
-        # Для платных подписок проверяем месячный лимит
-        # TODO: добавить проверку месячного лимита
-        pass
+    limit = settings.SUBSCRIPTION_LIMITS.get(plan)
+    return (
+        f"❌ Вы исчерпали месячный лимит тарифа «{PLAN_NAMES.get(plan, plan)}» "
+        f"({limit} расчетов).\n\n"
+        "💳 Для продолжения работы перейдите на тариф выше.\n"
+        "Нажмите «💳 Подписка» в главном меню."
+    )
+
+
+async def reserve_quota(state: FSMContext, user_id: int) -> Tuple[bool, Optional[str]]:
+    """
+    Резервирует расчет из лимита пользователя, если он еще не зарезервирован
+    
+    Returns:
+        (разрешен ли расчет, активный тариф)
+    """
+    data = await state.get_data()
+    if data.get('quota_reserved'):
+        return True, data.get('subscription')
+    
+    allowed, subscription = await db.reserve_calculation(user_id)
+    if allowed:
+        await state.update_data(quota_reserved=True, subscription=subscription)
+    return allowed, subscription
+
+
+async def release_quota(state: FSMContext, user_id: int):
+    """Возвращает зарезервированный, но не использованный расчет"""
+    data = await state.get_data()
+    if data.get('quota_reserved'):
+        await db.release_calculation(user_id)
+        await state.update_data(quota_reserved=False)
+
+
+@router.message(F.text == "📐 Рассчитать размеры")
+async def start_calculation(message: types.Message, state: FSMContext):
+    """Начало процесса расчета"""
+    # Атомарно проверяем и резервируем лимит пользователя
+    allowed, subscription = await reserve_quota(state, message.from_user.id)
+    if not allowed:
+        await message.answer(get_limit_exceeded_text(subscription))
+        return
     
     await state.set_state(CalculationStates.choosing_type)
     await message.answer(
@@ -191,46 +234,149 @@ async def change_fabric_width(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@router.message(CalculationStates.waiting_for_photo, F.photo)
-async def process_photo(message: types.Message, state: FSMContext):
-    """Обработка фотографии с замерами"""
-    await message.answer("⏳ Обрабатываю изображение...")
+async def prepare_photo(message: types.Message, file_id: str, deadline: Deadline) -> Optional[bytes]:
+    """
+    Скачивает, проверяет и обрабатывает фото в пределах общего срока
+    
+    Returns:
+        Обработанное изображение или None - пользователь уже получил сообщение об ошибке
+    """
+    file = await deadline.run(message.bot.get_file(file_id))
+    
+    # Скачиваем фото
+    photo_bytes = io.BytesIO()
+    await deadline.run(message.bot.download_file(file.file_path, photo_bytes))
+    photo_data = photo_bytes.getvalue()
+    
+    # Валидируем изображение
+    is_valid, error_msg = await deadline.run(image_processor.validate_image(photo_data))
+    if not is_valid:
+        await message.answer(
+            f"❌ {error_msg}\n\n"
+            "Попробуйте отправить другое фото или введите размеры вручную.",
+            reply_markup=get_manual_input_keyboard()
+        )
+        return None
+    
+    # Обрабатываем изображение
+    processed_image = await deadline.run(image_processor.process_image(photo_data))
+    if not processed_image:
+        await message.answer(
+            "❌ Не удалось обработать изображение.\n\n"
+            "Попробуйте отправить другое фото или введите размеры вручную.",
+            reply_markup=get_manual_input_keyboard()
+        )
+        return None
+    
+    return processed_image
+
+
+async def show_recognition_result(message: types.Message, state: FSMContext,
+                                  recognition_result: dict, reused: bool = False):
+    """Показывает распознанные размеры и ждет их подтверждения"""
+    await state.update_data(recognition_data=recognition_result)
+    
+    # Показываем распознанные размеры
+    formatted_text = recognizer.format_measurements_text(recognition_result)
+    
+    # Выбираем подходящую клавиатуру
+    data = await state.get_data()
+    calc_type = data.get('calculation_type', 'both')
+    
+    if calc_type in ['fabric', 'complete']:
+        keyboard = get_confirmation_with_fabric_keyboard(recognize_again=reused)
+    else:
+        keyboard = get_confirmation_keyboard(recognize_again=reused)
+    
+    reused_text = (
+        "♻️ Показываю прошлый результат распознавания. "
+        "Если размеры не совпадают, нажмите «🔄 Распознать заново».\n\n"
+        if reused else ""
+    )
+    await message.answer(
+        f"✅ Размеры распознаны!\n\n{formatted_text}\n\n"
+        f"{reused_text}"
+        "Все правильно?",
+        reply_markup=keyboard
+    )
+    
+    await state.set_state(CalculationStates.confirming_measurements)
+
+
+async def recognize_photo(message: types.Message, state: FSMContext, user_id: int,
+                          file_id: str, file_unique_id: str, refresh: bool = False,
+                          offer_similar: bool = True):
+    """
+    Распознает фото и показывает найденные размеры
+    
+    Результат берется из прошлых распознаваний, если это тот же файл
+    Telegram или то же изображение. Похожий снимок того же пользователя
+    только предлагается на выбор: перцептивный хэш не различает цифры,
+    и другой чертеж на том же шаблоне выглядит для него так же.
+    
+    Args:
+        refresh: Не брать готовый результат, а распознать заново; уже
+            скачанный и обработанный снимок используется повторно
+        offer_similar: Предлагать результат похожего снимка (False -
+            пользователь уже выбрал распознавание этого фото)
+    """
+    # Общий срок на всю цепочку: скачивание, проверка, обработка, распознавание
+    deadline = Deadline(settings.IMAGE_PROCESSING_TIMEOUT + settings.GEMINI_TIMEOUT)
     
     try:
-        # Получаем фото в максимальном качестве
-        photo = message.photo[-1]
-        file = await message.bot.get_file(photo.file_id)
+        recognition_result = None
+        if not refresh:
+            # Этот файл уже распознавался (например, фото переслали) - не скачиваем его
+            recognition_result = await deadline.run(recognizer.recognize_file(file_unique_id))
         
-        # Скачиваем фото
-        photo_bytes = io.BytesIO()
-        await message.bot.download_file(file.file_path, photo_bytes)
-        photo_data = photo_bytes.getvalue()
-        
-        # Валидируем изображение
-        is_valid, error_msg = await image_processor.validate_image(photo_data)
-        if not is_valid:
-            await message.answer(
-                f"❌ {error_msg}\n\n"
-                "Попробуйте отправить другое фото или введите размеры вручную.",
-                reply_markup=get_manual_input_keyboard()
-            )
-            return
-        
-        # Обрабатываем изображение
-        processed_image = await image_processor.process_image(photo_data)
-        if not processed_image:
-            await message.answer(
-                "❌ Не удалось обработать изображение.\n\n"
-                "Попробуйте отправить другое фото или введите размеры вручную.",
-                reply_markup=get_manual_input_keyboard()
+        reused = recognition_result is not None
+        if recognition_result is None:
+            # Gemini сейчас сбоит - не заставляем ждать заведомо неудачный запрос
+            if not recognizer.breaker.available():
+                raise CircuitOpenError(recognizer.breaker.retry_after())
+            
+            recent = recognizer.recent_image(file_unique_id)
+            if recent is not None:
+                # Фото только что обрабатывалось - не скачиваем его повторно
+                processed_image, image_hash = recent
+            else:
+                processed_image = await prepare_photo(message, file_id, deadline)
+                if processed_image is None:
+                    return
+                image_hash = await deadline.run(image_processor.perceptual_hash(processed_image))
+                recognizer.remember_image(file_unique_id, processed_image, image_hash)
+            
+            # Возможно, это пересъемка недавнего листа - спрашиваем пользователя
+            if offer_similar and not refresh:
+                similar_result = await recognizer.recognize_similar(user_id, image_hash)
+                if similar_result is not None:
+                    await state.update_data(
+                        similar_data=similar_result,
+                        photo_file_id=file_id,
+                        photo_unique_id=file_unique_id
+                    )
+                    await message.answer(
+                        "♻️ Похоже, этот лист вы недавно уже присылали.\n\n"
+                        "Если на фото другое помещение или другие размеры - распознаю его заново. "
+                        "Если это тот же чертеж, можно взять прошлые размеры.",
+                        reply_markup=get_similar_photo_keyboard()
+                    )
+                    return
+            
+            # Распознаем размеры: не дольше GEMINI_TIMEOUT и не позже общего срока
+            await message.answer("🤖 Распознаю размеры...")
+            recognition_result = await recognizer.recognize_measurements(
+                processed_image,
+                timeout=deadline.budget(settings.GEMINI_TIMEOUT),
+                file_unique_id=file_unique_id,
+                telegram_id=user_id,
+                image_hash=image_hash,
+                refresh=refresh
             )
-            return
-        
-        # Распознаем размеры
-        await message.answer("🤖 Распознаю размеры...")
-        recognition_result = await recognizer.recognize_measurements(processed_image)
         
         if not recognition_result or not await recognizer.validate_recognition(recognition_result):
+            # Неудачное распознавание не расходует лимит
+            await release_quota(state, user_id)
             await message.answer(
                 "❌ Не удалось распознать размеры на фото.\n\n"
                 "Возможные причины:\n"
@@ -242,29 +388,31 @@ async def process_photo(message: types.Message, state: FSMContext):
             )
             return
         
-        # Сохраняем результат распознавания
-        await state.update_data(recognition_data=recognition_result)
-        
-        # Показываем распознанные размеры
-        formatted_text = recognizer.format_measurements_text(recognition_result)
-        
-        # Выбираем подходящую клавиатуру
-        data = await state.get_data()
-        calc_type = data.get('calculation_type', 'both')
-        
-        if calc_type in ['fabric', 'complete']:
-            keyboard = get_confirmation_with_fabric_keyboard()
-        else:
-            keyboard = get_confirmation_keyboard()
+        # Сохраняем фото для повторного распознавания
+        await state.update_data(photo_file_id=file_id, photo_unique_id=file_unique_id)
+        await show_recognition_result(message, state, recognition_result, reused)
         
+    except asyncio.TimeoutError:
+        logger.warning(
+            f"Обработка фото пользователя {user_id} "
+            f"не уложилась в {deadline.seconds} с"
+        )
+        # Несостоявшееся распознавание не расходует лимит
+        await release_quota(state, user_id)
         await message.answer(
-            f"✅ Размеры распознаны!\n\n{formatted_text}\n\n"
-            "Все правильно?",
-            reply_markup=keyboard
+            "⌛ Распознавание заняло слишком много времени.\n\n"
+            "Попробуйте отправить фото еще раз или введите размеры вручную.",
+            reply_markup=get_manual_input_keyboard()
+        )
+    except ServiceUnavailableError as e:
+        logger.warning(f"Распознавание для пользователя {user_id} недоступно: {e}")
+        # Несостоявшееся распознавание не расходует лимит
+        await release_quota(state, user_id)
+        await message.answer(
+            "⚠️ Сервис распознавания временно недоступен.\n\n"
+            "Введите размеры вручную или отправьте фото еще раз через пару минут.",
+            reply_markup=get_manual_input_keyboard()
         )
-        
-        await state.set_state(CalculationStates.confirming_measurements)
-        
     except Exception as e:
         logger.error(f"Ошибка при обработке фото: {e}")
         await message.answer(
@@ -274,6 +422,66 @@ async def process_photo(message: types.Message, state: FSMContext):
         )
 
 
+@router.message(CalculationStates.waiting_for_photo, F.photo)
+async def process_photo(message: types.Message, state: FSMContext):
+    """Обработка фотографии с замерами"""
+    await message.answer("⏳ Обрабатываю изображение...")
+    
+    # Получаем фото в максимальном качестве
+    photo = message.photo[-1]
+    await recognize_photo(message, state, message.from_user.id, photo.file_id, photo.file_unique_id)
+
+
+@router.callback_query(CalculationStates.confirming_measurements, F.data == "recognize_again")
+async def recognize_photo_again(callback: types.CallbackQuery, state: FSMContext):
+    """Повторное распознавание фото без прошлого результата"""
+    data = await state.get_data()
+    file_id = data.get('photo_file_id')
+    if not file_id:
+        await callback.answer("Фото не найдено, отправьте его еще раз", show_alert=True)
+        return
+    
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await recognize_photo(
+        callback.message, state, callback.from_user.id,
+        file_id, data.get('photo_unique_id'), refresh=True
+    )
+
+
+@router.callback_query(CalculationStates.waiting_for_photo, F.data == "recognize_photo")
+async def recognize_similar_photo(callback: types.CallbackQuery, state: FSMContext):
+    """Пользователь прислал другой лист - распознаем фото, не предлагая похожий"""
+    data = await state.get_data()
+    file_id = data.get('photo_file_id')
+    if not file_id:
+        await callback.answer("Фото не найдено, отправьте его еще раз", show_alert=True)
+        return
+    
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await state.update_data(similar_data=None)
+    await recognize_photo(
+        callback.message, state, callback.from_user.id,
+        file_id, data.get('photo_unique_id'), offer_similar=False
+    )
+
+
+@router.callback_query(CalculationStates.waiting_for_photo, F.data == "use_previous_recognition")
+async def use_previous_recognition(callback: types.CallbackQuery, state: FSMContext):
+    """Пользователь подтвердил, что прислал тот же лист - берем прошлые размеры"""
+    data = await state.get_data()
+    similar_data = data.get('similar_data')
+    if not similar_data:
+        await callback.answer("Прошлые размеры не найдены, отправьте фото еще раз", show_alert=True)
+        return
+    
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await state.update_data(similar_data=None)
+    await show_recognition_result(callback.message, state, similar_data, reused=True)
+
+
 @router.callback_query(F.data == "manual_input")
 async def start_manual_input(callback: types.CallbackQuery, state: FSMContext):
     """Начало ручного ввода размеров"""
@@ -379,6 +587,17 @@ async def confirm_and_calculate(callback: types.CallbackQuery, state: FSMContext
         await callback.answer()
         return
     
+    # Лимит мог быть возвращен после неудачного распознавания
+    allowed, subscription = await reserve_quota(state, user_id)
+    if not allowed:
+        await state.clear()
+        await callback.message.edit_text(
+            get_limit_exceeded_text(subscription),
+            reply_markup=get_back_to_menu_keyboard()
+        )
+        await callback.answer()
+        return
+    
     try:
         # Проверяем, есть ли несколько помещений
         rooms = recognition_data.get('rooms', [])
@@ -468,12 +687,11 @@ async def confirm_and_calculate(callback: types.CallbackQuery, state: FSMContext
                 measurements=result.get('measurements', []),
                 perimeter=result.get('perimeter', {}).get('value_m'),
                 area=result.get('area', {}).get('value_m2'),
-                room_description=room_description
+                room_description=room_description,
+                # Все помещения ссылаются на одну запись распознавания
+                recognized_data=recognition_data
             )
         
-        # Увеличиваем счетчик использований
-        await db.increment_user_calculations(user_id)
-        
         # Отправляем результат
         # Если текст слишком длинный, разбиваем на части
         if len(result_text) > 4000:
@@ -549,6 +767,7 @@ async def retry_photo(callback: types.CallbackQuery, state: FSMContext):
 @router.callback_query(F.data == "cancel")
 async def cancel_calculation(callback: types.CallbackQuery, state: FSMContext):
     """Отмена расчета"""
+    await release_quota(state, callback.from_user.id)
     await state.clear()
     await callback.message.delete()
     await callback.message.answer(
@@ -561,6 +780,7 @@ async def cancel_calculation(callback: types.CallbackQuery, state: FSMContext):
 @router.callback_query(F.data == "main_menu")
 async def back_to_menu(callback: types.CallbackQuery, state: FSMContext):
     """Возврат в главное меню"""
+    await release_quota(state, callback.from_user.id)
     await state.clear()
     await callback.message.delete()
     await callback.message.answer(
@@ -570,31 +790,9 @@ async def back_to_menu(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@router.message(F.text == "📊 Мои расчеты")
-async def show_calculations_history(message: types.Message):
-    """Показ истории расчетов"""
-    user_id = message.from_user.id
-    
-    # Проверяем подписку
-    subscription = await db.get_active_subscription(user_id)
-    if subscription == 'free':
-        await message.answer(
-            "📊 История расчетов доступна только для подписчиков.\n\n"
-            "💳 Оформите подписку для доступа к:\n"
-            "• Истории всех расчетов\n"
-            "• Экспорту результатов\n"
-            "• Приоритетной поддержке"
-        )
-        return
-    
-    # Получаем последние расчеты
-    calculations = await db.get_user_calculations(user_id, limit=20)
-    
-    if not calculations:
-        await message.answer("У вас пока нет сохраненных расчетов.")
-        return
-    
-    text = "📊 **Ваши последние расчеты:**\n\n"
+def format_history_text(calculations: list, subscription: str) -> str:
+    """Форматирует страницу истории расчетов"""
+    text = "📊 **Ваши расчеты:**\n\n"
     
     # Группируем расчеты по дате
     grouped_by_date = {}
@@ -653,18 +851,169 @@ async def show_calculations_history(message: types.Message):
             text += "\n"
         
         text += "\n"
-        
-        # Ограничение длины сообщения
-        if len(text) > 3500:
-            text += f"... и еще {len(calculations) - total_calculations} расчетов\n\n"
-            text += "💡 Полная история доступна в веб-интерфейсе (скоро)"
-            break
     
     if total_calculations > 0:
-        text += f"📈 **Всего расчетов показано:** {total_calculations}\n"
+        text += f"📈 **Расчетов на странице:** {total_calculations}\n"
         text += f"🎯 **Ваша подписка:** {subscription.title()}"
     
-    await message.answer(text, parse_mode="Markdown") 
+    return text
+
+
+async def get_history_page(user_id: int, before: str = None, after: str = None):
+    """
+    Готовит страницу истории расчетов
+    
+    Returns:
+        (текст, клавиатура) или (текст, None) если показывать нечего
+    """
+    # Проверяем подписку
+    subscription = await db.get_active_subscription(user_id)
+    if subscription in (None, 'free'):
+        return (
+            "📊 История расчетов доступна только для подписчиков.\n\n"
+            "💳 Оформите подписку для доступа к:\n"
+            "• Истории всех расчетов\n"
+            "• Экспорту результатов\n"
+            "• Приоритетной поддержке"
+        ), None
+    
+    page = await db.get_calculation_history(
+        user_id,
+        limit=settings.HISTORY_PAGE_SIZE,
+        before=before,
+        after=after
+    )
+    
+    if not page['items']:
+        return "У вас пока нет сохраненных расчетов.", None
+    
+    text = format_history_text(page['items'], subscription)
+    keyboard = get_history_keyboard(page['older_cursor'], page['newer_cursor'])
+    return text, keyboard
+
+
+@router.message(F.text == "📊 Мои расчеты")
+async def show_calculations_history(message: types.Message):
+    """Показ истории расчетов"""
+    text, keyboard = await get_history_page(message.from_user.id)
+    await message.answer(text, reply_markup=keyboard, parse_mode="Markdown")
+
+
+@router.callback_query(F.data.startswith("history:"))
+async def paginate_calculations_history(callback: types.CallbackQuery):
+    """Переход по страницам истории расчетов"""
+    _, direction, cursor = callback.data.split(":", 2)
+    
+    if direction == "older":
+        text, keyboard = await get_history_page(callback.from_user.id, before=cursor)
+    else:
+        text, keyboard = await get_history_page(callback.from_user.id, after=cursor)
+    
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
+    await callback.answer()
+
+
+def format_search_text(calculations: list, query: str) -> str:
+    """Форматирует страницу результатов поиска (в порядке релевантности)"""
+    # Символы разметки из запроса пользователя ломают Markdown
+    shown_query = query.translate(str.maketrans("", "", "*_`["))
+    text = f"🔎 **Найдено по запросу «{shown_query}»:**\n\n"
+    
+    for calc in calculations:
+        try:
+            date_str = datetime.strptime(calc['created_at'][:10], "%Y-%m-%d").strftime("%d.%m.%Y")
+        except (TypeError, ValueError):
+            date_str = calc['created_at'] or ''
+        
+        text += f"📅 {date_str} — {calc.get('room_description') or 'Помещение'}\n"
+        
+        details = []
+        if calc.get('perimeter'):
+            details.append(f"📐 {calc['perimeter']:.1f}м")
+        if calc.get('area'):
+            details.append(f"📏 {calc['area']:.1f}м²")
+        if details:
+            text += f"     {' | '.join(details)}\n"
+    
+    return text
+
+
+# Сколько последних запросов /find помним для кнопок листания
+SEARCH_QUERIES_KEPT = 20
+
+
+def search_query_key(query: str) -> str:
+    """Короткий ключ запроса для callback_data (сам запрос может не поместиться в 64 байта)"""
+    return f"{zlib.crc32(query.encode('utf-8')):08x}"
+
+
+async def get_search_page(user_id: int, query: str, after: str = None):
+    """
+    Готовит страницу результатов поиска по расчетам
+    
+    Returns:
+        (текст, клавиатура) или (текст, None) если показывать нечего
+    """
+    subscription = await db.get_active_subscription(user_id)
+    if subscription in (None, 'free'):
+        return (
+            "🔎 Поиск по расчетам доступен только для подписчиков.\n\n"
+            "💳 Оформите подписку, чтобы искать по истории расчетов."
+        ), None
+    
+    page = await db.search_calculations(
+        user_id,
+        query,
+        limit=settings.HISTORY_PAGE_SIZE,
+        after=after
+    )
+    
+    if not page['items']:
+        if after:
+            return "Больше результатов нет.", None
+        return "Ничего не найдено. Попробуйте другие слова.", None
+    
+    text = format_search_text(page['items'], query)
+    keyboard = get_search_keyboard(search_query_key(query), page['next_cursor'])
+    return text, keyboard
+
+
+@router.message(Command("find"))
+async def find_calculations(message: types.Message, command: CommandObject, state: FSMContext):
+    """Поиск по истории расчетов: /find <запрос>"""
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer(
+            "🔎 Укажите, что искать, например:\n"
+            "`/find кухня март`",
+            parse_mode="Markdown"
+        )
+        return
+    
+    # Запрос нужен для листания: в callback_data помещаются только его ключ и курсор.
+    # Кнопки прошлых результатов продолжают листать свои запросы
+    queries = (await state.get_data()).get('find_queries') or {}
+    queries.pop(search_query_key(query), None)
+    queries[search_query_key(query)] = query
+    await state.update_data(find_queries=dict(list(queries.items())[-SEARCH_QUERIES_KEPT:]))
+    text, keyboard = await get_search_page(message.from_user.id, query)
+    await message.answer(text, reply_markup=keyboard, parse_mode="Markdown")
+
+
+@router.callback_query(F.data.startswith("find:"))
+async def paginate_search_results(callback: types.CallbackQuery, state: FSMContext):
+    """Следующая страница результатов поиска"""
+    parts = callback.data.split(":", 2)
+    queries = (await state.get_data()).get('find_queries') or {}
+    query = queries.get(parts[1]) if len(parts) == 3 else None
+    cursor = parts[-1]
+    if not query:
+        await callback.answer("Поиск устарел, повторите команду /find", show_alert=True)
+        return
+    
+    text, keyboard = await get_search_page(callback.from_user.id, query, after=cursor)
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
+    await callback.answer()
 
 
 # ========== ОБРАБОТЧИКИ ЭТАПОВ НАТЯЖНЫХ ПОТОЛКОВ ==========
@@ -1292,6 +1641,7 @@ async def finalize_ceiling_calculation(callback: types.CallbackQuery, state: FSM
         perimeter=perimeter,
         area=area,
         corners_count=corners_count,
+        recognized_data=data.get('recognition_data'),
         profile_type=profile_type,
         profile_quantity=profile_data.get('profile_quantity'),
         dowel_nails_count=profile_data.get('dowel_nails_count'),
@@ -1314,9 +1664,6 @@ async def finalize_ceiling_calculation(callback: types.CallbackQuery, state: FSM
         glue_volume=totals.get('glue_volume')
     )
     
-    # Увеличиваем счетчик использований
-    await db.increment_user_calculations(user_id)
-    
     # Отправляем смету
     await callback.message.edit_text(
         estimate_text,
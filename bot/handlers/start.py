@@ -3,6 +3,7 @@ from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
 from bot.keyboards.main import get_main_keyboard
 from bot.database.models import db
+from bot.handlers.calculation import release_quota
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,7 +14,8 @@ router = Router()
 @router.message(CommandStart())
 async def cmd_start(message: types.Message, state: FSMContext):
     """Обработчик команды /start"""
-    # Очищаем состояние
+    # Очищаем состояние, возвращая незавершенный расчет в лимит
+    await release_quota(state, message.from_user.id)
     await state.clear()
     
     # Получаем или создаем пользователя
@@ -97,6 +99,9 @@ async def cmd_help(message: types.Message):
 • Припуски по краям (10 см)
 • Расчет количества полос и отходов
 
+**Поиск по расчетам (для подписчиков):**
+`/find кухня март` — найдет расчеты по описанию, заметкам и дате
+
 **Форматы изображений:**
 JPG, PNG, WEBP, HEIC
 
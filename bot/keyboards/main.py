@@ -126,7 +126,7 @@ def get_subscription_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def get_confirmation_keyboard() -> InlineKeyboardMarkup:
+def get_confirmation_keyboard(recognize_again: bool = False) -> InlineKeyboardMarkup:
     """Клавиатура подтверждения распознанных размеров"""
     builder = InlineKeyboardBuilder()
     
@@ -140,6 +140,14 @@ def get_confirmation_keyboard() -> InlineKeyboardMarkup:
             callback_data="edit_measurements"
         )
     )
+    if recognize_again:
+        # Размеры взяты из прошлого распознавания - можно распознать фото заново
+        builder.row(
+            InlineKeyboardButton(
+                text="🔄 Распознать заново",
+                callback_data="recognize_again"
+            )
+        )
     builder.row(
         InlineKeyboardButton(
             text="❌ Отмена",
@@ -150,7 +158,7 @@ def get_confirmation_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def get_confirmation_with_fabric_keyboard() -> InlineKeyboardMarkup:
+def get_confirmation_with_fabric_keyboard(recognize_again: bool = False) -> InlineKeyboardMarkup:
     """Клавиатура подтверждения с возможностью изменить ширину ткани"""
     builder = InlineKeyboardBuilder()
     
@@ -170,6 +178,39 @@ def get_confirmation_with_fabric_keyboard() -> InlineKeyboardMarkup:
             callback_data="change_fabric_width"
         )
     )
+    if recognize_again:
+        builder.row(
+            InlineKeyboardButton(
+                text="🔄 Распознать заново",
+                callback_data="recognize_again"
+            )
+        )
+    builder.row(
+        InlineKeyboardButton(
+            text="❌ Отмена",
+            callback_data="cancel"
+        )
+    )
+    
+    return builder.as_markup()
+
+
+def get_similar_photo_keyboard() -> InlineKeyboardMarkup:
+    """Выбор для фото, похожего на недавнее: распознать заново или взять прошлые размеры"""
+    builder = InlineKeyboardBuilder()
+    
+    builder.row(
+        InlineKeyboardButton(
+            text="🤖 Распознать это фото",
+            callback_data="recognize_photo"
+        )
+    )
+    builder.row(
+        InlineKeyboardButton(
+            text="♻️ Это тот же лист - взять прошлые размеры",
+            callback_data="use_previous_recognition"
+        )
+    )
     builder.row(
         InlineKeyboardButton(
             text="❌ Отмена",
@@ -260,6 +301,60 @@ def get_back_to_menu_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+def get_history_keyboard(older_cursor: str = None, newer_cursor: str = None) -> InlineKeyboardMarkup:
+    """Клавиатура листания истории расчетов"""
+    builder = InlineKeyboardBuilder()
+    
+    buttons = []
+    if newer_cursor:
+        buttons.append(
+            InlineKeyboardButton(
+                text="⬅️ Новее",
+                callback_data=f"history:newer:{newer_cursor}"
+            )
+        )
+    if older_cursor:
+        buttons.append(
+            InlineKeyboardButton(
+                text="Старше ➡️",
+                callback_data=f"history:older:{older_cursor}"
+            )
+        )
+    if buttons:
+        builder.row(*buttons)
+    
+    builder.row(
+        InlineKeyboardButton(
+            text="🏠 Главное меню",
+            callback_data="main_menu"
+        )
+    )
+    
+    return builder.as_markup()
+
+
+def get_search_keyboard(query_key: str, next_cursor: str = None) -> InlineKeyboardMarkup:
+    """Клавиатура листания результатов поиска по расчетам (query_key - ключ запроса /find)"""
+    builder = InlineKeyboardBuilder()
+    
+    if next_cursor:
+        builder.row(
+            InlineKeyboardButton(
+                text="Еще результаты ➡️",
+                callback_data=f"find:{query_key}:{next_cursor}"
+            )
+        )
+    
+    builder.row(
+        InlineKeyboardButton(
+            text="🏠 Главное меню",
+            callback_data="main_menu"
+        )
+    )
+    
+    return builder.as_markup()
+
+
 # ========== КЛАВИАТУРЫ ДЛЯ НАТЯЖНЫХ ПОТОЛКОВ ==========
 
 def get_profile_type_keyboard() -> InlineKeyboardMarkup:
@@ -0,0 +1,46 @@
+import asyncio
+from typing import Awaitable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Deadline:
+    """
+    Общий срок выполнения цепочки операций
+
+    Каждый этап получает оставшееся до срока время (и, при необходимости,
+    собственный предел) и отменяется, если не успел. Когда срок уже истек,
+    следующий этап даже не запускается.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = asyncio.get_running_loop().time() + seconds
+
+    def remaining(self) -> float:
+        """Сколько секунд осталось до срока (не меньше нуля)"""
+        return max(0.0, self.expires_at - asyncio.get_running_loop().time())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def budget(self, limit: Optional[float] = None) -> float:
+        """Время на очередной этап: остаток срока, но не больше limit"""
+        remaining = self.remaining()
+        return remaining if limit is None else min(remaining, limit)
+
+    async def run(self, aw: Awaitable[T], limit: Optional[float] = None) -> T:
+        """
+        Выполняет этап в пределах оставшегося времени
+
+        Raises:
+            asyncio.TimeoutError: срок истек; этап при этом отменяется
+        """
+        timeout = self.budget(limit)
+        if timeout <= 0:
+            # Корутину, которую не будем запускать, закрываем без предупреждений
+            if asyncio.iscoroutine(aw):
+                aw.close()
+            raise asyncio.TimeoutError()
+        return await asyncio.wait_for(aw, timeout)
@@ -1,8 +1,17 @@
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+import asyncio
+import copy
 import json
-from typing import Dict, Any, Optional, List
+import re
+import time
+from typing import Dict, Any, Optional, List, Tuple
 from PIL import Image
 import io
+from bot.database.cache import TTLCache
+from bot.database.recognition_cache import RecognitionCache, recognition_cache_key
+from bot.utils.similar_images import SimilarImageIndex
+from bot.utils.resilience import CircuitBreaker, CircuitOpenError, ServiceUnavailableError, backoff_delay
 from config.settings import settings
 import logging
 
@@ -11,10 +20,75 @@ logger = logging.getLogger(__name__)
 # Настройка Gemini API
 genai.configure(api_key=settings.GEMINI_API_KEY)
 
+# Временные ошибки Gemini, которые имеет смысл повторить:
+# 429 и исчерпанная квота, ошибки сервера 5xx (включая таймаут), сеть
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServerError,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+# Обработанные снимки последних фото (по file_unique_id) и сколько их помнить, секунд
+RECENT_IMAGES = 32
+RECENT_IMAGE_TTL = 30 * 60
+
+
+class _Flight:
+    """Выполняющееся распознавание и количество ожидающих его запросов"""
+    
+    __slots__ = ('task', 'waiters')
+    
+    def __init__(self, task: "asyncio.Future"):
+        self.task = task
+        self.waiters = 0
+
 
 class GeminiRecognizer:
-    def __init__(self):
+    def __init__(self, max_concurrency: int = settings.GEMINI_MAX_CONCURRENCY):
         self.model = genai.GenerativeModel(settings.GEMINI_MODEL)
+        
+        # Одновременных запросов к Gemini не больше max_concurrency,
+        # остальные ждут своей очереди, не блокируя цикл событий
+        self.max_concurrency = max(1, max_concurrency)
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        
+        # Статистика очереди запросов
+        self._waiting = 0
+        self._active = 0
+        self._requests = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        
+        # Выполняющиеся распознавания по ключу кэша: одновременные запросы
+        # одного изображения ждут общий результат вместо повторного запроса
+        self._in_flight: Dict[str, _Flight] = {}
+        self._coalesced = 0
+        
+        # Повторы временных ошибок и отключение распознавания, пока Gemini сбоит
+        self.attempt_timeout = settings.GEMINI_ATTEMPT_TIMEOUT
+        self.max_retries = max(0, settings.GEMINI_RETRIES)
+        self._retries = 0
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.GEMINI_BREAKER_FAILURES,
+            reset_timeout=settings.GEMINI_BREAKER_RESET_SECONDS
+        )
+        
+        # Кэш результатов по содержимому обработанного изображения
+        self.cache = RecognitionCache(
+            settings.RECOGNITION_CACHE_URL or None,
+            ttl=settings.RECOGNITION_CACHE_TTL_HOURS * 3600,
+            memory_size=settings.RECOGNITION_CACHE_MEMORY_SIZE,
+            max_bytes=settings.RECOGNITION_CACHE_MAX_MB * 1024 * 1024
+        )
+        # Недавние снимки пользователей для повторных фото того же листа
+        self.similar = SimilarImageIndex(
+            threshold=settings.SIMILAR_IMAGE_THRESHOLD,
+            window=settings.SIMILAR_IMAGE_WINDOW_MINUTES * 60,
+            per_user=settings.SIMILAR_IMAGE_PER_USER
+        )
+        # Повторное распознавание того же фото не скачивает и не обрабатывает его заново
+        self._images = TTLCache(maxsize=RECENT_IMAGES, ttl=RECENT_IMAGE_TTL)
         self.recognition_prompt = """
         Проанализируй изображение с замерами помещений для натяжных потолков.
         
@@ -68,46 +142,262 @@ class GeminiRecognizer:
         Обязательно укажи позицию каждого помещения на листе для идентификации.
         """
     
-    async def recognize_measurements(self, image_data: bytes) -> Optional[Dict[str, Any]]:
-        """Распознает размеры всех помещений на изображении"""
+    async def close(self):
+        """Закрывает файл кэша распознавания"""
+        await self.cache.close()
+    
+    def stats(self) -> dict:
+        """Статистика очереди запросов к Gemini"""
+        return {
+            'max_concurrency': self.max_concurrency,
+            'active': self._active,
+            'waiting': self._waiting,
+            'requests': self._requests,
+            'avg_wait': round(self._total_wait / self._requests, 3) if self._requests else 0.0,
+            'max_wait': round(self._max_wait, 3),
+            'in_flight': len(self._in_flight),
+            'coalesced': self._coalesced,
+            'retries': self._retries,
+            'breaker': self.breaker.stats(),
+            'cache': self.cache.stats(),
+            'similar': self.similar.stats()
+        }
+    
+    async def _generate(self, image: Image.Image, timeout: Optional[float] = None) -> str:
+        """
+        Отправляет изображение в Gemini и возвращает текст ответа
+        
+        Запрос идет через асинхронный клиент и ждет свободного слота,
+        если одновременно выполняется max_concurrency запросов.
+        timeout - сколько секунд осталось у запроса (включая ожидание слота).
+        """
+        started = time.perf_counter()
+        queued = started
+        self._waiting += 1
         try:
-            # Открываем изображение
-            image = Image.open(io.BytesIO(image_data))
-            
-            # Отправляем запрос к Gemini
-            response = self.model.generate_content([self.recognition_prompt, image])
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        
+        waited = time.perf_counter() - queued
+        self._requests += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+        self._active += 1
+        try:
+            request_options = {}
+            if timeout is not None:
+                # Остаток срока передаем и самому HTTP-запросу
+                remaining = timeout - (time.perf_counter() - started)
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                request_options['timeout'] = remaining
+            response = await self.model.generate_content_async(
+                [self.recognition_prompt, image],
+                request_options=request_options
+            )
+            return response.text.strip()
+        finally:
+            self._active -= 1
+            self._slots.release()
+    
+    async def _generate_with_retries(self, image: Image.Image, timeout: Optional[float] = None) -> str:
+        """
+        Запрос к Gemini с повторами временных ошибок
+        
+        Каждая попытка ограничена attempt_timeout и остатком общего timeout;
+        между попытками - экспоненциальная пауза со случайным разбросом.
+        Повтор не начинается, если после паузы не останется времени.
+        
+        В автомат записывается одна ошибка на запрос, а не на попытку.
+        Таймаут попытки, укороченной сроком вызывающего, ошибкой сервиса
+        не считается: сервис мог просто не успеть за остаток срока.
+        
+        Raises:
+            CircuitOpenError: автомат разомкнут, запрос не отправлялся
+            ServiceUnavailableError: временные ошибки не прошли за все попытки
+            asyncio.TimeoutError: не уложились в timeout
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(self.breaker.retry_after())
+        
+        loop = asyncio.get_running_loop()
+        expires_at = None if timeout is None else loop.time() + timeout
+        attempt = 0
+        service_failed = False
+        while True:
+            attempt_timeout = self.attempt_timeout
+            if expires_at is not None:
+                attempt_timeout = min(attempt_timeout, expires_at - loop.time())
+                if attempt_timeout <= 0:
+                    self._record_request_failure(service_failed)
+                    raise asyncio.TimeoutError()
             
-            # Извлекаем JSON из ответа
-            response_text = response.text.strip()
+            try:
+                response_text = await asyncio.wait_for(
+                    self._generate(image, attempt_timeout), attempt_timeout
+                )
+            except RETRYABLE_ERRORS as e:
+                timed_out = isinstance(e, (asyncio.TimeoutError, google_exceptions.DeadlineExceeded))
+                if not (timed_out and attempt_timeout < self.attempt_timeout):
+                    service_failed = True
+                
+                attempt += 1
+                delay = backoff_delay(attempt, settings.GEMINI_RETRY_BASE_DELAY, settings.GEMINI_RETRY_MAX_DELAY)
+                out_of_time = expires_at is not None and expires_at - loop.time() <= delay
+                if attempt > self.max_retries or out_of_time or not self.breaker.available():
+                    self._record_request_failure(service_failed)
+                    if timed_out:
+                        raise asyncio.TimeoutError() from e
+                    raise ServiceUnavailableError(str(e)) from e
+                
+                logger.warning(
+                    f"Временная ошибка Gemini ({type(e).__name__}), "
+                    f"попытка {attempt + 1} через {delay:.2f} с"
+                )
+                self._retries += 1
+                await asyncio.sleep(delay)
+                continue
             
-            # Пытаемся найти JSON в ответе
-            if response_text.startswith('{') and response_text.endswith('}'):
-                result = json.loads(response_text)
+            self.breaker.record_success()
+            return response_text
+    
+    def _record_request_failure(self, service_failed: bool):
+        """Одна запись в автомат за неудачный запрос"""
+        if service_failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.release()
+    
+    @staticmethod
+    def _parse_response(response_text: str) -> Optional[Dict[str, Any]]:
+        """Извлекает JSON из ответа и приводит все размеры к сантиметрам"""
+        # Пытаемся найти JSON в ответе
+        if response_text.startswith('{') and response_text.endswith('}'):
+            result = json.loads(response_text)
+        else:
+            # Если ответ содержит текст помимо JSON, пытаемся извлечь JSON
+            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+            if json_match:
+                result = json.loads(json_match.group())
             else:
-                # Если ответ содержит текст помимо JSON, пытаемся извлечь JSON
-                import re
-                json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-                if json_match:
-                    result = json.loads(json_match.group())
-                else:
-                    logger.error(f"Не удалось извлечь JSON из ответа: {response_text}")
-                    return None
-            
-            # Конвертируем все размеры в сантиметры для всех помещений
-            for room in result.get('rooms', []):
-                for measurement in room.get('measurements', []):
-                    value = measurement['value']
-                    unit = measurement.get('unit', 'cm')
-                    
-                    if unit == 'm':
-                        measurement['value'] = value * 100
-                        measurement['unit'] = 'cm'
-                    elif unit == 'mm':
-                        measurement['value'] = value / 10
-                        measurement['unit'] = 'cm'
-            
+                logger.error(f"Не удалось извлечь JSON из ответа: {response_text}")
+                return None
+        
+        # Конвертируем все размеры в сантиметры для всех помещений
+        for room in result.get('rooms', []):
+            for measurement in room.get('measurements', []):
+                value = measurement['value']
+                unit = measurement.get('unit', 'cm')
+                
+                if unit == 'm':
+                    measurement['value'] = value * 100
+                    measurement['unit'] = 'cm'
+                elif unit == 'mm':
+                    measurement['value'] = value / 10
+                    measurement['unit'] = 'cm'
+        
+        return result
+    
+    def _file_key(self, file_unique_id: str) -> str:
+        """Ключ файла Telegram в индексе распознаваний (с учетом модели и промпта)"""
+        return recognition_cache_key(
+            f"telegram-file:{file_unique_id}".encode("utf-8"),
+            settings.GEMINI_MODEL,
+            self.recognition_prompt
+        )
+    
+    async def recognize_file(self, file_unique_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Результат распознавания уже обработанного файла Telegram
+        
+        file_unique_id одинаков у пересланных и повторно отправленных
+        копий фото, поэтому при попадании файл даже не нужно скачивать.
+        
+        Returns:
+            Результат распознавания или None, если файл еще не распознавался
+        """
+        return await self.cache.get_by_file(self._file_key(file_unique_id))
+    
+    def remember_image(self, file_unique_id: Optional[str], image_data: bytes,
+                       image_hash: Optional[int]):
+        """Запоминает обработанный снимок файла Telegram и его перцептивный хэш"""
+        if file_unique_id:
+            self._images.set(file_unique_id, (image_data, image_hash))
+    
+    def recent_image(self, file_unique_id: Optional[str]) -> Optional[Tuple[bytes, Optional[int]]]:
+        """Обработанный снимок и хэш недавно обработанного файла Telegram (или None)"""
+        if not file_unique_id:
+            return None
+        return self._images.get(file_unique_id, None)
+    
+    async def recognize_similar(self, telegram_id: int, image_hash: Optional[int]) -> Optional[Dict[str, Any]]:
+        """
+        Результат распознавания недавнего похожего снимка пользователя
+        
+        Это лишь кандидат: цифры на снимках могут отличаться, поэтому
+        результат нужно показать пользователю на выбор.
+        
+        Returns:
+            Результат или None, если похожих снимков нет или результат
+            уже вытеснен из кэша
+        """
+        key = self.similar.find(telegram_id, image_hash)
+        return await self.cache.get(key) if key else None
+    
+    async def _remember(self, cache_key: str, file_unique_id: Optional[str],
+                        telegram_id: Optional[int], image_hash: Optional[int]):
+        """Связывает результат с файлом Telegram и снимком пользователя"""
+        if file_unique_id:
+            await self.cache.link_file(self._file_key(file_unique_id), cache_key)
+        if telegram_id is not None:
+            self.similar.add(telegram_id, image_hash, cache_key)
+    
+    async def recognize_measurements(self, image_data: bytes,
+                                     timeout: Optional[float] = None,
+                                     file_unique_id: Optional[str] = None,
+                                     telegram_id: Optional[int] = None,
+                                     image_hash: Optional[int] = None,
+                                     refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Распознает размеры всех помещений на изображении
+        
+        Успешные результаты кэшируются по содержимому изображения,
+        модели и промпту - повторное фото обходится без запроса к Gemini.
+        
+        Args:
+            image_data: Обработанное изображение
+            timeout: Оставшееся время на распознавание, секунд
+            file_unique_id: Файл Telegram, из которого получено изображение -
+                успешный результат будет доступен через recognize_file()
+            telegram_id, image_hash: Пользователь и перцептивный хэш снимка -
+                результат будет доступен через recognize_similar()
+            refresh: Не брать готовый результат из кэша, а распознать заново;
+                новый результат заменит его в кэше
+        
+        Raises:
+            asyncio.TimeoutError: не уложились в timeout
+            ServiceUnavailableError: Gemini временно недоступен
+                (в том числе CircuitOpenError - автомат разомкнут)
+        """
+        cache_key = recognition_cache_key(image_data, settings.GEMINI_MODEL, self.recognition_prompt)
+        cached = None if refresh else await self.cache.get(cache_key)
+        if cached is not None:
+            await self._remember(cache_key, file_unique_id, telegram_id, image_hash)
+            return cached
+        
+        try:
+            result = await self._recognize_once(cache_key, image_data, timeout)
+            if result and await self.validate_recognition(result):
+                await self._remember(cache_key, file_unique_id, telegram_id, image_hash)
             return result
             
+        except (asyncio.TimeoutError, google_exceptions.DeadlineExceeded):
+            logger.warning(f"Распознавание не уложилось в отведенное время ({timeout or 0:.1f} с)")
+            raise asyncio.TimeoutError()
+        except ServiceUnavailableError as e:
+            logger.warning(f"Gemini недоступен: {e}")
+            raise
         except json.JSONDecodeError as e:
             logger.error(f"Ошибка парсинга JSON: {e}")
             return None
@@ -115,6 +405,64 @@ class GeminiRecognizer:
             logger.error(f"Ошибка распознавания: {e}")
             return None
     
+    async def _recognize_once(self, cache_key: str, image_data: bytes,
+                              timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Распознавание, общее для одновременных запросов одного изображения
+        
+        Первый запрос запускает распознавание в отдельной задаче, остальные
+        присоединяются к ней. Каждый ждет не дольше своего timeout; отмена
+        или таймаут одного запроса не прерывают остальные, а задача
+        отменяется, только когда ее больше никто не ждет. Ошибка
+        распознавания достается всем ожидающим.
+        
+        Срок самого запроса к Gemini задает timeout первого запроса.
+        """
+        flight = self._in_flight.get(cache_key)
+        if flight is None:
+            task = asyncio.ensure_future(self._recognize_uncached(cache_key, image_data, timeout))
+            flight = _Flight(task)
+            self._in_flight[cache_key] = flight
+            task.add_done_callback(lambda _: self._land(cache_key, flight))
+        else:
+            self._coalesced += 1
+        
+        flight.waiters += 1
+        try:
+            if timeout is None:
+                result = await asyncio.shield(flight.task)
+            else:
+                result = await asyncio.wait_for(asyncio.shield(flight.task), timeout)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                # Результат больше никому не нужен - освобождаем слот Gemini
+                self._land(cache_key, flight)
+                flight.task.cancel()
+        
+        # У каждого запроса своя копия: обработчики могут менять результат
+        return copy.deepcopy(result)
+    
+    def _land(self, cache_key: str, flight: _Flight):
+        """Убирает распознавание из выполняющихся - новые запросы начнут свое"""
+        if self._in_flight.get(cache_key) is flight:
+            del self._in_flight[cache_key]
+    
+    async def _recognize_uncached(self, cache_key: str, image_data: bytes,
+                                  timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Запрос к Gemini; успешный результат сохраняется в кэш"""
+        # Открываем изображение
+        image = Image.open(io.BytesIO(image_data))
+        
+        # Отправляем запрос к Gemini
+        response_text = await self._generate_with_retries(image, timeout)
+        
+        result = self._parse_response(response_text)
+        # Неудачные распознавания не кэшируем: следующая попытка может удаться
+        if result and await self.validate_recognition(result):
+            await self.cache.set(cache_key, result)
+        return result
+    
     async def validate_recognition(self, recognition_data: Dict[str, Any]) -> bool:
         """Проверяет корректность распознанных данных"""
         if not recognition_data:
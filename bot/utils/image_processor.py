@@ -1,10 +1,21 @@
 from PIL import Image
+import asyncio
 import io
+import math
 from typing import Optional, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Перцептивный хэш: изображение HASH_SAMPLE x HASH_SAMPLE, из его ДКП берутся
+# низкие частоты HASH_SIZE x HASH_SIZE (64 бита)
+HASH_SAMPLE = 32
+HASH_SIZE = 8
+_HASH_COSINES = [
+    [math.cos(math.pi * (2 * x + 1) * u / (2 * HASH_SAMPLE)) for x in range(HASH_SAMPLE)]
+    for u in range(HASH_SIZE)
+]
+
 
 class ImageProcessor:
     """Обработчик изображений для подготовки к распознаванию"""
@@ -22,12 +33,18 @@ class ImageProcessor:
         """
         Обрабатывает изображение для оптимальной работы с API
         
+        Работа с Pillow идет в отдельном потоке, чтобы не блокировать
+        цикл событий и чтобы этап можно было прервать по таймауту.
+        
         Args:
             image_data: Байты изображения
             
         Returns:
             Обработанные байты изображения или None при ошибке
         """
+        return await asyncio.to_thread(self._process_image, image_data)
+    
+    def _process_image(self, image_data: bytes) -> Optional[bytes]:
         try:
             # Открываем изображение
             image = Image.open(io.BytesIO(image_data))
@@ -67,11 +84,14 @@ class ImageProcessor:
     
     async def validate_image(self, image_data: bytes) -> Tuple[bool, str]:
         """
-        Проверяет валидность изображения
+        Проверяет валидность изображения (в отдельном потоке)
         
         Returns:
             (is_valid, error_message)
         """
+        return await asyncio.to_thread(self._validate_image, image_data)
+    
+    def _validate_image(self, image_data: bytes) -> Tuple[bool, str]:
         try:
             image = Image.open(io.BytesIO(image_data))
             
@@ -93,6 +113,50 @@ class ImageProcessor:
         except Exception as e:
             return False, f"Не удалось открыть изображение: {str(e)}"
     
+    async def perceptual_hash(self, image_data: bytes) -> Optional[int]:
+        """
+        Перцептивный хэш изображения (pHash, в отдельном потоке)
+        
+        В отличие от хэша байтов почти не меняется при пересъемке того же
+        листа: небольшом сдвиге, другой экспозиции или сжатии.
+        
+        Returns:
+            64-битный хэш или None при ошибке
+        """
+        return await asyncio.to_thread(self._perceptual_hash, image_data)
+    
+    def _perceptual_hash(self, image_data: bytes) -> Optional[int]:
+        try:
+            size = HASH_SAMPLE
+            image = Image.open(io.BytesIO(image_data))
+            image = image.convert('L').resize((size, size), Image.Resampling.LANCZOS)
+            pixels = image.tobytes()
+            cosines = _HASH_COSINES
+            
+            # Двумерное ДКП по строкам, затем по столбцам - только низкие частоты
+            rows = [
+                [sum(c * p for c, p in zip(cosines[u], pixels[y * size:(y + 1) * size]))
+                 for u in range(HASH_SIZE)]
+                for y in range(size)
+            ]
+            coefficients = [
+                sum(cosines[v][y] * rows[y][u] for y in range(size))
+                for v in range(HASH_SIZE) for u in range(HASH_SIZE)
+            ]
+            
+            # Бит - выше ли коэффициент медианы; постоянная составляющая
+            # (общая яркость) в медиане не участвует
+            ac = coefficients[1:]
+            median = sorted(ac)[len(ac) // 2]
+            value = 0
+            for coefficient in coefficients:
+                value = (value << 1) | (coefficient > median)
+            return value
+            
+        except Exception as e:
+            logger.error(f"Ошибка вычисления перцептивного хэша: {e}")
+            return None
+    
     def get_image_info(self, image_data: bytes) -> dict:
         """Получает информацию об изображении"""
         try:
@@ -0,0 +1,114 @@
+import random
+import time
+from typing import Optional
+
+
+class ServiceUnavailableError(Exception):
+    """Внешний сервис временно недоступен (повторы не помогли)"""
+
+
+class CircuitOpenError(ServiceUnavailableError):
+    """Автомат разомкнут: внешний сервис недоступен, запрос не выполняется"""
+
+    def __init__(self, retry_after: float = 0.0):
+        super().__init__(f"Сервис недоступен, повторите через {retry_after:.0f} с")
+        self.retry_after = retry_after
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    Пауза перед повторной попыткой: экспонента с полным джиттером
+
+    Случайная пауза от нуля до base * 2^(attempt - 1), но не больше cap,
+    разводит повторы разных запросов во времени, и они не бьют по сервису
+    одновременно.
+    """
+    return random.uniform(0, min(cap, base * 2 ** max(0, attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель для вызовов внешнего сервиса
+
+    - closed: запросы идут как обычно; после failure_threshold ошибок
+      подряд автомат размыкается;
+    - open: запросы не выполняются reset_timeout секунд;
+    - half_open: срок вышел - пропускается один пробный запрос;
+      успех замыкает автомат, ошибка снова размыкает.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        # Время начала пробного запроса: зависший пробный запрос не держит автомат
+        self._probe_started: Optional[float] = None
+
+        # Статистика
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def retry_after(self) -> float:
+        """Через сколько секунд автомат пропустит пробный запрос"""
+        if self._state != self.OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def available(self) -> bool:
+        """Стоит ли начинать работу, которая закончится запросом к сервису"""
+        return self.state != self.OPEN
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос сейчас (в half_open - только пробный)"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+
+        now = time.monotonic()
+        if state == self.HALF_OPEN and (
+                self._probe_started is None or now - self._probe_started >= self.reset_timeout):
+            self._probe_started = now
+            return True
+
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self._state = self.CLOSED
+        self._failures = 0
+        self._probe_started = None
+
+    def release(self):
+        """Запрос закончился без ответа о состоянии сервиса (например, кончился срок вызывающего)"""
+        self._probe_started = None
+
+    def record_failure(self):
+        self._failures += 1
+        if self._probe_started is not None or self._failures >= self.failure_threshold:
+            if self._state != self.OPEN or self._probe_started is not None:
+                self.opened += 1
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probe_started = None
+
+    def stats(self) -> dict:
+        """Состояние автомата"""
+        return {
+            'state': self.state,
+            'failures': self._failures,
+            'retry_after': round(self.retry_after(), 1),
+            'opened': self.opened,
+            'rejected': self.rejected
+        }
@@ -0,0 +1,173 @@
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Количество различающихся битов двух перцептивных хэшей"""
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    BK-дерево для поиска хэшей в пределах расстояния Хэмминга
+
+    Каждый потомок узла хранится под своим расстоянием до узла; по
+    неравенству треугольника при поиске с радиусом r достаточно обойти
+    потомков с расстоянием от d - r до d + r.
+    """
+
+    def __init__(self):
+        # Узел: [хэш, значение, {расстояние: узел}]
+        self._root: Optional[list] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, image_hash: int, value):
+        node = [image_hash, value, {}]
+        self._size += 1
+        if self._root is None:
+            self._root = node
+            return
+
+        current = self._root
+        while True:
+            distance = hamming_distance(image_hash, current[0])
+            if distance == 0:
+                # Тот же хэш - достаточно обновить значение
+                current[1] = value
+                self._size -= 1
+                return
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, image_hash: int, radius: int) -> List[Tuple[int, object]]:
+        """Все значения в пределах radius: [(расстояние, значение)], ближайшие первыми"""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(image_hash, node[0])
+            if distance <= radius:
+                found.append((distance, node[1]))
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+class SimilarImageIndex:
+    """
+    Недавние распознавания пользователей по перцептивному хэшу
+
+    Для каждого пользователя хранится не больше per_user последних
+    снимков не старше window секунд. Для снимка, хэш которого отличается
+    не больше чем на threshold битов, находится прошлое распознавание.
+
+    Хэш не различает цифры: два чертежа на одном шаблоне с разными
+    размерами для него одинаковы. Поэтому найденный результат можно
+    только предложить пользователю, но не подставлять молча.
+    """
+
+    def __init__(self, threshold: int = 8, window: float = 600, per_user: int = 20,
+                 max_users: int = 10000):
+        self.threshold = threshold
+        self.window = window
+        self.per_user = max(1, per_user)
+        self.max_users = max(1, max_users)
+        # {telegram_id: [(хэш, ключ кэша, время добавления)]}, по давности обращений
+        self._entries: "OrderedDict[int, List[Tuple[int, str, float]]]" = OrderedDict()
+        self._trees: Dict[int, BKTree] = {}
+
+        # Статистика
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0 and self.window > 0
+
+    def _fresh(self, telegram_id: int) -> List[Tuple[int, str, float]]:
+        """Снимки пользователя в пределах окна; дерево перестраивается после устаревания"""
+        entries = self._entries.get(telegram_id)
+        if not entries:
+            return []
+
+        cutoff = time.monotonic() - self.window
+        if entries[0][2] > cutoff:
+            return entries
+
+        entries = [entry for entry in entries if entry[2] > cutoff]
+        if not entries:
+            self._forget(telegram_id)
+            return []
+        self._entries[telegram_id] = entries
+        self._rebuild(telegram_id)
+        return entries
+
+    def _rebuild(self, telegram_id: int):
+        tree = BKTree()
+        for image_hash, key, _ in self._entries[telegram_id]:
+            tree.add(image_hash, key)
+        self._trees[telegram_id] = tree
+
+    def _forget(self, telegram_id: int):
+        self._entries.pop(telegram_id, None)
+        self._trees.pop(telegram_id, None)
+
+    def find(self, telegram_id: int, image_hash: Optional[int]) -> Optional[str]:
+        """
+        Ключ кэша ближайшего недавнего снимка пользователя
+
+        Returns:
+            Ключ или None, если похожих снимков в пределах threshold нет
+        """
+        if not self.enabled or image_hash is None or not self._fresh(telegram_id):
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(telegram_id)
+        found = self._trees[telegram_id].search(image_hash, self.threshold)
+        if not found:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return found[0][1]
+
+    def add(self, telegram_id: int, image_hash: Optional[int], key: str):
+        """Запоминает распознанный снимок пользователя"""
+        if not self.enabled or image_hash is None:
+            return
+
+        entries = [entry for entry in self._fresh(telegram_id) if entry[0] != image_hash]
+        entries.append((image_hash, key, time.monotonic()))
+        rebuild = len(entries) > self.per_user or telegram_id not in self._trees
+        self._entries[telegram_id] = entries[-self.per_user:]
+        self._entries.move_to_end(telegram_id)
+
+        if rebuild:
+            self._rebuild(telegram_id)
+        else:
+            self._trees[telegram_id].add(image_hash, key)
+
+        while len(self._entries) > self.max_users:
+            oldest = next(iter(self._entries))
+            self._forget(oldest)
+
+    def stats(self) -> dict:
+        """Статистика поиска похожих снимков"""
+        total = self.hits + self.misses
+        return {
+            'users': len(self._entries),
+            'images': sum(len(entries) for entries in self._entries.values()),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
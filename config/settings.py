@@ -13,6 +13,18 @@ class Settings(BaseSettings):
     # Gemini API
     GEMINI_API_KEY: str
     GEMINI_MODEL: str = "gemini-2.0-flash-exp"
+    GEMINI_MAX_CONCURRENCY: int = 8  # Одновременных запросов к Gemini, остальные ждут в очереди
+    
+    # Кэш результатов распознавания
+    RECOGNITION_CACHE_URL: str = "sqlite:///recognition_cache.db"  # Пусто - только в памяти
+    RECOGNITION_CACHE_TTL_HOURS: int = 720  # Время жизни записи
+    RECOGNITION_CACHE_MEMORY_SIZE: int = 500  # Записей в памяти процесса
+    RECOGNITION_CACHE_MAX_MB: int = 200  # Объем файла кэша до вытеснения
+    
+    # Повторные снимки того же листа (по перцептивному хэшу) - прошлый результат предлагается на выбор
+    SIMILAR_IMAGE_THRESHOLD: int = 8  # Отличие в битах из 64; 0 - не искать похожие
+    SIMILAR_IMAGE_WINDOW_MINUTES: int = 10  # Сколько помнить снимки пользователя
+    SIMILAR_IMAGE_PER_USER: int = 20  # Снимков на пользователя
     
     # YooKassa
     YOOKASSA_SHOP_ID: Optional[str] = None
@@ -20,6 +32,13 @@ class Settings(BaseSettings):
     
     # Database
     DATABASE_URL: str = "sqlite:///bot.db"
+    DATABASE_POOL_SIZE: int = 4  # Количество долгоживущих соединений (для SQLite - читателей)
+    DATABASE_SQLITE_PROFILE: str = "default"  # Профиль PRAGMA: default, durable, throughput, legacy
+    DATABASE_WRITE_FLUSH_INTERVAL_MS: int = 50  # Период группового коммита
+    DATABASE_WRITE_BATCH_SIZE: int = 100  # Строк в пачке до досрочного сброса
+    DATABASE_CACHE_SIZE: int = 10000  # Пользователей в кэше
+    DATABASE_CACHE_TTL: int = 60  # Время жизни записи кэша, секунд
+    DATABASE_SHARDS: int = 1  # Файлов SQLite, между которыми делятся пользователи (1 - без шардирования)
     
     # Subscription prices (в рублях)
     SUBSCRIPTION_PRICES: dict = {
@@ -36,6 +55,30 @@ class Settings(BaseSettings):
         "unlimited": -1  # unlimited
     }
     
+    # Период, за который действует лимит тарифа
+    SUBSCRIPTION_LIMIT_PERIODS: dict = {
+        "free": "day",
+        "basic": "month",
+        "pro": "month",
+        "unlimited": "month"
+    }
+    
+    # История расчетов
+    HISTORY_PAGE_SIZE: int = 10  # Расчетов на одной странице
+    
+    # Архив старых расчетов
+    ARCHIVE_DATABASE_URL: str = "sqlite:///bot_archive.db"  # Пусто - без архива
+    ARCHIVE_AFTER_DAYS: int = 0  # Возраст расчета для архивирования (0 - не архивировать)
+    ARCHIVE_MODE: str = "move"  # move - перенос в архив, strip - удаление тяжелых JSON-полей
+    ARCHIVE_INTERVAL_HOURS: int = 24  # Период запуска архивирования
+    
+    # Обслуживание SQLite
+    BACKUP_DIR: str = "backups"  # Каталог резервных копий (пусто - без копий)
+    BACKUP_KEEP: int = 7  # Сколько последних копий хранить
+    BACKUP_INTERVAL_HOURS: int = 6  # Период резервного копирования (0 - не копировать)
+    VACUUM_INTERVAL_HOURS: int = 24  # Период PRAGMA incremental_vacuum (0 - не запускать)
+    ANALYZE_INTERVAL_HOURS: int = 24  # Период ANALYZE (0 - не запускать)
+    
     # Calculation settings
     DEFAULT_PERIMETER_MARGIN: int = 5  # %
     DEFAULT_AREA_MARGIN: int = 10  # %
@@ -122,8 +165,17 @@ class Settings(BaseSettings):
     }
     
     # API timeouts
-    GEMINI_TIMEOUT: int = 10
-    IMAGE_PROCESSING_TIMEOUT: int = 10
+    # Срок обработки фото - их сумма; распознавание не дольше GEMINI_TIMEOUT
+    GEMINI_TIMEOUT: int = 10  # Распознавание вместе с повторами, секунд
+    IMAGE_PROCESSING_TIMEOUT: int = 10  # Скачивание и обработка фото, секунд
+    
+    # Повторы и автоматический выключатель запросов к Gemini
+    GEMINI_ATTEMPT_TIMEOUT: float = 6  # Одна попытка, секунд
+    GEMINI_RETRIES: int = 2  # Повторов после 429/5xx/таймаута
+    GEMINI_RETRY_BASE_DELAY: float = 0.5  # Первая пауза, удваивается (со случайным разбросом)
+    GEMINI_RETRY_MAX_DELAY: float = 4  # Максимальная пауза, секунд
+    GEMINI_BREAKER_FAILURES: int = 5  # Ошибок подряд до отключения распознавания
+    GEMINI_BREAKER_RESET_SECONDS: int = 30  # Через сколько пробовать снова
     
     class Config:
         env_file = ".env"
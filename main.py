@@ -8,6 +8,7 @@ from aiogram.enums import ParseMode
 
 from config.settings import settings
 from bot.database.models import db
+from bot.utils.gemini_api import recognizer
 from bot.handlers import start_router, calculation_router, subscription_router
 from bot.handlers.admin import router as admin_router
 
@@ -27,10 +28,33 @@ async def on_startup(bot: Bot):
     """Действия при запуске бота"""
     logger.info("Бот запускается...")
     
-    # Создаем таблицы в БД
+    # Открываем пул соединений и создаем таблицы в БД
+    await db.connect()
     await db.create_tables()
     logger.info("База данных инициализирована")
     
+    # После изменения количества шардов переносим пользователей в их шарды
+    if db.shard_count > 1:
+        await db.redistribute_shards()
+    
+    # Перекодируем старые текстовые JSON-поля в компактный формат
+    db.run_in_background(db.reencode_legacy_blobs())
+    
+    # Периодически убираем старые расчеты из основной базы
+    if settings.ARCHIVE_AFTER_DAYS > 0:
+        db.run_in_background(db.run_retention(
+            settings.ARCHIVE_AFTER_DAYS,
+            mode=settings.ARCHIVE_MODE,
+            interval=settings.ARCHIVE_INTERVAL_HOURS * 3600
+        ))
+    
+    # Резервные копии, VACUUM и ANALYZE без остановки бота
+    db.run_in_background(db.maintenance.run(
+        backup_interval=settings.BACKUP_INTERVAL_HOURS * 3600,
+        vacuum_interval=settings.VACUUM_INTERVAL_HOURS * 3600,
+        analyze_interval=settings.ANALYZE_INTERVAL_HOURS * 3600
+    ))
+    
     # Получаем информацию о боте
     bot_info = await bot.get_me()
     logger.info(f"Бот @{bot_info.username} запущен!")
@@ -39,6 +63,8 @@ async def on_startup(bot: Bot):
 async def on_shutdown(bot: Bot):
     """Действия при остановке бота"""
     logger.info("Бот останавливается...")
+    await db.close()
+    await recognizer.close()
     await bot.session.close()
 
 
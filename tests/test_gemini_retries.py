@@ -0,0 +1,51 @@
+"""Автомат Gemini считает одну ошибку на запрос и не винит сервис в коротком сроке вызывающего"""
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+import pytest  # noqa: E402
+from google.api_core import exceptions as google_exceptions  # noqa: E402
+
+from bot.utils.gemini_api import GeminiRecognizer  # noqa: E402
+from bot.utils.resilience import CircuitBreaker, ServiceUnavailableError  # noqa: E402
+
+
+def make_recognizer(generate, monkeypatch):
+    recognizer = GeminiRecognizer()
+    recognizer.attempt_timeout = 1.0
+    recognizer.max_retries = 2
+    recognizer.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    monkeypatch.setattr(recognizer, "_generate", generate)
+    monkeypatch.setattr("bot.utils.gemini_api.backoff_delay", lambda *args: 0.0)
+    return recognizer
+
+
+def test_one_failure_per_request(monkeypatch):
+    calls = []
+
+    async def generate(image, timeout):
+        calls.append(timeout)
+        raise google_exceptions.ServiceUnavailable("busy")
+
+    recognizer = make_recognizer(generate, monkeypatch)
+    with pytest.raises(ServiceUnavailableError):
+        asyncio.run(recognizer._generate_with_retries(None))
+
+    assert len(calls) == 3
+    assert recognizer.breaker.stats()['failures'] == 1
+    assert recognizer.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_caller_deadline_is_not_a_failure(monkeypatch):
+    async def generate(image, timeout):
+        await asyncio.sleep(10)
+
+    recognizer = make_recognizer(generate, monkeypatch)
+    for _ in range(3):
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(recognizer._generate_with_retries(None, timeout=0.05))
+
+    assert recognizer.breaker.stats()['failures'] == 0
+    assert recognizer.breaker.state == CircuitBreaker.CLOSED
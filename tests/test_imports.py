@@ -0,0 +1,25 @@
+"""Проверка, что бот собирается: все модули импортируются без ошибок"""
+import importlib
+import os
+
+# Обязательные настройки; сеть и файлы БД при импорте не используются
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+
+def test_import_handlers():
+    handlers = importlib.import_module("bot.handlers")
+    assert handlers.start_router and handlers.calculation_router and handlers.subscription_router
+    importlib.import_module("bot.handlers.admin")
+
+
+def test_import_main(tmp_path, monkeypatch):
+    # main.py пишет лог в bot.log текущего каталога
+    monkeypatch.chdir(tmp_path)
+    main = importlib.import_module("main")
+    assert callable(main.main)
+
+
+def test_release_quota_exported():
+    from bot.handlers.calculation import release_quota, reserve_quota
+    assert callable(release_quota) and callable(reserve_quota)
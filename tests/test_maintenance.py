@@ -0,0 +1,75 @@
+"""Старая база без auto_vacuum: открытие ее не переписывает, разовый перевод включает incremental vacuum"""
+import asyncio
+import os
+import sqlite3
+
+import pytest
+
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+from bot.database.maintenance import enable_incremental_vacuum  # noqa: E402
+from bot.database.models import Database  # noqa: E402
+
+
+def make_legacy_file(path):
+    """Файл в режиме WAL, созданный до включения auto_vacuum"""
+    legacy = sqlite3.connect(path)
+    legacy.execute("PRAGMA journal_mode = WAL")
+    legacy.execute("CREATE TABLE junk (data BLOB)")
+    legacy.executemany("INSERT INTO junk VALUES (?)", [(b"x" * 4000,) for _ in range(200)])
+    legacy.commit()
+    legacy.close()
+
+
+async def free_junk(path):
+    """Открывает базу как бот, удаляет строки и запускает vacuum"""
+    db = Database(url=f"sqlite:///{path}")
+    await db.connect()
+    await db.create_tables()
+    async with db.backend.acquire(readonly=True) as conn:
+        cursor = await conn.execute("PRAGMA auto_vacuum")
+        mode = (await cursor.fetchone())[0]
+    async with db.backend.acquire() as conn:
+        await conn.execute("DELETE FROM junk")
+        await conn.commit()
+    freed = await db.maintenance.vacuum()
+    await db.close()
+    return mode, freed
+
+
+def test_open_does_not_rewrite_legacy_file(tmp_path):
+    path = tmp_path / "bot.db"
+    make_legacy_file(path)
+
+    mode, freed = asyncio.run(free_junk(path))
+    assert mode == 0
+    assert freed == {"bot": 0}
+
+
+def test_enable_incremental_vacuum(tmp_path):
+    path = tmp_path / "bot.db"
+    make_legacy_file(path)
+
+    assert enable_incremental_vacuum(str(path)) is True
+    assert enable_incremental_vacuum(str(path)) is False
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    mode, freed = asyncio.run(free_junk(path))
+    assert mode == 2
+    assert freed["bot"] > 0
+
+
+def test_enable_incremental_vacuum_refuses_while_open(tmp_path):
+    path = tmp_path / "bot.db"
+    make_legacy_file(path)
+
+    # Соединение запущенного бота не дает выйти из режима WAL
+    bot = sqlite3.connect(path)
+    bot.execute("SELECT COUNT(*) FROM junk").fetchone()
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            enable_incremental_vacuum(str(path))
+    finally:
+        bot.close()
@@ -0,0 +1,125 @@
+"""Резервирование расчетов по лимитам тарифов и постраничная история"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+from bot.database.models import Database  # noqa: E402
+from config.settings import settings  # noqa: E402
+
+
+async def open_db(tmp_path):
+    db = Database(url=f"sqlite:///{tmp_path}/bot.db")
+    await db.connect()
+    await db.create_tables()
+    return db
+
+
+async def reserve_all(db, telegram_id, attempts):
+    return [(await db.reserve_calculation(telegram_id))[0] for _ in range(attempts)]
+
+
+def test_free_plan_is_limited_per_day(tmp_path):
+    async def scenario():
+        db = await open_db(tmp_path)
+        await db.create_user(1)
+        limit = settings.SUBSCRIPTION_LIMITS['free']
+
+        assert await reserve_all(db, 1, limit + 1) == [True] * limit + [False]
+        assert await db.get_usage(1, 'day') == limit
+        # Отказ не увеличивает счетчики
+        assert await db.get_usage(1, 'month') == limit
+
+        await db.release_calculation(1)
+        assert await db.get_usage(1, 'day') == limit - 1
+        assert await db.get_usage(1, 'month') == limit - 1
+        assert await db.reserve_calculation(1) == (True, 'free')
+        assert await db.reserve_calculation(1) == (False, 'free')
+        await db.close()
+
+    asyncio.run(scenario())
+
+
+def test_paid_plan_is_limited_per_month(tmp_path, monkeypatch):
+    monkeypatch.setitem(settings.SUBSCRIPTION_LIMITS, 'basic', 3)
+
+    async def scenario():
+        db = await open_db(tmp_path)
+        await db.create_user(1)
+        await db.update_user_subscription(1, 'basic', datetime.now() + timedelta(days=30))
+
+        # Дневной лимит бесплатного тарифа к платному не применяется
+        assert await reserve_all(db, 1, 4) == [True, True, True, False]
+        assert await db.get_usage(1, 'month') == 3
+        assert await db.get_usage(1, 'day') == 3
+        assert (await db.get_user(1))['subscription_type'] == 'basic'
+        await db.close()
+
+    asyncio.run(scenario())
+
+
+def test_expired_subscription_falls_back_to_free(tmp_path):
+    async def scenario():
+        db = await open_db(tmp_path)
+        await db.create_user(1)
+        await db.update_user_subscription(1, 'pro', datetime.now() - timedelta(minutes=1))
+
+        assert await db.reserve_calculation(1) == (True, 'free')
+        user = await db.get_user(1)
+        assert user['subscription_type'] == 'free'
+        assert user['subscription_expires'] is None
+        await db.close()
+
+    asyncio.run(scenario())
+
+
+def test_reserve_creates_unknown_user(tmp_path):
+    async def scenario():
+        db = await open_db(tmp_path)
+        assert await db.reserve_calculation(42) == (True, 'free')
+        assert await db.get_user(42) is not None
+        await db.close()
+
+    asyncio.run(scenario())
+
+
+def test_history_pages_in_both_directions(tmp_path):
+    async def scenario():
+        db = await open_db(tmp_path)
+        await db.create_user(1)
+        for number in range(1, 6):
+            await db.save_calculation(1, 'area', room_description=f"комната {number}", area=float(number))
+        await db.flush_writes()
+        # Два расчета в одну секунду: порядок внутри нее задает id
+        async with db.backend.acquire() as conn:
+            await conn.execute("""
+                UPDATE calculations SET created_at =
+                    CASE WHEN id <= 2 THEN '2024-01-01 00:00:00'
+                         ELSE '2024-01-0' || id || ' 00:00:00' END
+            """)
+            await conn.commit()
+
+        def names(page):
+            return [int(item['room_description'].split()[-1]) for item in page['items']]
+
+        first = await db.get_calculation_history(1, limit=2)
+        assert names(first) == [5, 4]
+        assert first['newer_cursor'] is None
+
+        middle = await db.get_calculation_history(1, limit=2, before=first['older_cursor'])
+        assert names(middle) == [3, 2]
+        last = await db.get_calculation_history(1, limit=2, before=middle['older_cursor'])
+        assert names(last) == [1]
+        assert last['older_cursor'] is None
+
+        back = await db.get_calculation_history(1, limit=2, after=last['newer_cursor'])
+        assert names(back) == [3, 2]
+        assert back['older_cursor'] is not None
+        top = await db.get_calculation_history(1, limit=2, after=back['newer_cursor'])
+        assert names(top) == [5, 4]
+        assert top['newer_cursor'] is None
+        await db.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,81 @@
+"""Кэш распознаваний: повтор без запроса к Gemini, refresh пропускает только готовый результат"""
+import asyncio
+import io
+import json
+import os
+
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+from PIL import Image  # noqa: E402
+
+from bot.database.recognition_cache import RecognitionCache  # noqa: E402
+from bot.utils.gemini_api import GeminiRecognizer  # noqa: E402
+
+
+def make_image() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (200, 200), "white").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def make_recognizer(monkeypatch, delay: float = 0.0):
+    recognizer = GeminiRecognizer()
+    recognizer.cache = RecognitionCache(None)
+    calls = []
+
+    async def generate(image, timeout=None):
+        calls.append(timeout)
+        await asyncio.sleep(delay)
+        return json.dumps({"rooms": [{
+            "room_number": 1, "room_type": "rectangle",
+            "measurements": [{"side": "a", "value": 300 + len(calls)}, {"side": "b", "value": 200}]
+        }]})
+
+    monkeypatch.setattr(recognizer, "_generate_with_retries", generate)
+    return recognizer, calls
+
+
+def first_value(result: dict) -> float:
+    return result['rooms'][0]['measurements'][0]['value']
+
+
+def test_refresh_skips_only_cached_result(monkeypatch):
+    recognizer, calls = make_recognizer(monkeypatch)
+    image = make_image()
+
+    async def scenario():
+        first = await recognizer.recognize_measurements(image, file_unique_id="file1")
+        cached = await recognizer.recognize_measurements(image)
+        refreshed = await recognizer.recognize_measurements(image, file_unique_id="file1", refresh=True)
+        by_file = await recognizer.recognize_file("file1")
+        return first, cached, refreshed, by_file
+
+    first, cached, refreshed, by_file = asyncio.run(scenario())
+    assert len(calls) == 2
+    assert first_value(cached) == first_value(first) == 301
+    # Новый результат заменяет прошлый и по содержимому, и по файлу Telegram
+    assert first_value(refreshed) == first_value(by_file) == 302
+
+
+def test_concurrent_requests_share_one_call(monkeypatch):
+    recognizer, calls = make_recognizer(monkeypatch, delay=0.05)
+    image = make_image()
+
+    async def scenario():
+        return await asyncio.gather(*(recognizer.recognize_measurements(image) for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(first_value(result) == 301 for result in results)
+    # У каждого запроса своя копия результата
+    results[0]['rooms'].clear()
+    assert results[1]['rooms']
+
+
+def test_recent_image_is_kept_by_file():
+    recognizer = GeminiRecognizer()
+    recognizer.remember_image("file1", b"image", 42)
+    assert recognizer.recent_image("file1") == (b"image", 42)
+    assert recognizer.recent_image("file2") is None
+    assert recognizer.recent_image(None) is None
@@ -0,0 +1,142 @@
+"""Поиск находит заархивированные расчеты и листается через основную базу и архив"""
+import asyncio
+import os
+import sqlite3
+from contextlib import asynccontextmanager
+
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+from bot.database.models import Database  # noqa: E402
+from bot.handlers.calculation import search_query_key  # noqa: E402
+from bot.keyboards.main import get_search_keyboard  # noqa: E402
+
+
+async def search_all(db, telegram_id, query):
+    """Все результаты поиска, по одному на страницу"""
+    found, cursor = [], None
+    while True:
+        page = await db.search_calculations(telegram_id, query, limit=1, after=cursor)
+        found.extend(item['room_description'] for item in page['items'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            return found
+
+
+def test_search_includes_archived_calculations(tmp_path):
+    archive_path = tmp_path / "archive.db"
+
+    async def scenario():
+        db = Database(url=f"sqlite:///{tmp_path}/bot.db", archive_url=f"sqlite:///{archive_path}")
+        await db.connect()
+        await db.create_tables()
+        await db.create_user(1)
+        await db.save_calculation(1, 'area', room_description="кухня старая", area=9.8)
+        await db.save_calculation(1, 'area', room_description="спальня", area=12.0)
+        await db.flush_writes()
+        async with db.backend.acquire() as conn:
+            await conn.execute("UPDATE calculations SET created_at = '2000-01-01 00:00:00'")
+            await conn.commit()
+        await db.archive_old_calculations(30)
+        await db.save_calculation(1, 'area', room_description="кухня новая", area=10.5)
+
+        found = await search_all(db, 1, "кухня")
+        other_user = await search_all(db, 2, "кухня")
+        await db.close()
+        return found, other_user
+
+    found, other_user = asyncio.run(scenario())
+    # Ранги bm25 разных индексов не сравниваются: архив идет после основной базы
+    assert found == ["кухня новая", "кухня старая"]
+    assert other_user == []
+
+    # Архив, созданный до появления индекса, индексируется при открытии
+    legacy = sqlite3.connect(archive_path)
+    legacy.execute("DROP TABLE calculations_fts")
+    legacy.close()
+
+    async def reopen():
+        db = Database(url=f"sqlite:///{tmp_path}/bot.db", archive_url=f"sqlite:///{archive_path}")
+        await db.connect()
+        found = await search_all(db, 1, "старая")
+        await db.close()
+        return found
+
+    assert asyncio.run(reopen()) == ["кухня старая"]
+
+
+class PostgresShapedConnection:
+    """Соединение SQLite, которое выполняет запросы ветки PostgreSQL и проверяет типы параметров"""
+
+    def __init__(self, conn, bound):
+        self.conn = conn
+        self.bound = bound
+
+    async def execute(self, sql, params=()):
+        # В PostgreSQL score - bigint: курсор должен передавать целые числа
+        self.bound.extend(params)
+        return await self.conn.execute(sql.replace(" ILIKE ", " LIKE "), params)
+
+
+class PostgresShapedBackend:
+    """Хранилище SQLite с диалектом 'postgres' для проверки запроса поиска"""
+
+    dialect = "postgres"
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.bound = []
+
+    @property
+    def is_open(self):
+        return self.backend.is_open
+
+    @asynccontextmanager
+    async def acquire(self, readonly: bool = False):
+        async with self.backend.acquire(readonly=readonly) as conn:
+            yield PostgresShapedConnection(conn, self.bound)
+
+
+def test_search_pages_through_postgres_query(tmp_path):
+    async def scenario():
+        db = Database(url=f"sqlite:///{tmp_path}/bot.db")
+        await db.connect()
+        await db.create_tables()
+        await db.create_user(1)
+        for index in range(5):
+            await db.save_calculation(1, 'area', room_description=f"кухня {index}", area=9.8)
+        await db.flush_writes()
+
+        shaped = PostgresShapedBackend(db.backend)
+        db.backends[0] = db.backend = shaped
+        found, cursors, cursor = [], [], None
+        while True:
+            page = await db.search_calculations(1, "кухня", limit=2, after=cursor)
+            found.extend(item['room_description'] for item in page['items'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+            cursors.append(cursor)
+        db.backends[0] = db.backend = shaped.backend
+        await db.close()
+        return found, cursors, shaped.bound
+
+    found, cursors, bound = asyncio.run(scenario())
+    # Новые расчеты выше, страницы не теряют и не повторяют строки
+    assert found == [f"кухня {index}" for index in reversed(range(5))]
+    assert len(cursors) == 2
+    assert not any(isinstance(value, float) for value in bound)
+
+
+def test_search_cursor_keeps_large_postgres_ids():
+    calc_id = 2 ** 60 + 1
+    cursor = Database.make_search_cursor({'store': 0, 'score': -calc_id, 'id': calc_id})
+    assert Database.parse_search_cursor(cursor, 'postgres') == (0, -calc_id, calc_id)
+
+
+def test_search_button_fits_callback_data():
+    cursor = Database.make_search_cursor({'store': 1, 'score': -1.2345678901234567e-05, 'id': 2 ** 40})
+    keyboard = get_search_keyboard(search_query_key("кухня " * 50), cursor)
+    data = keyboard.inline_keyboard[0][0].callback_data
+    assert data.startswith(f"find:{search_query_key('кухня ' * 50)}:")
+    assert len(data.encode("utf-8")) <= 64
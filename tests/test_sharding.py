@@ -0,0 +1,81 @@
+"""Перенос пользователей между шардами не теряет строки с занятыми id"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+from bot.database.models import Database  # noqa: E402
+
+
+def test_redistribute_keeps_users_and_payments(tmp_path):
+    url = f"sqlite:///{tmp_path}/bot.db"
+    users = range(1, 21)
+
+    async def scenario():
+        db = Database(url=url, shards=2)
+        await db.connect()
+        await db.create_tables()
+        for telegram_id in users:
+            await db.create_user(telegram_id, f"user{telegram_id}")
+            await db.update_user_subscription(telegram_id, 'pro', datetime.now() + timedelta(days=30))
+            await db.save_payment(telegram_id, f"payment{telegram_id}", 'pro', 399)
+        await db.close()
+
+        # Изменили количество шардов: у строк в разных шардах совпадают id
+        db = Database(url=url, shards=3)
+        await db.connect()
+        await db.create_tables()
+        await db.redistribute_shards()
+
+        lost = []
+        for telegram_id in users:
+            user = await db.get_user(telegram_id)
+            if not user or user['subscription_type'] != 'pro':
+                lost.append(telegram_id)
+
+        payments = 0
+        for shard in range(db.shard_count):
+            async with db._acquire(readonly=True, shard=shard) as conn:
+                cursor = await conn.execute("SELECT COUNT(*) FROM payments")
+                payments += (await cursor.fetchone())[0]
+        await db.close()
+        return lost, payments
+
+    lost, payments = asyncio.run(scenario())
+    assert lost == []
+    assert payments == len(users)
+
+
+def test_archive_keeps_recognitions_from_all_shards(tmp_path):
+    async def scenario():
+        db = Database(url=f"sqlite:///{tmp_path}/bot.db", shards=3,
+                      archive_url=f"sqlite:///{tmp_path}/archive.db")
+        await db.connect()
+        await db.create_tables()
+        for telegram_id in range(1, 10):
+            await db.create_user(telegram_id)
+            await db.save_calculation(telegram_id, 'area', measurements=[350, 280], area=9.8,
+                                      recognized_data={'rooms': [{'owner': telegram_id}]})
+        await db.flush_writes()
+
+        # У распознаваний в разных шардах совпадают id
+        for shard in range(db.shard_count):
+            async with db._acquire(shard=shard) as conn:
+                await conn.execute("UPDATE calculations SET created_at = '2000-01-01 00:00:00'")
+                await conn.commit()
+        await db.archive_old_calculations(30)
+
+        owners = {}
+        for telegram_id in range(1, 10):
+            history = await db.get_calculation_history(telegram_id)
+            for item in history['items']:
+                calculation = await db.get_calculation(item['id'], telegram_id)
+                data = calculation.get('recognized_data')
+                owners[telegram_id] = data and data['rooms'][0]['owner']
+        await db.close()
+        return owners
+
+    owners = asyncio.run(scenario())
+    assert owners == {telegram_id: telegram_id for telegram_id in range(1, 10)}
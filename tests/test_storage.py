@@ -0,0 +1,154 @@
+"""Кэш, пакетная загрузка, отложенная запись, кодек и общий срок операций"""
+import asyncio
+import os
+import sqlite3
+from contextlib import asynccontextmanager
+
+import pytest
+
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+from bot.database import codec  # noqa: E402
+from bot.database.backends import create_backend  # noqa: E402
+from bot.database.cache import TTLCache  # noqa: E402
+from bot.database.loader import BatchLoader  # noqa: E402
+from bot.database.write_behind import WriteBehindQueue  # noqa: E402
+from bot.utils.deadline import Deadline  # noqa: E402
+
+
+def test_cache_evicts_least_recently_used(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("bot.database.cache.time.monotonic", lambda: now[0])
+    cache = TTLCache(maxsize=2, ttl=10)
+
+    cache.set("a", 1)
+    cache.set("b", None)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    # "b" дольше всего не читали; закэшированный None отличается от промаха
+    assert cache.get("b") is TTLCache.MISSING
+    assert cache.get("a") == 1
+
+    cache.set("d", None)
+    assert cache.get("d") is None
+    now[0] += 10
+    assert cache.get("a", "нет") == "нет"
+    assert len(cache) == 1
+
+
+def test_batch_loader_coalesces_concurrent_loads():
+    calls = []
+
+    async def fetch(keys):
+        calls.append(sorted(keys))
+        return {key: key * 10 for key in keys if key != 3}
+
+    async def scenario():
+        loader = BatchLoader(fetch)
+        results = await asyncio.gather(*(loader.load(key) for key in (1, 2, 1, 3)))
+        assert results == [10, 20, 10, None]
+        assert calls == [[1, 2, 3]]
+
+        # Следующий проход цикла событий - новая пачка
+        assert await loader.load(1) == 10
+        assert calls == [[1, 2, 3], [1]]
+        assert loader.stats()['batches'] == 2
+
+    asyncio.run(scenario())
+
+
+def test_batch_loader_passes_errors_to_every_waiter():
+    async def fetch(keys):
+        raise RuntimeError("база недоступна")
+
+    async def scenario():
+        loader = BatchLoader(fetch)
+        results = await asyncio.gather(loader.load(1), loader.load(2), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+    asyncio.run(scenario())
+
+
+def test_write_behind_flushes_in_order_and_survives_bad_rows(tmp_path):
+    async def scenario():
+        backend = create_backend(f"sqlite:///{tmp_path}/queue.db", pool_size=1)
+        await backend.connect()
+        async with backend.acquire() as db:
+            await db.execute("CREATE TABLE log (id INTEGER PRIMARY KEY AUTOINCREMENT, value TEXT NOT NULL)")
+            await db.commit()
+
+        queue = WriteBehindQueue(backend.acquire, flush_interval=0.01, max_batch=100)
+        queue.start()
+        for value in ("a", "b", None, "c"):
+            queue.enqueue("INSERT INTO log (value) VALUES (?)", (value,))
+        assert queue.pending == 4
+        await queue.stop()
+
+        assert queue.pending == 0
+        assert queue.failed_rows == 1
+        async with backend.acquire(readonly=True) as db:
+            cursor = await db.execute("SELECT value FROM log ORDER BY id")
+            assert [row[0] for row in await cursor.fetchall()] == ["a", "b", "c"]
+        await backend.close()
+
+    asyncio.run(scenario())
+
+
+def test_write_behind_keeps_batch_when_database_is_down():
+    @asynccontextmanager
+    async def broken():
+        raise sqlite3.OperationalError("database is locked")
+        yield
+
+    async def scenario():
+        queue = WriteBehindQueue(broken)
+        queue.enqueue("INSERT INTO log (value) VALUES (?)", ("a",))
+        with pytest.raises(sqlite3.OperationalError):
+            await queue.flush()
+        assert queue.pending == 1
+
+    asyncio.run(scenario())
+
+
+def test_codec_round_trip_by_version_byte():
+    small = {"notes": "кухня", "walls": [1.5, 2]}
+    large = {"walls": [{"length": 3.25, "label": "стена"}] * 50}
+
+    assert codec.encode(None) is None
+    raw = codec.encode(small)
+    assert raw[0] == codec.CompactJSONCodec.version
+    assert codec.decode(raw) == small
+
+    raw = codec.encode(large)
+    assert raw[0] == codec.ZlibJSONCodec.version
+    assert len(raw) < len(codec.dumps(large).encode())
+    assert codec.decode(raw) == large
+
+    # Старые версии бота хранили JSON текстом
+    assert codec.is_legacy('{"a": 1}')
+    assert codec.decode('{"a": 1}') == {"a": 1}
+    with pytest.raises(ValueError):
+        codec.decode(b"\xff{}")
+
+
+def test_deadline_cancels_slow_stage_and_skips_the_rest():
+    async def scenario():
+        deadline = Deadline(0.05)
+        assert await deadline.run(asyncio.sleep(0, result="ok")) == "ok"
+        assert deadline.budget(0.01) == pytest.approx(0.01)
+
+        with pytest.raises(asyncio.TimeoutError):
+            await deadline.run(asyncio.sleep(1))
+        assert deadline.expired
+
+        started = []
+
+        async def stage():
+            started.append(True)
+
+        with pytest.raises(asyncio.TimeoutError):
+            await deadline.run(stage())
+        assert started == []
+
+    asyncio.run(scenario())
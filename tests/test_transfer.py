@@ -0,0 +1,63 @@
+"""Перенос данных забирает все шарды и заново строит поисковый индекс"""
+import asyncio
+import os
+
+import pytest
+
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+from bot.database.models import Database  # noqa: E402
+from bot.database.transfer import transfer  # noqa: E402
+
+USERS = range(1, 9)
+
+
+async def fill_sharded(url):
+    db = Database(url=url, shards=2)
+    await db.connect()
+    await db.create_tables()
+    for telegram_id in USERS:
+        await db.create_user(telegram_id)
+        await db.save_calculation(telegram_id, 'area', room_description=f"кухня {telegram_id}", area=9.8)
+        await db.save_payment(telegram_id, f"pay-{telegram_id}", 'basic', 100.0)
+    await db.flush_writes()
+    assert {db._shard_of(telegram_id) for telegram_id in USERS} == {0, 1}
+    await db.close()
+
+
+def test_transfer_copies_every_shard_and_rebuilds_search(tmp_path):
+    source = f"sqlite:///{tmp_path}/source.db"
+    target = f"sqlite:///{tmp_path}/target.db"
+
+    async def scenario():
+        await fill_sharded(source)
+        counts = await transfer(source, target, source_shards=2)
+        assert counts['users'] == len(USERS)
+        assert counts['calculations'] == len(USERS)
+        assert counts['calculations_fts'] == len(USERS)
+
+        db = Database(url=target)
+        await db.connect()
+        await db.create_tables()
+        for telegram_id in USERS:
+            assert await db.get_user(telegram_id) is not None
+            page = await db.search_calculations(telegram_id, "кухня")
+            assert [item['room_description'] for item in page['items']] == [f"кухня {telegram_id}"]
+        async with db.backend.acquire() as conn:
+            cursor = await conn.execute("SELECT COUNT(*) FROM payments")
+            assert (await cursor.fetchone())[0] == len(USERS)
+        await db.close()
+
+    asyncio.run(scenario())
+
+
+def test_transfer_refuses_to_skip_shards(tmp_path):
+    source = f"sqlite:///{tmp_path}/source.db"
+
+    async def scenario():
+        await fill_sharded(source)
+        with pytest.raises(ValueError):
+            await transfer(source, f"sqlite:///{tmp_path}/target.db")
+
+    asyncio.run(scenario())